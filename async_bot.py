@@ -0,0 +1,450 @@
+"""
+Асинхронный запуск бота на AsyncTeleBot.
+
+Те же обработчики, что и в bot.py, но вызовы Telegram и API котиков
+ожидаются через await, а блокирующая работа с SQLite выполняется
+в ограниченном пуле потоков. Решения обработчиков (тексты, проверки
+сессий, разбор и запись трат, статистика) общие с bot.py и лежат
+в bot_common, здесь только отправка ответов. Запуск: python async_bot.py
+
+Отличия от bot.py:
+    - /cat берет котика из буфера CatPrefetcher, а при пустом буфере
+      запрашивает API через общую сессию aiohttp, с тем же выключателем;
+    - /profile не поддерживается: cProfile не разделяет корутины одного
+      потока, команда отвечает PROFILE_ASYNC_TEXT;
+    - обновления чатов не раздаются по шардам, каждое - своя задача.
+"""
+import asyncio
+import contextvars
+import functools
+import time
+import os
+import log
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from dotenv import load_dotenv
+from telebot import types, asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+from database_handler import check_user_exists
+from config import (EXPORT_GZIP, DB_EXECUTOR_WORKERS,
+                    METRICS_HOST, METRICS_PORT, METRICS_DUMP_PATH,
+                    METRICS_DUMP_INTERVAL, TRACE_PATH, TRACE_SAMPLE_RATE,
+                    TRACE_SLOW_MS)
+from cat_api import get_cat_img_async, prefetcher
+from cat_files import (get_file_id, save_file_id, next_cached_file_id,
+                       load_file_ids)
+from connection import manager, writer
+from migrations import migrate
+from cache import warm_categories
+from write_queue import WriteBehindQueue
+from webhook import WebhookServer
+from metrics import (track_handler, install_async_telegram_timing,
+                     start_metrics)
+from tracing import tracer, trace
+from dispatcher import update_chat_id
+from exporter import make_export, remove_export
+from category_memo import pending, categories, remember_saved, learn
+from sessions import (UserSession, StatsSession, user_status, for_user_stats,
+                      sweeper, load_sessions)
+from bot_common import (COMMANDS, HELP_TEXT, CAT_ERROR_TEXT,
+                        SAVE_ERROR_TEXT, EXPORT_EMPTY_TEXT, EXPORT_ERROR_TEXT,
+                        ITEMS_EMPTY_TEXT, RECAT_EXPIRED_TEXT,
+                        RECAT_ERROR_TEXT, RECAT_SAVING_TEXT,
+                        NO_EXPENSES_TEXT, STATS_MENU_TEXT,
+                        STATS_CUSTOM_TEXT, PROFILE_ASYNC_TEXT, SKIP_TEXTS,
+                        saved_items_text, recategorize_keyboard,
+                        categories_keyboard,
+                        start_text, create_stats_keyboard, period_text,
+                        button_period, custom_period, statistics_reply,
+                        text_refusal, save_expenses)
+
+logging.getLogger("telebot").setLevel(logging.WARNING)
+logging.getLogger("aiohttp").setLevel(logging.WARNING)
+
+load_dotenv()
+
+secret_token = os.getenv('TOKEN')
+write_behind = os.getenv('WRITE_BEHIND') == '1'
+# Если задан WEBHOOK_URL, обновления принимаются через webhook.
+webhook_url = os.getenv('WEBHOOK_URL')
+webhook_secret = os.getenv('WEBHOOK_SECRET', '')
+# Адрес Bot API можно подменить, например на локальный сервер loadtest.py.
+if os.getenv('TELEGRAM_API_URL'):
+    asyncio_helper.API_URL = os.getenv('TELEGRAM_API_URL')
+install_async_telegram_timing()
+bot = AsyncTeleBot(token=secret_token)
+
+db_executor = ThreadPoolExecutor(
+    max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix='db')
+http_session = None
+write_queue = None
+
+
+async def run_db(func, *args):
+    """Выполняет блокирующую функцию работы с базой в пуле потоков."""
+    loop = asyncio.get_running_loop()
+    # Пул не переносит contextvars, без копии SQL выпал бы из трассы.
+    call = functools.partial(contextvars.copy_context().run, func, *args)
+    return await loop.run_in_executor(db_executor, call)
+
+
+_process_new_updates = bot.process_new_updates
+
+
+async def process_update(update):
+    """Обрабатывает одно обновление в его собственной трассе."""
+    with trace('update', update_id=update.update_id,
+               chat_id=update_chat_id(update)):
+        await _process_new_updates([update])
+
+
+async def process_new_updates(updates):
+    # Каждое обновление - отдельная задача со своей копией контекста.
+    await asyncio.gather(*(process_update(update) for update in updates))
+
+
+bot.process_new_updates = process_new_updates
+
+
+async def fetch_cat():
+    """Прямой запрос котика, когда буфер пуст и выключатель пускает."""
+    if not prefetcher.breaker.allow():
+        return False
+    new_cat = await get_cat_img_async(http_session)
+    if new_cat:
+        prefetcher.breaker.success()
+    else:
+        prefetcher.breaker.failure()
+    return new_cat
+
+
+@bot.message_handler(commands=['cat'])
+@track_handler
+async def cat(message):
+    new_cat = prefetcher.get(direct=False)
+    # Известную картинку отправляем по file_id, а если буфер пуст
+    # (API недоступно или медленное) - берем картинку из кэша по кругу.
+    if new_cat:
+        photo = await run_db(get_file_id, new_cat)
+    else:
+        photo = next_cached_file_id()
+    if photo is None and not new_cat:
+        new_cat = await fetch_cat()
+    if photo is not None:
+        await bot.send_photo(message.chat.id, photo)
+    elif new_cat:
+        sent = await bot.send_photo(message.chat.id, new_cat)
+        if sent and sent.photo:
+            await run_db(save_file_id, new_cat, sent.photo[-1].file_id)
+    else:
+        await bot.send_message(message.chat.id, CAT_ERROR_TEXT)
+
+
+@bot.message_handler(commands=['start'])
+@track_handler
+async def handle_start(message):
+
+    user_status[message.chat.id] = UserSession(
+        login=message.chat.username, active=True, time=time.time())
+
+    await bot.send_message(
+        chat_id=message.chat.id,
+        text=start_text(message.chat.first_name),
+        parse_mode='HTML',
+        reply_markup=types.ReplyKeyboardRemove()
+    )
+    logging.debug('Сообщение функции handle_start отправлено')
+
+
+@bot.message_handler(commands=['help'])
+@track_handler
+async def handle_help(message):
+    await bot.send_message(
+        chat_id=message.chat.id,
+        text=HELP_TEXT,
+        parse_mode='Markdown'
+    )
+    logging.debug('Сообщение функции handle_help отправлено')
+
+
+@bot.message_handler(commands=['profile'])
+@track_handler
+async def handle_profile(message):
+    await bot.send_message(message.chat.id, PROFILE_ASYNC_TEXT)
+
+
+@bot.message_handler(commands=['stats'])
+@track_handler
+async def handle_stats(message):
+    """Обработчик команды /stats"""
+    chat_id = message.chat.id
+    username = message.chat.username
+    logging.debug('Запрос статистики')
+
+    # Проверяем есть ли пользователь в базе
+    if not await run_db(check_user_exists, username):
+        await bot.send_message(chat_id, NO_EXPENSES_TEXT,
+                               reply_markup=types.ReplyKeyboardRemove())
+        return
+
+    for_user_stats[chat_id] = StatsSession(
+        username=username, state='stats_menu')
+    await bot.send_message(chat_id, STATS_MENU_TEXT, parse_mode='Markdown',
+                           reply_markup=create_stats_keyboard())
+    logging.debug('Показали в ТГ окно выбора периода')
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('stats_'))
+@track_handler
+async def handle_stats_callback(call):
+    """Обработчик callback от кнопок статистики"""
+    chat_id = call.message.chat.id
+    message_id = call.message.message_id
+    username = call.message.chat.username
+
+    if call.data == 'stats_custom':
+        # Состояние ставится до ответа: даты могут прийти сразу после него.
+        for_user_stats[chat_id] = StatsSession(
+            username=username, state='waiting_dates')
+        await bot.edit_message_text(STATS_CUSTOM_TEXT, chat_id, message_id,
+                                    parse_mode='Markdown')
+        logging.debug('Выбор произвольного периода')
+
+    elif call.data in ('stats_week', 'stats_month'):
+        title, period_data = button_period(call.data, username)
+        await bot.edit_message_text(period_text(title, period_data), chat_id,
+                                    message_id, parse_mode='Markdown')
+        logging.debug(f'Выбор статистики: {period_data['period_type']}')
+        await process_statistics(chat_id, period_data)
+
+    elif call.data == 'stats_back':
+        await bot.edit_message_text(STATS_MENU_TEXT, chat_id, message_id,
+                                    parse_mode='Markdown',
+                                    reply_markup=create_stats_keyboard())
+        for_user_stats.update(chat_id, state='stats_menu')
+        logging.debug('Возврат внутри выбора периода статистики')
+
+    elif call.data == 'stats_cancel':
+        await bot.delete_message(chat_id, message_id)
+        for_user_stats.pop(chat_id)
+        logging.debug('Отмена выбора статистики')
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('recat'))
+@track_handler
+async def handle_recategorize(call):
+    """Смена категории сохраненной траты кнопками под ответом."""
+    chat_id = call.message.chat.id
+    message_id = call.message.message_id
+    saved = pending.get((chat_id, message_id))
+    if saved is None:
+        await bot.answer_callback_query(call.id, RECAT_EXPIRED_TEXT)
+        await bot.edit_message_reply_markup(
+            chat_id, message_id, reply_markup=None)
+        return
+    login, records, product_ids = saved
+    action, *args = call.data.split(':')
+
+    if action == 'recat':
+        index = int(args[0])
+        if index >= len(product_ids):
+            # Отложенная запись еще не вернула id траты.
+            await bot.answer_callback_query(call.id, RECAT_SAVING_TEXT)
+            return
+        await bot.edit_message_reply_markup(
+            chat_id, message_id,
+            reply_markup=categories_keyboard(
+                product_ids[index], await run_db(categories)))
+        await bot.answer_callback_query(call.id)
+
+    elif action == 'recat_set':
+        product_id, category_id = int(args[0]), int(args[1])
+        if product_id not in product_ids:
+            await bot.answer_callback_query(call.id, RECAT_EXPIRED_TEXT)
+            return
+        index = product_ids.index(product_id)
+        try:
+            category = await run_db(learn, login, product_id, category_id)
+        except Exception as e:
+            logging.error(f'Ошибка смены категории: {e}')
+            await bot.answer_callback_query(call.id, RECAT_ERROR_TEXT)
+            return
+        if category is None:
+            await bot.answer_callback_query(call.id, RECAT_ERROR_TEXT)
+            return
+        records[index] = records[index][:3] + (category,)
+        await bot.edit_message_text(
+            saved_items_text(records), chat_id, message_id,
+            reply_markup=recategorize_keyboard(records))
+        await bot.answer_callback_query(call.id, f'Категория: {category}')
+        logging.debug(f'Категория траты сменена на {category}')
+
+    elif action == 'recat_cancel':
+        await bot.edit_message_reply_markup(
+            chat_id, message_id, reply_markup=recategorize_keyboard(records))
+        await bot.answer_callback_query(call.id)
+
+
+@bot.message_handler(
+        func=lambda message:
+        getattr(for_user_stats.get(message.chat.id), 'state', None) == 'waiting_dates'
+)
+@track_handler
+async def handle_custom_dates(message):
+    """Обработчик произвольного периода"""
+    chat_id = message.chat.id
+    period_data, error = custom_period(chat_id, message.text)
+    if error is not None:
+        await bot.send_message(chat_id, error, parse_mode='Markdown')
+        return
+    await bot.send_message(
+        chat_id, period_text('📅 *Выбран период:*', period_data),
+        parse_mode='Markdown')
+    await process_statistics(chat_id, period_data)
+    for_user_stats.pop(chat_id)
+
+
+@bot.message_handler(commands=['export'])
+@track_handler
+async def handle_export(message):
+    """Отправляет всю историю трат файлом CSV."""
+    chat_id = message.chat.id
+    try:
+        export = await run_db(make_export, message.chat.username, EXPORT_GZIP)
+    except Exception as e:
+        logging.error(f'Ошибка выгрузки трат: {e}')
+        await bot.send_message(chat_id, EXPORT_ERROR_TEXT)
+        return
+    if export is None:
+        await bot.send_message(chat_id, EXPORT_EMPTY_TEXT)
+        return
+    path, name, rows = export
+    try:
+        with open(path, 'rb') as file:
+            await bot.send_document(
+                chat_id, file, visible_file_name=name,
+                caption=f'📤 Выгружено трат: {rows}')
+        logging.debug(f'Выгрузка {name} отправлена')
+    except Exception as e:
+        logging.error(f'Ошибка отправки выгрузки {name}: {e}')
+        await bot.send_message(chat_id, EXPORT_ERROR_TEXT)
+    finally:
+        await run_db(remove_export, path)
+
+
+async def process_statistics(chat_id, period_data):
+    """Обрабатывает статистику и отправляет результат"""
+    text, parse_mode = await run_db(statistics_reply, period_data)
+    await bot.send_message(chat_id, text, parse_mode=parse_mode)
+
+
+@bot.message_handler(content_types=['text'])
+@track_handler
+async def handle_text(message):
+    chat_id = message.chat.id
+    if message.text in SKIP_TEXTS:
+        return
+    refusal = text_refusal(chat_id, message.chat.username)
+    if refusal is not None:
+        await bot.send_message(chat_id=chat_id, text=refusal)
+        return
+    try:
+        # Выученные категории могут читаться из базы.
+        product_ids = []
+        records = await run_db(
+            save_expenses, chat_id, message.chat.username, message.text,
+            write_queue, product_ids)
+        if not records:
+            await bot.send_message(chat_id=chat_id, text=ITEMS_EMPTY_TEXT)
+            return
+        reply = await bot.send_message(
+            chat_id=chat_id, text=saved_items_text(records),
+            reply_markup=recategorize_keyboard(records))
+        remember_saved(chat_id, reply.message_id, message.chat.username,
+                       records, product_ids)
+        logging.debug(f'Траты сохранены: {len(records)}')
+    except Exception as e:
+        logging.error(f'Ошибка сохранения в базу {e}')
+        await bot.send_message(chat_id=chat_id, text=SAVE_ERROR_TEXT)
+
+
+async def serve_webhook(loop):
+    """Принимает обновления webhook, пока задачу не отменят."""
+    server = WebhookServer(
+        # Сервер работает в своих потоках, обработка - в цикле событий.
+        process=lambda update: asyncio.run_coroutine_threadsafe(
+            process_new_updates([types.Update.de_json(update)]), loop),
+        secret=webhook_secret,
+        host=os.getenv('WEBHOOK_HOST', '0.0.0.0'),
+        port=int(os.getenv('WEBHOOK_PORT', 8443)),
+    )
+    await bot.remove_webhook()
+    await bot.set_webhook(url=webhook_url, secret_token=webhook_secret)
+    server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.stop()
+
+
+async def main():
+    global http_session, write_queue
+    loop = asyncio.get_running_loop()
+
+    def report_write_error(chat_id, error):
+        # Вызывается из потока записи, поэтому передаем отправку в цикл.
+        asyncio.run_coroutine_threadsafe(
+            bot.send_message(chat_id=chat_id, text=SAVE_ERROR_TEXT), loop)
+
+    with writer() as con:
+        migrate(con)
+        warm_categories(con)
+    load_sessions()
+    load_file_ids()
+    prefetcher.start()
+    sweeper.start()
+    metrics_services = start_metrics(
+        METRICS_HOST, int(os.getenv('METRICS_PORT', METRICS_PORT)),
+        os.getenv('METRICS_DUMP_PATH', METRICS_DUMP_PATH),
+        METRICS_DUMP_INTERVAL)
+    tracer.start(
+        os.getenv('TRACE_PATH', TRACE_PATH),
+        float(os.getenv('TRACE_SAMPLE_RATE', TRACE_SAMPLE_RATE)),
+        float(os.getenv('TRACE_SLOW_MS', TRACE_SLOW_MS)))
+    if write_behind:
+        write_queue = WriteBehindQueue(on_error=report_write_error)
+        write_queue.start()
+
+    async with aiohttp.ClientSession() as session:
+        http_session = session
+        try:
+            await bot.set_my_commands(COMMANDS)
+            if webhook_url:
+                await serve_webhook(loop)
+            else:
+                await bot.polling(non_stop=True, timeout=10)
+        finally:
+            prefetcher.stop()
+            sweeper.stop()
+            for service in metrics_services:
+                service.stop()
+            tracer.stop()
+            if write_queue is not None:
+                await run_db(write_queue.stop)
+            await bot.close_session()
+            db_executor.shutdown(wait=True)
+            manager.close()
+
+
+if __name__ == "__main__":
+    if webhook_url and not webhook_secret:
+        logging.error('WEBHOOK_URL задан без WEBHOOK_SECRET')
+        raise SystemExit(
+            'Webhook режим требует WEBHOOK_SECRET: без него сервер '
+            'примет обновления от кого угодно.')
+    logging.info("Асинхронный бот запущен")
+    print('Бот запущен!')
+    asyncio.run(main())
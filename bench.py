@@ -0,0 +1,258 @@
+"""
+Замеры горячих путей бота на синтетических данных.
+
+Меряется:
+- пропускная способность data_parse_many, как его зовет бот: с кэшем
+  выученных категорий (category_memo) перед шаблонами. Строки корпуса
+  other у пользователя выучены и проходят мимо шаблонов. Старый
+  data_parse без словаря остается базовой колонкой для сравнения;
+- base_insert по одной записи и insert_parsed_many пачками;
+- задержка get_expenses_statistics и get_total_statistics на базах
+  разного размера, без кэша статистики и с ним.
+
+Базы строит datagen.py во временном каталоге, рабочая asla.sqlite
+не трогается.
+Результаты пишутся в JSON. С --compare печатаются метрики,
+ухудшившиеся относительно прошлого запуска больше чем на --threshold.
+
+Запуск:
+    python bench.py --sizes 10000,1000000,10000000 -o bench.json
+    python bench.py --sizes 10000 --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3 as sq
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import log
+import logging
+
+from cache import login_ids, category_ids, stats_cache, warm_categories
+from category_memo import memo, normalize_title
+from config import WRITE_BATCH_SIZE
+from connection import manager, writer
+from data_income import data_parse, data_parse_many
+from datagen import generate
+from database import base_insert, insert_parsed_many
+from database_handler import get_expenses_statistics, get_total_statistics
+
+# Строки, для которых классификатор находит категорию
+CORPUS = [
+    'мясо 1500', 'молоко хлеб 230', 'пятёрочка продукты 2450',
+    'кофе с собой 250', 'обед в столовой 420', 'доставка пиццы 990',
+    'такси домой 640', 'метро проездной 2900', 'бензин 95 3000',
+    'кино на вечер 700', 'концерт билеты 4500', 'квартплата 7800',
+    'интернет за месяц 650', 'электричество 1200', 'кроссовки 6990',
+    'футболка 1200', 'стоматолог 5000', 'анализы в клинике 2300',
+    'аптека лекарства 870', 'курсы английского 9000', 'учебник 650',
+    'стиральный порошок 450', 'шиномонтаж 2400', 'стрижка 1500',
+    'маникюр 2000', 'авиабилеты 18000', 'гостиница 6400',
+    'кредит платеж 15000', 'ипотека 32000', 'салат и сок 380',
+]
+# Строки, которые проходят все шаблоны и попадают в other
+OTHER_CORPUS = [
+    'что-то по мелочи 150', 'подарок коллеге 1000', 'разное 300',
+    'перевод другу 2000', 'непонятная покупка 450', 'всякое 90',
+]
+LOGINS = 100
+DAYS = 365
+# Пользователь базы datagen.py, от имени которого идет разбор
+PARSE_LOGIN = 'user0'
+
+
+def timed(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def percentiles(samples: list[float]) -> dict:
+    """p50/p95/max в миллисекундах."""
+    ordered = sorted(samples)
+    return {
+        'p50_ms': statistics.median(ordered) * 1000,
+        'p95_ms': ordered[int(len(ordered) * 0.95) - 1] * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def use_database(path: str, size: int = 0) -> None:
+    """Создает базу на size трат и переключает на нее соединения и кэши."""
+    manager.close()
+    generate(path, logins=LOGINS, products=size // LOGINS, days=DAYS)
+    manager.database = path
+    for cache in (login_ids, category_ids, stats_cache):
+        cache.clear()
+    with writer() as con:
+        warm_categories(con)
+
+
+def learn_other(login: str) -> None:
+    """Записывает пользователю выученные категории строк OTHER_CORPUS."""
+    with writer() as con:
+        login_id = con.execute(
+            'SELECT id FROM logins WHERE name = ?', (login,)).fetchone()[0]
+        category_id = con.execute(
+            'SELECT id FROM categories ORDER BY id LIMIT 1').fetchone()[0]
+        con.executemany(
+            'INSERT OR REPLACE INTO category_memo'
+            '(login_id, title, category_id) VALUES(?, ?, ?)',
+            [(login_id, normalize_title(text.rsplit(' ', 1)[0]), category_id)
+             for text in OTHER_CORPUS])
+    login_ids.put(login, login_id)
+    memo.clear()
+
+
+def bench_parse(iterations: int) -> dict:
+    """Разбор на текущей базе: data_parse_many и базовый data_parse."""
+    learn_other(PARSE_LOGIN)
+    results = {}
+    for suffix, corpus in (('', CORPUS), ('_other', OTHER_CORPUS)):
+        items = [{'login': PARSE_LOGIN, 'staf': corpus[number % len(corpus)]}
+                 for number in range(iterations)]
+        # Первый проход заполняет кэш memo, как у работающего бота.
+        for item in items[:len(corpus)]:
+            data_parse_many(item)
+        for func in (data_parse_many, data_parse):
+            elapsed = timed(lambda: [func(item) for item in items])
+            results[f'{func.__name__}{suffix}'] = {
+                'ops': iterations, 'ops_per_s': iterations / elapsed}
+    return results
+
+
+def bench_insert(count: int) -> dict:
+    items = [{'login': f'user{number % LOGINS}',
+              'staf': CORPUS[number % len(CORPUS)]} for number in range(count)]
+    elapsed = timed(lambda: [base_insert(item) for item in items])
+    results = {'base_insert': {'ops': count, 'ops_per_s': count / elapsed}}
+
+    records = [data_parse(item) for item in items * 10]
+    batches = [records[start:start + WRITE_BATCH_SIZE]
+               for start in range(0, len(records), WRITE_BATCH_SIZE)]
+    elapsed = timed(lambda: [insert_parsed_many(batch) for batch in batches])
+    results['insert_parsed_many'] = {
+        'ops': len(records), 'batch_size': WRITE_BATCH_SIZE,
+        'ops_per_s': len(records) / elapsed}
+    return results
+
+
+def bench_statistics(repeat: int) -> dict:
+    today = datetime.now(timezone.utc).date()
+    periods = {
+        'week': today - timedelta(days=6),
+        'month': today - timedelta(days=29),
+        'year': today - timedelta(days=DAYS - 1),
+    }
+    results = {}
+    for name, start in periods.items():
+        for func in (get_expenses_statistics, get_total_statistics):
+            cold, warm = [], []
+            for number in range(repeat):
+                period = {'username': f'user{number % LOGINS}',
+                          'start_date': start.strftime('%d.%m.%Y'),
+                          'end_date': today.strftime('%d.%m.%Y')}
+                stats_cache.clear()
+                cold.append(timed(func, period))
+                warm.append(timed(func, period))
+            results[f'{func.__name__}_{name}'] = {
+                'cold': percentiles(cold), 'cached': percentiles(warm)}
+    return results
+
+
+def run(sizes: list[int], repeat: int, parse_ops: int,
+        insert_ops: int) -> dict:
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    report = {
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'sqlite': sq.sqlite_version,
+        'results': {},
+    }
+    try:
+        use_database(os.path.join(workdir, 'insert.sqlite'))
+        report['results'].update(bench_parse(parse_ops))
+        report['results'].update(bench_insert(insert_ops))
+
+        for size in sizes:
+            started = time.perf_counter()
+            use_database(os.path.join(workdir, f'stats_{size}.sqlite'), size)
+            print(f'База на {size} строк заполнена за '
+                  f'{time.perf_counter() - started:.1f} с')
+            report['results'][f'statistics_{size}'] = bench_statistics(repeat)
+            manager.close()
+            for name in os.listdir(workdir):
+                if name.startswith(f'stats_{size}.'):
+                    os.remove(os.path.join(workdir, name))
+    finally:
+        manager.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def flatten(results: dict, prefix: str = '') -> dict:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        else:
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare(previous: dict, current: dict, threshold: float) -> list[str]:
+    """Метрики, ухудшившиеся больше чем на threshold (доля)."""
+    old = flatten(previous['results'])
+    regressions = []
+    for key, value in flatten(current['results']).items():
+        before = old.get(key)
+        # Максимум и счетчики операций слишком шумные для сравнения.
+        if not before or key.endswith(('.ops', '.batch_size', '.max_ms')):
+            continue
+        # Для ops_per_s хуже - меньше, для задержек - больше.
+        change = (before - value) / before if key.endswith('ops_per_s') \
+            else (value - before) / before
+        if change > threshold:
+            regressions.append(
+                f'{key}: {before:.3f} -> {value:.3f} (+{change:.0%})')
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Замеры горячих путей бота.')
+    parser.add_argument('--sizes', default='10000,1000000,10000000',
+                        help='размеры баз для статистики через запятую')
+    parser.add_argument('--repeat', type=int, default=200,
+                        help='запросов статистики на каждый период')
+    parser.add_argument('--parse-ops', type=int, default=20000)
+    parser.add_argument('--insert-ops', type=int, default=2000)
+    parser.add_argument('-o', '--output', default='bench.json')
+    parser.add_argument('--compare', help='JSON прошлого запуска')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='допустимое ухудшение, доля')
+    args = parser.parse_args()
+
+    # Отладочные записи на каждую вставку исказили бы замеры.
+    logging.getLogger().setLevel(logging.WARNING)
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    report = run(sizes, args.repeat, args.parse_ops, args.insert_ops)
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f'Результаты записаны в {args.output}')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            regressions = compare(json.load(file), report, args.threshold)
+        for line in regressions:
+            print(f'Ухудшение {line}')
+        if regressions:
+            parser.exit(1)
+
+
+if __name__ == '__main__':
+    main()
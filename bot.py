@@ -1,21 +1,51 @@
 """
 Основная логика работы бота.
 """
-import datetime
+import html
 import time
 import os
 import log
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
-from datetime import timedelta
 from dotenv import load_dotenv
-from telebot import TeleBot, types
-
-from database import base_insert
-from database_handler import (get_expenses_statistics, get_total_statistics,
-                              format_statistics_message, check_user_exists)
-from config import TIME_TO_CLEAR
-from cat_api import get_cat_img
+from telebot import TeleBot, types, apihelper
+
+from database_handler import check_user_exists
+from config import (EXPORT_GZIP, EXPORT_WORKERS,
+                    METRICS_HOST, METRICS_PORT,
+                    METRICS_DUMP_PATH, METRICS_DUMP_INTERVAL, TRACE_PATH,
+                    TRACE_SAMPLE_RATE, TRACE_SLOW_MS, POLL_INTERVAL)
+from cat_api import prefetcher
+from cat_files import (get_file_id, save_file_id, next_cached_file_id,
+                       load_file_ids)
+from connection import manager, writer
+from migrations import migrate
+from cache import warm_categories, cache_stats
+from write_queue import WriteBehindQueue
+from exporter import make_export, remove_export
+from category_memo import memo, pending, categories, remember_saved, learn
+from sessions import (UserSession, StatsSession, user_status, for_user_stats,
+                      sweeper, load_sessions)
+from webhook import WebhookServer
+from dispatcher import ChatDispatcher, update_chat_id
+from metrics import (track_handler, install_telegram_timing,
+                     register_collector, gauge_lines, start_metrics)
+from tracing import tracer, trace
+from profiler import Profiler, is_admin, parse_profile_args
+from bot_common import (COMMANDS, HELP_TEXT, CAT_ERROR_TEXT,
+                        SAVE_ERROR_TEXT, EXPORT_EMPTY_TEXT, EXPORT_ERROR_TEXT,
+                        ITEMS_EMPTY_TEXT, RECAT_EXPIRED_TEXT,
+                        RECAT_ERROR_TEXT, RECAT_SAVING_TEXT,
+                        NO_EXPENSES_TEXT, STATS_MENU_TEXT,
+                        STATS_CUSTOM_TEXT, SKIP_TEXTS,
+                        saved_items_text, recategorize_keyboard,
+                        categories_keyboard,
+                        PROFILE_DENIED_TEXT, PROFILE_USAGE_TEXT,
+                        PROFILE_BUSY_TEXT, PROFILE_IDLE_TEXT,
+                        start_text, create_stats_keyboard, period_text,
+                        button_period, custom_period, statistics_reply,
+                        text_refusal, save_expenses)
 
 logging.getLogger("telebot").setLevel(logging.WARNING)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
@@ -23,49 +53,116 @@ logging.getLogger("urllib3").setLevel(logging.WARNING)
 load_dotenv()
 
 secret_token = os.getenv('TOKEN')
-bot = TeleBot(token=secret_token)
+write_behind = os.getenv('WRITE_BEHIND') == '1'
+# Если задан WEBHOOK_URL, обновления принимаются через webhook.
+webhook_url = os.getenv('WEBHOOK_URL')
+webhook_secret = os.getenv('WEBHOOK_SECRET', '')
+# Адрес Bot API можно подменить, например на локальный сервер loadtest.py.
+if os.getenv('TELEGRAM_API_URL'):
+    apihelper.API_URL = os.getenv('TELEGRAM_API_URL')
+install_telegram_timing()
+# Обработчики запускает диспетчер по чатам, а не пул потоков TeleBot.
+bot = TeleBot(token=secret_token, threaded=False)
+dispatcher = ChatDispatcher()
+_process_new_updates = bot.process_new_updates
+
+
+def send_profile_report(chat_id, report):
+    # Сводка влезает в одно сообщение, полный профиль - в файлах.
+    bot.send_message(chat_id, f'<pre>{html.escape(report[:3500])}</pre>',
+                     parse_mode='HTML')
+
+
+profiler = Profiler(on_report=send_profile_report)
+
+
+def process_update(update):
+    """Обрабатывает одно обновление в его собственной трассе."""
+    with trace('update', update_id=update.update_id,
+               chat_id=update_chat_id(update)):
+        profiler.run(_process_new_updates, [update])
+
+
+def dispatch_updates(updates):
+    """Раздает обновления по шардам диспетчера в порядке поступления."""
+    # TeleBot двигает offset getUpdates только в исходном
+    # process_new_updates, который теперь выполняется в шардах позже.
+    # Без этого следующий опрос снова получил бы еще не обработанные
+    # обновления и раздал их повторно.
+    if updates:
+        bot.last_update_id = max(
+            bot.last_update_id, max(update.update_id for update in updates))
+    for update in updates:
+        dispatcher.submit(update_chat_id(update), process_update, update)
+
+
+bot.process_new_updates = dispatch_updates
 
-bot.set_my_commands([
-    types.BotCommand("/start", "🐆 Начать работу с ботом"),
-    types.BotCommand("/help", "❓ Показать справку"),
-    types.BotCommand("/stats", "💸 Показать статистику трат"),
-    types.BotCommand("/cat", "🐱‍🚀 Показать котика"),
-])
 
+def collect_runtime_metrics():
+    """Глубина очередей диспетчера и записи, попадания в кэши."""
+    shards = dispatcher.stats()
+    lines = gauge_lines(
+        'bot_dispatch_queue_depth', 'Обновлений в очереди шарда',
+        [({'shard': shard['shard']}, shard['depth']) for shard in shards])
+    lines += gauge_lines(
+        'bot_dispatch_max_wait_seconds', 'Наибольшее ожидание в очереди шарда',
+        [({'shard': shard['shard']}, shard['max_wait']) for shard in shards])
+    caches = dict(cache_stats(), category_memo=memo.stats())
+    for field in ('hits', 'misses', 'size'):
+        lines += gauge_lines(
+            f'bot_cache_{field}', f'Кэши: {field}',
+            [({'cache': name}, stats[field]) for name, stats in caches.items()])
+    if write_queue is not None:
+        lines += gauge_lines(
+            'bot_write_queue_depth', 'Трат в очереди записи',
+            [({}, write_queue.qsize())])
+    return lines
 
-user_status = {}
-for_user_stats = {}
+
+register_collector(collect_runtime_metrics)
+
+
+def report_write_error(chat_id, error):
+    bot.send_message(chat_id=chat_id, text=SAVE_ERROR_TEXT)
+
+
+write_queue = WriteBehindQueue(on_error=report_write_error) if write_behind else None
+# Выгрузка читает всю историю и грузит файл в Telegram: на шарде
+# диспетчера она задержала бы остальные сообщения чатов этого шарда.
+export_executor = ThreadPoolExecutor(
+    max_workers=EXPORT_WORKERS, thread_name_prefix='export')
 
 
 @bot.message_handler(commands=['cat'])
+@track_handler
 def cat(message):
-    new_cat = get_cat_img()
-    if new_cat:
-        bot.send_photo(message.chat.id, new_cat)
+    new_cat = prefetcher.get(direct=False)
+    # Известную картинку отправляем по file_id, а если буфер пуст
+    # (API недоступно или медленное) - берем картинку из кэша по кругу.
+    photo = get_file_id(new_cat) if new_cat else next_cached_file_id()
+    if photo is None and not new_cat:
+        new_cat = prefetcher.get()
+    if photo is not None:
+        bot.send_photo(message.chat.id, photo)
+    elif new_cat:
+        sent = bot.send_photo(message.chat.id, new_cat)
+        if sent and sent.photo:
+            save_file_id(new_cat, sent.photo[-1].file_id)
     else:
-        bot.send_message(
-            message.chat.id, '😾 попробуй позже , я не смог получить котика')
+        bot.send_message(message.chat.id, CAT_ERROR_TEXT)
 
 
 @bot.message_handler(commands=['start'])
+@track_handler
 def handle_start(message):
 
-    user_status[message.chat.id] = {
-        'login': message.chat.username,
-        'active': True,
-        'time': time.time()
-    }
+    user_status[message.chat.id] = UserSession(
+        login=message.chat.username, active=True, time=time.time())
 
     bot.send_message(
         chat_id=message.chat.id,
-        text=f'✅ Привет, {message.chat.first_name}! Теперь я буду '
-            f'сохранять твои траты.\n\n'
-            f'Просто присылай мне сообщения в формате:\n'
-            f'<code>продукт сумма</code>\n\n'
-            f'Пример: <code>мясо 1500</code>\n\n'
-            f'📋 *Команды доступны через меню:*\n'
-            f'• Нажми на иконку "︙" слева от поля ввода\n'
-            f'• Или просто напиши /help, /stats',
+        text=start_text(message.chat.first_name),
         parse_mode='HTML',
         reply_markup=types.ReplyKeyboardRemove()
 
@@ -74,87 +171,38 @@ def handle_start(message):
 
 
 @bot.message_handler(commands=['help'])
+@track_handler
 def handle_help(message):
-    text = '''
-   👋 *Привет, я kitty_asla_bot!*
-
-🐱 *Моя задача* - помочь тебе вести учет твоих затрат.
-
-📋 *Алгоритм действий:*
-
-1️⃣ Введи команду */start* чтобы начать
-2️⃣ Напиши одним сообщением:
-   *[что купил] [сколько потратил]*
-
-🍖 *Пример:*
-   `мясо 1500`
-   `кафе 1200`
-   `транспорт 500`
-
-💡 *Совет:* Я автоматически определю категорию твоих трат!
-
-📊 *Доступные команды:*
-/start - начать работу
-/help - показать справку
-/stats - показать статистику
-/cat - просто картинка котика
-'''
-
     bot.send_message(
         chat_id=message.chat.id,
-        text=text,
+        text=HELP_TEXT,
         parse_mode='Markdown'
     )
     logging.debug('Сообщение функции handle_help отправлено')
 
-
-def create_stats_keyboard():
-    keyboard = types.InlineKeyboardMarkup(row_width=2)
-    buttons = [
-        types.InlineKeyboardButton("📅 Произвольный период", callback_data="stats_custom"),
-        types.InlineKeyboardButton("📆 Неделя", callback_data="stats_week"),
-        types.InlineKeyboardButton("📊 Месяц", callback_data="stats_month"),
-        types.InlineKeyboardButton("❌ Отмена", callback_data="stats_cancel")
-    ]
-    keyboard.add(buttons[0])
-    keyboard.add(buttons[1], buttons[2])
-    keyboard.add(buttons[3])
-    return keyboard
-
-
 @bot.message_handler(commands=['stats'])
+@track_handler
 def handle_stats(message):
     """Обработчик команды /stats"""
     chat_id = message.chat.id
     username = message.chat.username
     logging.debug('Запрос статистики')
 
-    remove_keyboard = types.ReplyKeyboardRemove()
-
     # Проверяем есть ли пользователь в базе
     if not check_user_exists(username):
-        bot.send_message(
-            chat_id,
-            "❌ Вы еще не добавляли траты!\n"
-            "Сначала добавьте записи через команду /start",
-            reply_markup=remove_keyboard
-        )
+        bot.send_message(chat_id, NO_EXPENSES_TEXT,
+                         reply_markup=types.ReplyKeyboardRemove())
         return
 
-    for_user_stats[chat_id] = {
-        'username': username,
-        'state': 'stats_menu'
-    }
-    bot.send_message(
-        chat_id,
-        "📊 *Выберите период для статистики:*",
-        parse_mode='Markdown',
-        reply_markup=create_stats_keyboard()
-    )
+    for_user_stats[chat_id] = StatsSession(
+        username=username, state='stats_menu')
+    bot.send_message(chat_id, STATS_MENU_TEXT, parse_mode='Markdown',
+                     reply_markup=create_stats_keyboard())
     logging.debug('Показали в ТГ окно выбора периода')
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith('stats_'))
+@track_handler
 def handle_stats_callback(call):
     """Обработчик callback от кнопок статистики"""
     chat_id = call.message.chat.id
@@ -162,193 +210,257 @@ def handle_stats_callback(call):
     username = call.message.chat.username
 
     if call.data == 'stats_custom':
-        bot.edit_message_text(
-            "📅 *Выберите произвольный период:*\n\n"
-            "Пришлите даты в формате:\n"
-            "`ДД.ММ.ГГГГ-ДД.ММ.ГГГГ`\n"
-            "Например: `01.01.2024-31.01.2024`",
-            chat_id,
-            message_id,
-            parse_mode='Markdown'
-        )
-        for_user_stats[chat_id] = {
-            'username': username,
-            'state': 'waiting_dates'
-        }
+        # Состояние ставится до ответа: даты могут прийти сразу после него.
+        for_user_stats[chat_id] = StatsSession(
+            username=username, state='waiting_dates')
+        bot.edit_message_text(STATS_CUSTOM_TEXT, chat_id, message_id,
+                              parse_mode='Markdown')
         logging.debug('Выбор произвольного периода')
 
-    elif call.data == 'stats_week':
-        end_date = datetime.date.today()
-        start_date = end_date - timedelta(days=7)
-        period_data = {
-            'username': username,
-            'start_date': start_date.strftime('%d.%m.%Y'),
-            'end_date': end_date.strftime('%d.%m.%Y'),
-            'period_type': 'week'
-        }
-        bot.edit_message_text(
-            f'📆 *Статистика за неделю:*\n'
-            f'С {start_date.strftime('%d.%m.%Y')} по {end_date.strftime('%d.%m.%Y')}',
-            chat_id,
-            message_id,
-            parse_mode='Markdown'
-        )
-        logging.debug('Выбор статистики за неделю')
-        process_statistics(chat_id, period_data)
-
-    elif call.data == 'stats_month':
-        today = datetime.date.today()
-        start_date = today.replace(day=1)
-        if today.month == 12:
-            end_date = (today.replace(year=today.year + 1,
-                                      month=1, day=1) - timedelta(days=1))
-        else:
-            end_date = (today.replace(month=today.month + 1, day=1) -
-                        timedelta(days=1))
-        period_data = {
-            'username': username,
-            'start_date': start_date.strftime('%d.%m.%Y'),
-            'end_date': end_date.strftime('%d.%m.%Y'),
-            'period_type': 'month'
-        }
-        bot.edit_message_text(
-            f'📊 *Статистика за месяц:*\n'
-            f'С {start_date.strftime('%d.%m.%Y')} по {end_date.strftime('%d.%m.%Y')}',
-            chat_id,
-            message_id,
-            parse_mode='Markdown'
-        )
-        logging.debug('Выбор статистики за месяц')
+    elif call.data in ('stats_week', 'stats_month'):
+        title, period_data = button_period(call.data, username)
+        bot.edit_message_text(period_text(title, period_data), chat_id,
+                              message_id, parse_mode='Markdown')
+        logging.debug(f'Выбор статистики: {period_data['period_type']}')
         process_statistics(chat_id, period_data)
 
     elif call.data == 'stats_back':
-        bot.edit_message_text(
-            '📊 *Выберите период для статистики:*',
-            chat_id,
-            message_id,
-            parse_mode='Markdown',
-            reply_markup=create_stats_keyboard()
-        )
-        for_user_stats[chat_id]['state'] = 'stats_menu'
+        bot.edit_message_text(STATS_MENU_TEXT, chat_id, message_id,
+                              parse_mode='Markdown',
+                              reply_markup=create_stats_keyboard())
+        for_user_stats.update(chat_id, state='stats_menu')
         logging.debug('Возврат внутри выбора периода статистики')
 
     elif call.data == 'stats_cancel':
         bot.delete_message(chat_id, message_id)
-        if chat_id in for_user_stats:
-            del for_user_stats[chat_id]
+        for_user_stats.pop(chat_id)
         logging.debug('Отмена выбора статистики')
 
 
+@bot.callback_query_handler(func=lambda call: call.data.startswith('recat'))
+@track_handler
+def handle_recategorize(call):
+    """Смена категории сохраненной траты кнопками под ответом."""
+    chat_id = call.message.chat.id
+    message_id = call.message.message_id
+    saved = pending.get((chat_id, message_id))
+    if saved is None:
+        bot.answer_callback_query(call.id, RECAT_EXPIRED_TEXT)
+        bot.edit_message_reply_markup(chat_id, message_id, reply_markup=None)
+        return
+    login, records, product_ids = saved
+    action, *args = call.data.split(':')
+
+    if action == 'recat':
+        index = int(args[0])
+        if index >= len(product_ids):
+            # Отложенная запись еще не вернула id траты.
+            bot.answer_callback_query(call.id, RECAT_SAVING_TEXT)
+            return
+        bot.edit_message_reply_markup(
+            chat_id, message_id,
+            reply_markup=categories_keyboard(product_ids[index], categories()))
+        bot.answer_callback_query(call.id)
+
+    elif action == 'recat_set':
+        product_id, category_id = int(args[0]), int(args[1])
+        if product_id not in product_ids:
+            bot.answer_callback_query(call.id, RECAT_EXPIRED_TEXT)
+            return
+        index = product_ids.index(product_id)
+        try:
+            category = learn(login, product_id, category_id)
+        except Exception as e:
+            logging.error(f'Ошибка смены категории: {e}')
+            bot.answer_callback_query(call.id, RECAT_ERROR_TEXT)
+            return
+        if category is None:
+            bot.answer_callback_query(call.id, RECAT_ERROR_TEXT)
+            return
+        records[index] = records[index][:3] + (category,)
+        bot.edit_message_text(
+            saved_items_text(records), chat_id, message_id,
+            reply_markup=recategorize_keyboard(records))
+        bot.answer_callback_query(call.id, f'Категория: {category}')
+        logging.debug(f'Категория траты сменена на {category}')
+
+    elif action == 'recat_cancel':
+        bot.edit_message_reply_markup(
+            chat_id, message_id, reply_markup=recategorize_keyboard(records))
+        bot.answer_callback_query(call.id)
+
+
 @bot.message_handler(
         func=lambda message:
-        for_user_stats.get(message.chat.id, {}).get('state') == 'waiting_dates'
+        getattr(for_user_stats.get(message.chat.id), 'state', None) == 'waiting_dates'
 )
+@track_handler
 def handle_custom_dates(message):
     """Обработчик произвольного периода"""
     chat_id = message.chat.id
-    text = message.text.strip()
-    username = message.chat.username
+    period_data, error = custom_period(chat_id, message.text)
+    if error is not None:
+        bot.send_message(chat_id, error, parse_mode='Markdown')
+        return
+    bot.send_message(
+        chat_id, period_text('📅 *Выбран период:*', period_data),
+        parse_mode='Markdown')
+    process_statistics(chat_id, period_data)
+    for_user_stats.pop(chat_id)
+
+
+@bot.message_handler(commands=['export'])
+@track_handler
+def handle_export(message):
+    """Отправляет всю историю трат файлом CSV."""
+    export_executor.submit(send_export, message.chat.id, message.chat.username)
+
+
+def send_export(chat_id, username):
+    """Собирает выгрузку и отправляет ее, выполняется в export_executor."""
     try:
-        if '-' in text and text.count('.') == 4:
-            start_str, end_str = text.split('-')
-            start_date = datetime.datetime.strptime(start_str, '%d.%m.%Y').date()
-            end_date = datetime.datetime.strptime(end_str, '%d.%m.%Y').date()
-            if start_date > end_date:
-                bot.send_message(
-                    chat_id, "❌ Дата начала не может быть позже даты окончания!")
-                return
-            period_data = {
-                'username': for_user_stats[chat_id]['username'],
-                'start_date': start_date.strftime('%d.%m.%Y'),
-                'end_date': end_date.strftime('%d.%m.%Y'),
-                'period_type': 'custom'
-            }
-            bot.send_message(
-                chat_id,
-                f'📅 *Выбран период:*\n'
-                f'С {start_date.strftime('%d.%m.%Y')} по {end_date.strftime('%d.%m.%Y')}',
-                parse_mode='Markdown'
-            )
-            process_statistics(chat_id, period_data)
-            if chat_id in for_user_stats:
-                del for_user_stats[chat_id]
-        else:
-            bot.send_message(
-                chat_id,
-                '❌ Неверный формат!\nИспользуйте: ДД.ММ.ГГГГ-ДД.ММ.ГГГГ\nПример: `01.01.2024-31.01.2024`',
-                parse_mode='Markdown'
-            )
-    except ValueError:
-        bot.send_message(chat_id, '❌ Ошибка в формате даты! Проверьте правильность ввода.')
-        logging.error('Ошибка в формате даты!')
+        export = make_export(username, EXPORT_GZIP)
+    except Exception as e:
+        logging.error(f'Ошибка выгрузки трат: {e}')
+        bot.send_message(chat_id, EXPORT_ERROR_TEXT)
+        return
+    if export is None:
+        bot.send_message(chat_id, EXPORT_EMPTY_TEXT)
+        return
+    path, name, rows = export
+    try:
+        with open(path, 'rb') as file:
+            bot.send_document(
+                chat_id, file, visible_file_name=name,
+                caption=f'📤 Выгружено трат: {rows}')
+        logging.debug(f'Выгрузка {name} отправлена')
+    except Exception as e:
+        logging.error(f'Ошибка отправки выгрузки {name}: {e}')
+        bot.send_message(chat_id, EXPORT_ERROR_TEXT)
+    finally:
+        remove_export(path)
 
 
-def process_statistics(chat_id, period_data):
-    """Обрабатывает статистику и отправляет результат"""
+@bot.message_handler(commands=['profile'])
+@track_handler
+def handle_profile(message):
+    """Профилирование следующих обновлений, только для администраторов."""
+    chat_id = message.chat.id
+    if not is_admin(message.chat.username):
+        logging.warning(
+            f'Попытка профилирования от {message.chat.username}')
+        bot.send_message(chat_id, PROFILE_DENIED_TEXT)
+        return
+    if message.text.split()[1:] == ['stop']:
+        # Сводку отправит profiler.run после этого обработчика.
+        if profiler.stop() is None:
+            bot.send_message(chat_id, PROFILE_IDLE_TEXT)
+        return
     try:
-        # Проверяем есть ли пользователь в базе
-        if not check_user_exists(period_data['username']):
-            bot.send_message(
-                chat_id,
-                '❌ Пользователь не найден в базе данных.\n'
-                'Возможно, вы еще не добавляли траты.'
-            )
-            return
+        cpu, memory, updates, seconds = parse_profile_args(message.text)
+    except ValueError as e:
+        bot.send_message(chat_id, f'❌ {e}\n{PROFILE_USAGE_TEXT}')
+        return
+    if not profiler.start(chat_id, cpu, memory, updates, seconds):
+        bot.send_message(chat_id, PROFILE_BUSY_TEXT)
+        return
+    modes = ', '.join(name for name, on in
+                      (('cProfile', cpu), ('tracemalloc', memory)) if on)
+    limit = f'{seconds:g} с' if seconds else f'{updates} обновлений'
+    bot.send_message(chat_id, f'⏱ Профилирование ({modes}) на {limit}.')
 
-        statistics = get_expenses_statistics(period_data)
-        total_stats = get_total_statistics(period_data)
-        message = format_statistics_message(period_data, statistics, total_stats)
-        bot.send_message(chat_id, message, parse_mode='Markdown')
-    except Exception as e:
-        logging.error(f"Ошибка обработки статистики: {e}")
-        bot.send_message(chat_id, "❌ Произошла ошибка при получении статистики.")
+
+def process_statistics(chat_id, period_data):
+    """Обрабатывает статистику и отправляет результат"""
+    text, parse_mode = statistics_reply(period_data)
+    bot.send_message(chat_id, text, parse_mode=parse_mode)
 
 
 @bot.message_handler(content_types=['text'])
+@track_handler
 def handle_text(message):
     chat_id = message.chat.id
-
-    if message.text in ['/help', '/stats', '/start']:
-        return
-    if chat_id not in user_status or not user_status[chat_id]['active']:
-        bot.send_message(
-            chat_id=chat_id,
-            text='❌ Сначала нажми /start чтобы начать.\nИли /help для подсказки'
-        )
-        logging.debug(
-            'Пользователь незарегистрирован - отказ отработал штатно')
+    if message.text in SKIP_TEXTS:
         return
-
-    if (user_status[chat_id]['active'] and
-        time.time() - user_status[chat_id]['time'] > TIME_TO_CLEAR):
-        del user_status[chat_id]
-        bot.send_message(
-            chat_id=chat_id, text='🦘Сессия закрылась, нажми повторно /start')
-        logging.debug('Сообщение о закрытии сессии отправилось')
+    refusal = text_refusal(chat_id, message.chat.username)
+    if refusal is not None:
+        bot.send_message(chat_id=chat_id, text=refusal)
         return
-
-    if user_status[chat_id]['active']:
-        user_data = {
-            'login': message.chat.username,
-            'staf': message.text,
-        }
     try:
-        base_insert(user_data)
-        bot.send_message(chat_id=chat_id, text='✅ Данные сохраняю в базу!')
-        logging.debug(f'Данные в базу сохранены - сообщение в ТГ {user_data}')
+        product_ids = []
+        records = save_expenses(
+            chat_id, message.chat.username, message.text, write_queue,
+            product_ids)
+        if not records:
+            bot.send_message(chat_id=chat_id, text=ITEMS_EMPTY_TEXT)
+            return
+        reply = bot.send_message(
+            chat_id=chat_id, text=saved_items_text(records),
+            reply_markup=recategorize_keyboard(records))
+        remember_saved(chat_id, reply.message_id, message.chat.username,
+                       records, product_ids)
+        logging.debug(f'Траты сохранены: {len(records)}')
     except Exception as e:
         logging.error(f'Ошибка сохранения в базу {e}')
-        bot.send_message(
-            chat_id=chat_id,
-            text='💀 Что-то пошло не так, я не смог сохранить данные, попробуй еще раз'
-        )
+        bot.send_message(chat_id=chat_id, text=SAVE_ERROR_TEXT)
 
 
 if __name__ == "__main__":
+    if webhook_url and not webhook_secret:
+        logging.error('WEBHOOK_URL задан без WEBHOOK_SECRET')
+        raise SystemExit(
+            'Webhook режим требует WEBHOOK_SECRET: без него сервер '
+            'примет обновления от кого угодно.')
     logging.info("Бот запущен")
     print('Бот запущен!')
-    bot.polling(
-        none_stop=True,
-        timeout=10,
-        interval=2
-    )
+    bot.set_my_commands(COMMANDS)
+    with writer() as con:
+        migrate(con)
+        warm_categories(con)
+    load_sessions()
+    load_file_ids()
+    if write_queue is not None:
+        write_queue.start()
+    dispatcher.start()
+    prefetcher.start()
+    sweeper.start()
+    metrics_services = start_metrics(
+        METRICS_HOST, int(os.getenv('METRICS_PORT', METRICS_PORT)),
+        os.getenv('METRICS_DUMP_PATH', METRICS_DUMP_PATH),
+        METRICS_DUMP_INTERVAL)
+    tracer.start(
+        os.getenv('TRACE_PATH', TRACE_PATH),
+        float(os.getenv('TRACE_SAMPLE_RATE', TRACE_SAMPLE_RATE)),
+        float(os.getenv('TRACE_SLOW_MS', TRACE_SLOW_MS)))
+    try:
+        if webhook_url:
+            server = WebhookServer(
+                # Обновление сразу уходит в шард своего чата, порядок
+                # прихода сохраняется.
+                process=lambda update: bot.process_new_updates(
+                    [types.Update.de_json(update)]),
+                secret=webhook_secret,
+                host=os.getenv('WEBHOOK_HOST', '0.0.0.0'),
+                port=int(os.getenv('WEBHOOK_PORT', 8443)),
+            )
+            bot.remove_webhook()
+            bot.set_webhook(url=webhook_url, secret_token=webhook_secret)
+            server.serve_forever()
+        else:
+            bot.polling(
+                none_stop=True,
+                timeout=10,
+                interval=float(os.getenv('POLL_INTERVAL', POLL_INTERVAL))
+            )
+    finally:
+        dispatcher.stop()
+        export_executor.shutdown()
+        prefetcher.stop()
+        sweeper.stop()
+        for service in metrics_services:
+            service.stop()
+        profiler.stop()
+        tracer.stop()
+        if write_queue is not None:
+            write_queue.stop()
+        manager.close()
@@ -0,0 +1,301 @@
+"""
+Общие части синхронного (bot.py) и асинхронного (async_bot.py) бота:
+команды меню, тексты, клавиатуры, расчет периодов и решения
+обработчиков. Функции здесь не обращаются к Telegram: обработчик
+каждого бота только отправляет то, что они вернули, поэтому логика
+у двух ботов не расходится. Функции, читающие базу, асинхронный бот
+вызывает через run_db.
+"""
+import datetime
+import time
+from typing import Optional
+
+import log
+import logging
+
+from datetime import timedelta
+from telebot import types
+
+from config import MEMO_MAX_BUTTONS, TIME_TO_CLEAR
+from database import insert_parsed_many
+from data_income import data_parse_many
+from database_handler import get_statistics_message, get_user_id
+from sessions import user_status, for_user_stats
+
+COMMANDS = [
+    types.BotCommand("/start", "🐆 Начать работу с ботом"),
+    types.BotCommand("/help", "❓ Показать справку"),
+    types.BotCommand("/stats", "💸 Показать статистику трат"),
+    types.BotCommand("/export", "📤 Выгрузить все траты в CSV"),
+    types.BotCommand("/cat", "🐱‍🚀 Показать котика"),
+]
+
+HELP_TEXT = '''
+   👋 *Привет, я kitty_asla_bot!*
+
+🐱 *Моя задача* - помочь тебе вести учет твоих затрат.
+
+📋 *Алгоритм действий:*
+
+1️⃣ Введи команду */start* чтобы начать
+2️⃣ Напиши одним сообщением:
+   *[что купил] [сколько потратил]*
+
+🍖 *Пример:*
+   `мясо 1500`
+   `кафе 1200`
+   `транспорт 500`
+
+🧾 *Несколько трат сразу:*
+   `мясо 1500 хлеб 80 такси 400`
+   или каждую с новой строки
+
+💡 *Совет:* Я автоматически определю категорию твоих трат!
+
+📊 *Доступные команды:*
+/start - начать работу
+/help - показать справку
+/stats - показать статистику
+/export - выгрузить все траты файлом CSV
+/cat - просто картинка котика
+'''
+
+CAT_ERROR_TEXT = '😾 попробуй позже , я не смог получить котика'
+SAVED_TEXT = '✅ Данные сохраняю в базу!'
+SAVE_ERROR_TEXT = (
+    '💀 Что-то пошло не так, я не смог сохранить данные, попробуй еще раз')
+EXPORT_EMPTY_TEXT = '❌ Вы еще не добавляли траты, выгружать нечего.'
+EXPORT_ERROR_TEXT = '💀 Не получилось выгрузить траты, попробуй позже'
+ITEMS_EMPTY_TEXT = (
+    '❌ Не нашел трат в сообщении, напиши например: мясо 1500 хлеб 80')
+NO_LOGIN_TEXT = (
+    '❌ У тебя не задано имя пользователя (username) в Telegram, '
+    'без него я не могу сохранять траты. Задай его в настройках '
+    'и попробуй еще раз.')
+RECAT_EXPIRED_TEXT = 'Кнопка устарела, категорию этой траты уже не сменить.'
+RECAT_ERROR_TEXT = '💀 Не получилось сменить категорию, попробуй позже'
+RECAT_SAVING_TEXT = 'Траты еще записываются, попробуй через пару секунд'
+PROFILE_DENIED_TEXT = '❌ Команда доступна только администраторам.'
+PROFILE_USAGE_TEXT = (
+    'Формат: /profile [cpu|mem|all] [N | Ts]\n'
+    'Например: /profile all 30s, /profile cpu 200, /profile stop')
+PROFILE_BUSY_TEXT = '⏳ Профилирование уже идет, /profile stop - завершить.'
+PROFILE_IDLE_TEXT = '❌ Профилирование не запущено.'
+PROFILE_ASYNC_TEXT = '❌ Профилирование работает только в bot.py.'
+NOT_STARTED_TEXT = (
+    '❌ Сначала нажми /start чтобы начать.\nИли /help для подсказки')
+SESSION_CLOSED_TEXT = '🦘Сессия закрылась, нажми повторно /start'
+STATS_CLOSED_TEXT = '🦘Сессия закрылась, нажми повторно /stats'
+NO_EXPENSES_TEXT = (
+    '❌ Вы еще не добавляли траты!\n'
+    'Сначала добавьте записи через команду /start')
+STATS_MENU_TEXT = '📊 *Выберите период для статистики:*'
+STATS_CUSTOM_TEXT = (
+    '📅 *Выберите произвольный период:*\n\n'
+    'Пришлите даты в формате:\n'
+    '`ДД.ММ.ГГГГ-ДД.ММ.ГГГГ`\n'
+    'Например: `01.01.2024-31.01.2024`')
+STATS_USER_TEXT = (
+    '❌ Пользователь не найден в базе данных.\n'
+    'Возможно, вы еще не добавляли траты.')
+STATS_ERROR_TEXT = '❌ Произошла ошибка при получении статистики.'
+DATES_FORMAT_TEXT = (
+    '❌ Неверный формат!\nИспользуйте: ДД.ММ.ГГГГ-ДД.ММ.ГГГГ\n'
+    'Пример: `01.01.2024-31.01.2024`')
+DATES_ERROR_TEXT = '❌ Ошибка в формате даты! Проверьте правильность ввода.'
+DATES_ORDER_TEXT = '❌ Дата начала не может быть позже даты окончания!'
+# Команды не принимаются за траты, даже если у них нет обработчика
+SKIP_TEXTS = frozenset(
+    [command.command for command in COMMANDS] + ['/profile'])
+
+
+def saved_items_text(records: list[tuple[str, str, int, str]]) -> str:
+    """Ответ на сохранение: одна трата - SAVED_TEXT, несколько - список."""
+    if len(records) == 1:
+        return SAVED_TEXT
+    total = sum(price for _, _, price, _ in records)
+    lines = [f'✅ Сохраняю траты ({len(records)}) на {total} руб.:']
+    lines.extend(f'{number}. {title}: {price} руб. ({category})'
+                 for number, (_, title, price, category)
+                 in enumerate(records, 1))
+    return '\n'.join(lines)
+
+
+def recategorize_keyboard(records: list[tuple[str, str, int, str]]):
+    """Кнопки смены категории под ответом о сохранении."""
+    keyboard = types.InlineKeyboardMarkup(row_width=1)
+    for index, (_, title, _, category) in enumerate(
+            records[:MEMO_MAX_BUTTONS]):
+        text = (f'🏷 Другая категория ({category})' if len(records) == 1
+                else f'🏷 {title[:30]} ({category})')
+        keyboard.add(types.InlineKeyboardButton(
+            text, callback_data=f'recat:{index}'))
+    return keyboard
+
+
+def categories_keyboard(product_id: int,
+                        categories: list[tuple[int, str, str]]):
+    """Выбор новой категории для траты с id product_id."""
+    keyboard = types.InlineKeyboardMarkup(row_width=3)
+    keyboard.add(*[
+        types.InlineKeyboardButton(
+            description,
+            callback_data=f'recat_set:{product_id}:{category_id}')
+        for category_id, _, description in categories])
+    keyboard.add(types.InlineKeyboardButton(
+        '❌ Отмена', callback_data='recat_cancel'))
+    return keyboard
+
+
+def start_text(first_name: str) -> str:
+    return (
+        f'✅ Привет, {first_name}! Теперь я буду '
+        f'сохранять твои траты.\n\n'
+        f'Просто присылай мне сообщения в формате:\n'
+        f'<code>продукт сумма</code>\n\n'
+        f'Пример: <code>мясо 1500</code>\n\n'
+        f'📋 *Команды доступны через меню:*\n'
+        f'• Нажми на иконку "︙" слева от поля ввода\n'
+        f'• Или просто напиши /help, /stats'
+    )
+
+
+def create_stats_keyboard():
+    keyboard = types.InlineKeyboardMarkup(row_width=2)
+    buttons = [
+        types.InlineKeyboardButton("📅 Произвольный период", callback_data="stats_custom"),
+        types.InlineKeyboardButton("📆 Неделя", callback_data="stats_week"),
+        types.InlineKeyboardButton("📊 Месяц", callback_data="stats_month"),
+        types.InlineKeyboardButton("❌ Отмена", callback_data="stats_cancel")
+    ]
+    keyboard.add(buttons[0])
+    keyboard.add(buttons[1], buttons[2])
+    keyboard.add(buttons[3])
+    return keyboard
+
+
+def make_period(username: str, start_date: datetime.date,
+                end_date: datetime.date, period_type: str) -> dict:
+    """Собирает period_data для функций статистики."""
+    return {
+        'username': username,
+        'start_date': start_date.strftime('%d.%m.%Y'),
+        'end_date': end_date.strftime('%d.%m.%Y'),
+        'period_type': period_type
+    }
+
+
+def week_period(username: str) -> dict:
+    """Неделя: с даты семь дней назад по сегодня."""
+    end_date = datetime.date.today()
+    start_date = end_date - timedelta(days=7)
+    return make_period(username, start_date, end_date, 'week')
+
+
+def month_period(username: str) -> dict:
+    """Текущий календарный месяц."""
+    today = datetime.date.today()
+    start_date = today.replace(day=1)
+    if today.month == 12:
+        end_date = (today.replace(year=today.year + 1,
+                                  month=1, day=1) - timedelta(days=1))
+    else:
+        end_date = (today.replace(month=today.month + 1, day=1) -
+                    timedelta(days=1))
+    return make_period(username, start_date, end_date, 'month')
+
+
+def parse_custom_dates(text: str):
+    """Разбирает строку ДД.ММ.ГГГГ-ДД.ММ.ГГГГ.
+
+    Возвращает пару дат или None, если формат не похож на период.
+    Неверная дата выбрасывает ValueError.
+    """
+    if '-' not in text or text.count('.') != 4:
+        return None
+    start_str, end_str = text.split('-')
+    start_date = datetime.datetime.strptime(start_str, '%d.%m.%Y').date()
+    end_date = datetime.datetime.strptime(end_str, '%d.%m.%Y').date()
+    return start_date, end_date
+
+
+def period_text(title: str, period_data: dict) -> str:
+    return (f'{title}\n'
+            f'С {period_data['start_date']} по {period_data['end_date']}')
+
+
+def button_period(data: str, username: str) -> tuple[str, dict]:
+    """Кнопка stats_week/stats_month -> (заголовок, period_data)."""
+    if data == 'stats_week':
+        return '📆 *Статистика за неделю:*', week_period(username)
+    return '📊 *Статистика за месяц:*', month_period(username)
+
+
+def custom_period(chat_id: int,
+                  text: str) -> tuple[Optional[dict], Optional[str]]:
+    """Произвольный период из сообщения.
+
+    Возвращает (period_data, None) или (None, текст ошибки в Markdown).
+    """
+    try:
+        dates = parse_custom_dates(text.strip())
+    except ValueError:
+        logging.error('Ошибка в формате даты!')
+        return None, DATES_ERROR_TEXT
+    if not dates:
+        return None, DATES_FORMAT_TEXT
+    start_date, end_date = dates
+    if start_date > end_date:
+        return None, DATES_ORDER_TEXT
+    # Сессию мог убрать sweeper после проверки в фильтре обработчика.
+    stats_session = for_user_stats.get(chat_id)
+    if stats_session is None:
+        return None, STATS_CLOSED_TEXT
+    return make_period(
+        stats_session.username, start_date, end_date, 'custom'), None
+
+
+def statistics_reply(period_data: dict) -> tuple[str, Optional[str]]:
+    """Текст статистики за период и его parse_mode, читает базу."""
+    try:
+        login_id = get_user_id(period_data['username'])
+        if login_id is None:
+            return STATS_USER_TEXT, None
+        return get_statistics_message(login_id, period_data), 'Markdown'
+    except Exception as e:
+        logging.error(f'Ошибка обработки статистики: {e}')
+        return STATS_ERROR_TEXT, None
+
+
+def text_refusal(chat_id: int, username: Optional[str]) -> Optional[str]:
+    """Почему сообщение нельзя сохранить как траты, None - если можно."""
+    session = user_status.get(chat_id)
+    if session is None or not session.active:
+        logging.debug(
+            'Пользователь незарегистрирован - отказ отработал штатно')
+        return NOT_STARTED_TEXT
+    if time.time() - session.time > TIME_TO_CLEAR:
+        user_status.pop(chat_id)
+        logging.debug('Сессия закрылась по времени')
+        return SESSION_CLOSED_TEXT
+    if not username:
+        logging.debug('Трата без username - отказ отработал штатно')
+        return NO_LOGIN_TEXT
+    return None
+
+
+def save_expenses(chat_id: int, login: str, text: str, write_queue=None,
+                  product_ids: list = None) -> list[tuple[str, str, int, str]]:
+    """Разбирает траты сообщения и пишет их одной транзакцией.
+
+    С write_queue записи ставятся в очередь записи. В product_ids
+    дописываются id записанных трат. Пустой список - в сообщении
+    нет трат, ошибки записи выбрасываются.
+    """
+    records = data_parse_many({'login': login, 'staf': text})
+    if records:
+        if write_queue is not None:
+            write_queue.submit_many(chat_id, records, product_ids)
+        else:
+            insert_parsed_many(records, product_ids)
+    return records
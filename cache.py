@@ -0,0 +1,220 @@
+"""
+Кэши справочников в памяти процесса.
+
+Категории - статичные данные из create_base, ID логина после создания
+не меняется, поэтому эти значения можно не перечитывать из базы
+на каждую запись. Статистика за период кэшируется до новой траты
+пользователя, попадающей в этот период.
+"""
+import sqlite3 as sq
+import threading
+import time
+from collections import OrderedDict
+
+import log
+import logging
+
+from config import (LOGIN_CACHE_SIZE, CATEGORY_CACHE_SIZE,
+                    STATS_CACHE_SIZE, STATS_CACHE_TTL)
+
+
+class LRUCache:
+    """Потокобезопасный LRU кэш ограниченного размера со счетчиками."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Возвращает значение и отмечает его как недавно использованное."""
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return self._data[key]
+
+    def put(self, key, value) -> None:
+        """Сохраняет значение, вытесняя самое старое при переполнении."""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Удаляет значение из кэша."""
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def values(self) -> list:
+        """Снимок значений от самого старого к самому свежему."""
+        with self._lock:
+            return list(self._data.values())
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Счетчики попаданий и промахов."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+            }
+
+
+class StatsCache:
+    """LRU кэш результатов статистики с временем жизни записей.
+
+    Ключ - (login_id, начало, конец, вид), где начало и конец -
+    полуоткрытый интервал дат из period_bounds. Запись сбрасывается,
+    только если пользователь добавил трату с датой внутри ее периода.
+
+    Сброс увеличивает поколение пользователя. Читающий запоминает
+    generation() до запроса и передает его в put: если за время запроса
+    прошел сброс, результат мог устареть и в кэш не кладется.
+
+    Поколения берутся из общего растущего счетчика и хранятся только
+    для пользователей с записями в кэше. У остальных поколение равно
+    _floor - наибольшему из удаленных, поэтому удаление поколения
+    не возвращает его к значению, которое мог запомнить читающий.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._data = OrderedDict()
+        self._by_login = {}
+        self._generations = {}
+        self._counter = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def generation(self, login_id: int) -> int:
+        with self._lock:
+            return self._generations.get(login_id, self._floor)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value, generation: int = None) -> bool:
+        """Кладет запись, False - если с generation пользователя был сброс."""
+        with self._lock:
+            if (generation is not None
+                    and generation != self._generations.get(
+                        key[0], self._floor)):
+                return False
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            self._by_login.setdefault(key[0], set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+            return True
+
+    def invalidate(self, login_id: int, day: str) -> int:
+        """Сбрасывает записи пользователя, в период которых попадает day."""
+        with self._lock:
+            self._counter += 1
+            keys = [key for key in self._by_login.get(login_id, ())
+                    if key[1] <= day < key[2]]
+            for key in keys:
+                self._remove(key)
+            if login_id in self._by_login:
+                self._generations[login_id] = self._counter
+            else:
+                self._drop_generation(login_id, self._counter)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def _remove(self, key) -> None:
+        self._data.pop(key, None)
+        keys = self._by_login.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_login[key[0]]
+                self._drop_generation(key[0])
+
+    def _drop_generation(self, login_id: int, generation: int = None) -> None:
+        """Забывает поколение пользователя без записей, поднимая _floor."""
+        stored = self._generations.pop(login_id, None)
+        for value in (stored, generation):
+            if value is not None:
+                self._floor = max(self._floor, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._by_login.clear()
+            self._generations.clear()
+            self._floor = self._counter
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Счетчики попаданий, промахов и сбросов."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'invalidations': self.invalidations,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+            }
+
+
+# имя логина -> ID в таблице logins
+login_ids = LRUCache(LOGIN_CACHE_SIZE)
+# имя категории -> ID в таблице categories
+category_ids = LRUCache(CATEGORY_CACHE_SIZE)
+# статистика и готовые сообщения по пользователю и периоду
+stats_cache = StatsCache(STATS_CACHE_SIZE, STATS_CACHE_TTL)
+
+
+def warm_categories(con: sq.Connection) -> int:
+    """Заполняет кэш категорий из таблицы categories."""
+    rows = con.execute('SELECT name, id FROM categories').fetchall()
+    for name, category_id in rows:
+        category_ids.put(name, category_id)
+    logging.debug(f'Кэш категорий прогрет: {len(rows)} записей')
+    return len(rows)
+
+
+def cache_stats() -> dict:
+    """Счетчики всех кэшей."""
+    return {
+        'login_ids': login_ids.stats(),
+        'category_ids': category_ids.stats(),
+        'stats': stats_cache.stats(),
+    }
@@ -1,29 +1,209 @@
+import collections
+import threading
+import time
+
+import aiohttp
 import requests
 import log
 import logging
 
-from config import URL
+from config import (URL, CAT_BUFFER_SIZE, CAT_BATCH_SIZE, CAT_REFILL_INTERVAL,
+                    CAT_BREAKER_THRESHOLD, CAT_BREAKER_RESET)
+from metrics import upstream_timer
+
+# Общая сессия держит соединения с API открытыми между запросами.
+session = requests.Session()
+
+
+def extract_cat_url(data):
+    """Достает URL картинки из ответа API котиков."""
+    if data and isinstance(data, list) and len(data) > 0:
+        random_cat = data[0].get('url')
+        if random_cat:
+            return random_cat
+        else:
+            logging.error('URL котика не найден в ответе')
+            return False
+    else:
+        logging.error('API вернуло пустой ответ')
+        return False
 
 
 def get_cat_img():
-    try:
-        response = requests.get(URL, timeout=10)
-        if response.status_code != 200:
-            logging.error('Ошибка при запросе к API котиков')
+    with upstream_timer('thecatapi', 'get_cat_img') as timer:
+        try:
+            response = session.get(URL, timeout=10)
+            if response.status_code != 200:
+                timer.error()
+                logging.error('Ошибка при запросе к API котиков')
+                return False
+
+            return extract_cat_url(response.json())
+        except Exception as e:
+            timer.error()
+            logging.error(f'Ошибка API: {e}')
             return False
 
-        data = response.json()
 
-        if data and isinstance(data, list) and len(data) > 0:
-            random_cat = data[0].get('url')
-            if random_cat:
-                return random_cat
-            else:
-                logging.error('URL котика не найден в ответе')
+async def get_cat_img_async(session: aiohttp.ClientSession):
+    """То же, что get_cat_img, но через общую сессию aiohttp."""
+    with upstream_timer('thecatapi', 'get_cat_img_async') as timer:
+        try:
+            async with session.get(
+                    URL, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status != 200:
+                    timer.error()
+                    logging.error('Ошибка при запросе к API котиков')
+                    return False
+
+                return extract_cat_url(await response.json())
+        except Exception as e:
+            timer.error()
+            logging.error(f'Ошибка API: {e}')
+            return False
+
+
+class CircuitBreaker:
+    """Прекращает обращения к API после серии ошибок.
+
+    После threshold ошибок подряд запросы не делаются reset_timeout
+    секунд, затем разрешается одна пробная попытка: до ее success()
+    или failure() остальные вызовы allow() получают False.
+    """
+
+    def __init__(self, threshold: int = CAT_BREAKER_THRESHOLD,
+                 reset_timeout: float = CAT_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if (self._probing
+                    or time.monotonic() - self.opened_at < self.reset_timeout):
                 return False
-        else:
-            logging.error('API вернуло пустой ответ')
+            self._probing = True
+            return True
+
+    def success(self) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                logging.info('API котиков снова доступно')
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self._probing = False
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logging.warning(
+                        f'API котиков недоступно после {self.failures} '
+                        f'ошибок, пауза {self.reset_timeout} с')
+                self.opened_at = time.monotonic()
+
+
+class CatPrefetcher:
+    """Буфер готовых URL котиков, который пополняется в фоне.
+
+    get() берет URL из памяти. Фоновый поток дозапрашивает картинки
+    пачками (параметр limit) через общую сессию, когда буфер
+    опустел наполовину.
+    """
+
+    def __init__(self, url: str = URL, buffer_size: int = CAT_BUFFER_SIZE,
+                 batch_size: int = CAT_BATCH_SIZE,
+                 refill_interval: float = CAT_REFILL_INTERVAL,
+                 breaker: CircuitBreaker = None,
+                 http: requests.Session = None):
+        self.url = url
+        self.batch_size = batch_size
+        self.refill_interval = refill_interval
+        self.breaker = breaker or CircuitBreaker()
+        self.http = http or session
+        self._buffer = collections.deque(maxlen=buffer_size)
+        self._low_watermark = buffer_size // 2
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='cat-prefetch', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+
+    def get(self, direct: bool = True):
+        """Возвращает URL котика или False, если буфер пуст.
+
+        При пустом буфере и direct=True делается один прямой запрос.
+        """
+        try:
+            cat_url = self._buffer.popleft()
+        except IndexError:
+            cat_url = None
+        if len(self._buffer) < self._low_watermark:
+            self._wake.set()
+        if cat_url:
+            return cat_url
+        # Буфер пуст: одна прямая попытка, если API не отключено.
+        if not direct or not self.breaker.allow():
             return False
-    except Exception as e:
-        logging.error(f'Ошибка API: {e}')
-        return False
+        urls = self._fetch(1)
+        return urls[0] if urls else False
+
+    def _fetch(self, limit: int) -> list:
+        with upstream_timer('thecatapi', 'prefetch') as timer:
+            try:
+                response = self.http.get(
+                    self.url, params={'limit': limit}, timeout=10)
+                if response.status_code != 200:
+                    raise requests.HTTPError(f'статус {response.status_code}')
+                data = response.json()
+                urls = [item['url'] for item in data
+                        if isinstance(item, dict) and item.get('url')]
+                if not urls:
+                    raise ValueError('пустой ответ')
+            except Exception as e:
+                timer.error()
+                logging.error(f'Ошибка API котиков: {e}')
+                self.breaker.failure()
+                return []
+        self.breaker.success()
+        return urls
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if (len(self._buffer) < self._low_watermark
+                    and self.breaker.allow()):
+                urls = self._fetch(self.batch_size)
+                self._buffer.extend(urls)
+                if urls:
+                    continue
+            self._wake.wait(timeout=self.refill_interval)
+            self._wake.clear()
+
+
+prefetcher = CatPrefetcher()
@@ -0,0 +1,78 @@
+"""
+Кэш file_id котиков, уже отправленных в Telegram.
+
+Повторная отправка по file_id не заставляет Telegram заново скачивать
+картинку с thecatapi. Кэш хранится в таблице cat_files и в памяти,
+размер ограничен CAT_FILE_CACHE_SIZE, вытесняются давно не
+использованные картинки. Если API котиков недоступно, /cat
+отдает картинки по кругу из этого кэша.
+"""
+import sqlite3 as sq
+import threading
+
+import log
+import logging
+
+from cache import LRUCache
+from config import CAT_FILE_CACHE_SIZE
+from connection import writer, reader
+
+# URL картинки -> file_id в Telegram
+file_ids = LRUCache(CAT_FILE_CACHE_SIZE)
+_rotation = 0
+_rotation_lock = threading.Lock()
+
+
+def load_file_ids() -> int:
+    """Загружает кэш из базы, самые свежие записи - последними."""
+    with reader() as con:
+        rows = con.execute(
+            'SELECT url, file_id FROM cat_files ORDER BY last_used DESC '
+            'LIMIT ?', (CAT_FILE_CACHE_SIZE,)).fetchall()
+    for url, file_id in reversed(rows):
+        file_ids.put(url, file_id)
+    logging.debug(f'Загружено file_id котиков: {len(rows)}')
+    return len(rows)
+
+
+def get_file_id(url: str):
+    """Возвращает file_id для URL или None."""
+    file_id = file_ids.get(url)
+    if file_id is not None:
+        try:
+            with writer() as con:
+                con.execute(
+                    'UPDATE cat_files SET last_used = CURRENT_TIMESTAMP '
+                    'WHERE url = ?', (url,))
+        except sq.Error as error:
+            logging.error(f'Ошибка обновления cat_files: {error}')
+    return file_id
+
+
+def save_file_id(url: str, file_id: str) -> None:
+    """Запоминает file_id и удаляет из базы лишние старые записи."""
+    file_ids.put(url, file_id)
+    try:
+        with writer() as con:
+            con.execute(
+                'INSERT INTO cat_files(url, file_id) VALUES(?, ?) '
+                'ON CONFLICT(url) DO UPDATE SET file_id = excluded.file_id, '
+                'last_used = CURRENT_TIMESTAMP',
+                (url, file_id))
+            con.execute(
+                'DELETE FROM cat_files WHERE url NOT IN ('
+                'SELECT url FROM cat_files ORDER BY last_used DESC LIMIT ?)',
+                (CAT_FILE_CACHE_SIZE,))
+    except sq.Error as error:
+        logging.error(f'Ошибка сохранения file_id котика: {error}')
+
+
+def next_cached_file_id():
+    """Следующий file_id из кэша по кругу или None, если кэш пуст."""
+    global _rotation
+    cached = file_ids.values()
+    if not cached:
+        return None
+    with _rotation_lock:
+        _rotation = (_rotation + 1) % len(cached)
+        return cached[_rotation]
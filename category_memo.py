@@ -0,0 +1,158 @@
+"""
+Выученные категории названий трат.
+
+После сохранения траты пользователь может кнопкой выбрать для нее
+другую категорию. Выбор запоминается в таблице category_memo для пары
+(пользователь, нормализованное название) и переносит саму трату:
+кнопка знает id траты, поэтому одинаковые названия в одном сообщении
+не путаются.
+Когда MEMO_GLOBAL_MIN_USERS пользователей выбрали для названия одну
+и ту же категорию, она попадает в общий словарь (login_id = 0).
+
+При разборе траты сначала проверяется словарь пользователя, затем
+общий и только потом шаблоны CATEGORY_KEYWORDS. Перед таблицей стоит
+LRU кэш, отсутствие записи тоже кэшируется, поэтому повторное название
+не читает базу. ID пользователя берется только из кэша login_ids:
+сразу после перезапуска первая трата пользователя проходит мимо его
+словаря.
+"""
+import re
+import sqlite3 as sq
+from typing import Optional
+
+import log
+import logging
+
+from cache import LRUCache, login_ids, stats_cache
+from config import MEMO_CACHE_SIZE, MEMO_GLOBAL_MIN_USERS, MEMO_PENDING_SIZE
+from connection import reader, writer
+from metrics import sql_timer
+
+GLOBAL_LOGIN_ID = 0
+_MISSING = object()
+
+# (login_id, название) -> имя категории или None, если записи нет
+memo = LRUCache(MEMO_CACHE_SIZE)
+# (chat_id, message_id ответа) -> (логин, записи data_parse_many, id трат)
+pending = LRUCache(MEMO_PENDING_SIZE)
+_categories = None
+
+
+def normalize_title(title: str) -> str:
+    """'Кофе,  с собой!' -> 'кофе с собой'."""
+    return ' '.join(re.findall(r'\w+', title.lower().replace('ё', 'е')))
+
+
+def _load(login_id: int, title: str):
+    try:
+        with reader() as con, sql_timer('select_category_memo'):
+            row = con.execute(
+                'SELECT c.name FROM category_memo m '
+                'JOIN categories c ON c.id = m.category_id '
+                'WHERE m.login_id = ? AND m.title = ?',
+                (login_id, title)).fetchone()
+    except sq.Error as error:
+        logging.error(f'Ошибка чтения category_memo: {error}')
+        return _MISSING
+    return row[0] if row else None
+
+
+def lookup(login: str, title: str) -> Optional[str]:
+    """Выученная категория названия или None - тогда решают шаблоны."""
+    key = normalize_title(title)
+    if not key:
+        return None
+    for owner in (login_ids.get(login), GLOBAL_LOGIN_ID):
+        if owner is None:
+            continue
+        category = memo.get((owner, key), _MISSING)
+        if category is _MISSING:
+            category = _load(owner, key)
+            if category is _MISSING:
+                continue
+            memo.put((owner, key), category)
+        if category is not None:
+            return category
+    return None
+
+
+def categories() -> list[tuple[int, str, str]]:
+    """(id, имя, описание) всех категорий, справочник не меняется."""
+    global _categories
+    if _categories is None:
+        # Список собирается целиком и присваивается один раз: параллельный
+        # вызов не увидит его наполовину заполненным.
+        with reader() as con:
+            rows = con.execute(
+                'SELECT id, name, description FROM categories ORDER BY id'
+            ).fetchall()
+        _categories = rows
+    return _categories
+
+
+def remember_saved(chat_id: int, message_id: int, login: str,
+                   records: list, product_ids: list) -> None:
+    """Запоминает траты из ответа бота для кнопок смены категории.
+
+    product_ids заполняется при записи трат, с отложенной записью -
+    уже после ответа.
+    """
+    pending.put((chat_id, message_id), (login, list(records), product_ids))
+
+
+def learn(login: str, product_id: int, category_id: int) -> Optional[str]:
+    """Запоминает выбор категории для названия траты и переносит ее.
+
+    Возвращает имя категории или None, если логин, трата этого логина
+    или категория не найдены.
+    """
+    promoted = None
+    with writer() as con:
+        login_row = con.execute(
+            'SELECT id FROM logins WHERE name = ?', (login,)).fetchone()
+        category_row = con.execute(
+            'SELECT name FROM categories WHERE id = ?',
+            (category_id,)).fetchone()
+        if login_row is None or category_row is None:
+            return None
+        login_id, category = login_row[0], category_row[0]
+        product = con.execute(
+            'SELECT title, date(created_at) FROM products '
+            'WHERE id = ? AND login_id = ?',
+            (product_id, login_id)).fetchone()
+        if product is None:
+            return None
+        key = normalize_title(product[0])
+        with sql_timer('upsert_category_memo'):
+            con.execute(
+                'INSERT INTO category_memo(login_id, title, category_id) '
+                'VALUES(?, ?, ?) ON CONFLICT(login_id, title) DO UPDATE SET '
+                'category_id = excluded.category_id, '
+                'updated_at = CURRENT_TIMESTAMP',
+                (login_id, key, category_id))
+        with sql_timer('recategorize_product'):
+            con.execute('UPDATE products SET category_id = ? WHERE id = ?',
+                        (category_id, product_id))
+        # Общий словарь получает категорию, выбранную большинством.
+        votes = con.execute(
+            'SELECT m.category_id, c.name, COUNT(*) AS users '
+            'FROM category_memo m JOIN categories c ON c.id = m.category_id '
+            'WHERE m.title = ? AND m.login_id != ? '
+            'GROUP BY m.category_id ORDER BY users DESC LIMIT 1',
+            (key, GLOBAL_LOGIN_ID)).fetchone()
+        if votes is not None and votes[2] >= MEMO_GLOBAL_MIN_USERS:
+            promoted = votes[1]
+            con.execute(
+                'INSERT INTO category_memo(login_id, title, category_id) '
+                'VALUES(?, ?, ?) ON CONFLICT(login_id, title) DO UPDATE SET '
+                'category_id = excluded.category_id, '
+                'updated_at = CURRENT_TIMESTAMP',
+                (GLOBAL_LOGIN_ID, key, votes[0]))
+    memo.put((login_id, key), category)
+    if promoted is not None:
+        memo.put((GLOBAL_LOGIN_ID, key), promoted)
+    stats_cache.invalidate(login_id, product[1])
+    logging.debug(
+        'Категория %s выучена для %s: %s, трата %s', category, login, key,
+        product_id)
+    return category
@@ -0,0 +1,54 @@
+"""
+Классификатор трат по ключевым словам.
+
+Все шаблоны из CATEGORY_KEYWORDS собираются в одно скомпилированное
+регулярное выражение, поэтому категория определяется за один проход по тексту.
+"""
+import re
+
+from config import CATEGORY_KEYWORDS
+
+DEFAULT_CATEGORY = 'other'
+
+
+class CategoryClassifier:
+    """Определяет категорию траты по названию.
+
+    Правило прежнее: побеждает первая по порядку словаря категория,
+    хоть один шаблон которой встречается в тексте.
+    """
+
+    def __init__(self, keywords: dict[str, list[str]],
+                 default: str = DEFAULT_CATEGORY):
+        self.default = default
+        self.categories = list(keywords)
+        # Каждая категория - именованная группа, группы идут в порядке словаря,
+        # поэтому на любой позиции текста совпадает самая приоритетная
+        # из подходящих там категорий.
+        self._pattern = re.compile('|'.join(
+            f'(?P<c{index}>{"|".join(patterns)})'
+            for index, patterns in enumerate(keywords.values()) if patterns
+        ))
+
+    def classify(self, title: str) -> str:
+        """Возвращает название категории для одной строки."""
+        text = title.lower()
+        best = None
+        # Поиск продолжается со следующего символа после начала совпадения,
+        # а не с его конца: шаблоны других категорий могут перекрываться.
+        match = self._pattern.search(text)
+        while match:
+            index = int(match.lastgroup[1:])
+            if best is None or index < best:
+                best = index
+                if best == 0:
+                    break
+            match = self._pattern.search(text, match.start() + 1)
+        return self.categories[best] if best is not None else self.default
+
+    def classify_many(self, titles) -> list[str]:
+        """Возвращает список категорий для набора строк."""
+        return [self.classify(title) for title in titles]
+
+
+classifier = CategoryClassifier(CATEGORY_KEYWORDS)
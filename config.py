@@ -254,4 +254,107 @@ OTHER_CATEGORY_ID = 10
 
 TIME_TO_CLEAR = 600
 
+# Хранилище сессий: сколько хранить закрытую сессию, предел числа записей,
+# число полос блокировок, период очистки и запись сессий в базу.
+# Запись в базу идет на каждое изменение сессии в потоке обработчика,
+# поэтому по умолчанию выключена.
+SESSION_GRACE = 3600
+SESSION_MAX_SIZE = 100000
+SESSION_STRIPES = 16
+SESSION_SWEEP_INTERVAL = 30
+SESSION_PERSIST = False
+
 URL = 'https://api.thecatapi.com/v1/images/search'
+
+# Буфер котиков: размер, размер пачки запроса и пауза между проверками
+CAT_BUFFER_SIZE = 20
+CAT_BATCH_SIZE = 10
+CAT_REFILL_INTERVAL = 5
+# После стольких ошибок подряд API котиков не трогаем CAT_BREAKER_RESET секунд
+CAT_BREAKER_THRESHOLD = 3
+CAT_BREAKER_RESET = 60
+
+# Настройки соединений с базой
+READ_POOL_SIZE = 4
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 16000
+MMAP_SIZE = 256 * 1024 * 1024
+
+# Диагностические запросы по всей таблице products при подсчете статистики
+STATS_DEBUG = False
+
+# Размеры кэшей справочников
+LOGIN_CACHE_SIZE = 10000
+CATEGORY_CACHE_SIZE = 64
+
+# Отложенная запись трат пачками (включается WRITE_BEHIND=1 в .env)
+WRITE_BATCH_SIZE = 200
+WRITE_MAX_LATENCY = 0.5
+WRITE_QUEUE_SIZE = 10000
+WRITE_PUT_TIMEOUT = 2
+
+# Кэш результатов статистики
+STATS_CACHE_SIZE = 1000
+STATS_CACHE_TTL = 300
+
+# Выученные категории названий (category_memo.py): записей в памяти,
+# включая отсутствующие, сколько пользователей должны выбрать одну
+# категорию для названия, чтобы она попала в общий словарь, и сколько
+# сохраненных трат можно перекатегоризировать кнопками после ответа
+MEMO_CACHE_SIZE = 50000
+MEMO_GLOBAL_MIN_USERS = 3
+MEMO_PENDING_SIZE = 10000
+MEMO_MAX_BUTTONS = 10
+
+# Потоки для работы с SQLite в асинхронном боте (async_bot.py)
+DB_EXECUTOR_WORKERS = 4
+
+# Пауза между запросами getUpdates в режиме polling, секунд
+# (POLL_INTERVAL в .env)
+POLL_INTERVAL = 2
+
+# Webhook режим (включается WEBHOOK_URL в .env)
+# Наибольший размер тела запроса с обновлением, байт
+WEBHOOK_MAX_BODY = 1048576
+
+# Диспетчер обработчиков по чатам
+DISPATCH_WORKERS = 8
+DISPATCH_QUEUE_SIZE = 1000
+
+# Сколько file_id котиков хранить в базе
+CAT_FILE_CACHE_SIZE = 500
+
+# Массовый импорт трат из CSV (importer.py): строк в одной транзакции
+IMPORT_CHUNK_SIZE = 5000
+
+# Выгрузка трат (/export, exporter.py): строк за одно чтение курсора
+# и сжатие файла, отправляемого в Telegram
+EXPORT_FETCH_SIZE = 1000
+EXPORT_GZIP = True
+# Потоков для выгрузок: файл собирается и отправляется вне шарда чата
+EXPORT_WORKERS = 2
+
+# Метрики Prometheus: адрес /metrics (порт 0 - не поднимать сервер),
+# файл для периодической выгрузки (None - не писать) и корзины гистограмм
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108
+METRICS_DUMP_PATH = None
+METRICS_DUMP_INTERVAL = 60
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10)
+
+# Трассировка обновлений (tracing.py): файл в формате Chrome trace events
+# (None - не писать), доля случайно записываемых обновлений и порог в мс,
+# медленнее которого обновление записывается всегда
+TRACE_PATH = None
+TRACE_SAMPLE_RATE = 0.01
+TRACE_SLOW_MS = 1000
+
+# Профилирование по команде /profile (profiler.py): логины администраторов,
+# каталог для .pstats и снимков памяти, строк в сводке и ограничения сеанса
+ADMIN_LOGINS = ()
+PROFILE_DIR = 'profiles'
+PROFILE_TOP = 10
+PROFILE_DEFAULT_UPDATES = 100
+PROFILE_MAX_UPDATES = 10000
+PROFILE_MAX_SECONDS = 600
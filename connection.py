@@ -0,0 +1,126 @@
+"""
+Общие соединения с базой.
+
+Одно долгоживущее пишущее соединение и ограниченный пул
+читающих соединений (только чтение) для статистики. База работает в WAL,
+поэтому чтение статистики не блокирует запись трат.
+"""
+import queue
+import sqlite3 as sq
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import log
+import logging
+
+from config import (DATABASE_NAME, READ_POOL_SIZE, BUSY_TIMEOUT_MS,
+                    CACHE_SIZE_KB, MMAP_SIZE)
+
+
+class ConnectionManager:
+    """Раздает соединения с базой данных."""
+
+    def __init__(self, database: str, pool_size: int = READ_POOL_SIZE):
+        self.database = database
+        self.pool_size = pool_size
+        self._writer = None
+        self._write_lock = threading.RLock()
+        self._readers = queue.Queue(maxsize=pool_size)
+        self._created = 0
+        self._pool_lock = threading.Lock()
+
+    def _configure(self, con: sq.Connection) -> None:
+        """Общие настройки для всех соединений."""
+        con.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        con.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+        con.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+
+    def _open_writer(self) -> sq.Connection:
+        con = sq.connect(
+            self.database, timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False)
+        con.execute('PRAGMA journal_mode = WAL')
+        # В WAL режиме NORMAL не теряет целостность, но не делает fsync
+        # на каждый коммит.
+        con.execute('PRAGMA synchronous = NORMAL')
+        self._configure(con)
+        logging.debug(f'Открыто пишущее соединение с {self.database}')
+        return con
+
+    def _open_reader(self) -> sq.Connection:
+        uri = f'{Path(self.database).resolve().as_uri()}?mode=ro'
+        con = sq.connect(
+            uri, uri=True, timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False)
+        con.execute('PRAGMA query_only = ON')
+        self._configure(con)
+        logging.debug(f'Открыто читающее соединение с {self.database}')
+        return con
+
+    def get_writer(self) -> sq.Connection:
+        """Возвращает пишущее соединение, создавая его при первом вызове."""
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._open_writer()
+            return self._writer
+
+    @contextmanager
+    def writer(self):
+        """Пишущее соединение под блокировкой.
+
+        При успешном выходе из блока транзакция фиксируется,
+        при исключении - откатывается.
+        """
+        with self._write_lock:
+            con = self.get_writer()
+            try:
+                yield con
+                con.commit()
+            except Exception:
+                con.rollback()
+                raise
+
+    def _acquire_reader(self) -> sq.Connection:
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            if self._created < self.pool_size:
+                # Читающее соединение не может включить WAL и создать файл
+                # базы, поэтому сначала открываем пишущее.
+                self.get_writer()
+                con = self._open_reader()
+                self._created += 1
+                return con
+        return self._readers.get()
+
+    @contextmanager
+    def reader(self):
+        """Читающее соединение из пула, после блока возвращается в пул."""
+        con = self._acquire_reader()
+        try:
+            yield con
+        finally:
+            self._readers.put(con)
+
+    def close(self) -> None:
+        """Закрывает все соединения, например при остановке бота."""
+        with self._pool_lock:
+            while True:
+                try:
+                    self._readers.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._created = 0
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        logging.debug(f'Соединения с {self.database} закрыты')
+
+
+manager = ConnectionManager(DATABASE_NAME)
+writer = manager.writer
+reader = manager.reader
@@ -3,11 +3,12 @@
 import sqlite3 as sq
 
 from config import DATABASE_NAME
+from migrations import migrate
 
 
-def create_base():
+def create_base(database: str = DATABASE_NAME):
     """Создаем базу данных."""
-    con = sq.connect(DATABASE_NAME)
+    con = sq.connect(database)
     cur = con.cursor()
 
     logins_quary = '''
@@ -65,6 +66,7 @@ def create_base():
         except Exception as e:
             print(f'Ошибка при добавлении категории  {e}')
     con.commit()
+    migrate(con)
     con.close()
 
     print('База данных создана')
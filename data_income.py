@@ -1,12 +1,27 @@
 
 """
 Функция которая получает информацию о логине, продукте  и цене.
+
+data_parse складывает все числа сообщения в одну трату, data_parse_many
+делит сообщение на несколько трат: по строкам, запятым и точкам
+с запятой, а внутри части - на чередующиеся слова и числа:
+'мясо 1500 хлеб 80 такси 400' - три траты. Категорию каждой траты
+data_parse_many сначала ищет среди выученных (category_memo.py).
 """
 import re
 import log
 import logging
 
-from config import CATEGORY_KEYWORDS
+from category_memo import lookup
+from classifier import classifier
+from tracing import span
+
+# Разделители отдельных трат в одном сообщении
+# Запятая между цифрами ('1500,50') траты не разделяет.
+ITEM_SEPARATORS = re.compile(r'[\n;]|(?<!\d),|,(?!\d)')
+# Сумма с копейками: '1500,50' или '1500.50', копейки округляются.
+DECIMAL_AMOUNT = re.compile(r'\d+[,.]\d+')
+EMPTY_TITLE = 'Пустое значение'
 
 
 def data_parse(data: dict) -> tuple[str, str, int, str]:
@@ -27,17 +42,67 @@ def data_parse(data: dict) -> tuple[str, str, int, str]:
         else:
             str_item.append(item)  # складываем строки в список.
     sum_int_item = sum(int_item)
-    str_item = ' '.join(str_item) if str_item else 'Пустое значение'
+    str_item = ' '.join(str_item) if str_item else EMPTY_TITLE
 
     # проверяем есть ли товар в категории
-    category_name = 'other'
-    text_lower = str_item.lower()
-
-    for category, values in CATEGORY_KEYWORDS.items():
-        for value in values:
-            if re.search(value, text_lower):
-                category_name = category
-                break
-        if category_name != 'other':  # Если нашли категорию, выходим
-            break
+    with span('classify', 'parse'):
+        category_name = classifier.classify(str_item)
     return login, str_item, sum_int_item, category_name
+
+
+def split_items(staf: str) -> list[tuple[str, int]]:
+    """Делит текст на пары (статья трат, сумма).
+
+    Слова до чисел - название, идущие подряд числа складываются в сумму,
+    как в data_parse. Слова после последнего числа части дописываются
+    к названию последней траты ('кофе 250 с собой'), числа перед первым
+    словом - к сумме первой. Часть из одних чисел дописывается к сумме
+    предыдущей траты ('кофе 250, 50'), а не становится тратой без названия.
+    """
+    items = []
+    for part in ITEM_SEPARATORS.split(staf):
+        part_items = []
+        words, amount, has_amount = [], 0, False
+        for token in part.split():
+            if token.isdigit():
+                amount += int(token)
+                has_amount = True
+            elif DECIMAL_AMOUNT.fullmatch(token):
+                amount += round(float(token.replace(',', '.')))
+                has_amount = True
+            elif has_amount and words:
+                part_items.append([words, amount])
+                words, amount, has_amount = [token], 0, False
+            else:
+                words.append(token)
+        if words and has_amount:
+            part_items.append([words, amount])
+        elif words and part_items:
+            part_items[-1][0] = part_items[-1][0] + words
+        elif has_amount and not words and items:
+            items[-1] = (items[-1][0], items[-1][1] + amount)
+        elif words or has_amount:
+            part_items.append([words, amount])
+        items.extend((' '.join(words) or EMPTY_TITLE, amount)
+                     for words, amount in part_items)
+    return items
+
+
+def data_parse_many(data: dict) -> list[tuple[str, str, int, str]]:
+    """Как data_parse, но по записи на каждую трату сообщения.
+
+    Выученная категория названия берется до поиска по шаблонам.
+    """
+    login = data.get('login')
+    staf = data.get('staf')
+    if not login or not staf:
+        logging.error(
+            'Не получили валидный словарь {login: xxx, staf: xxx}'
+            '  с пакета bot.py функции handle_text')
+        return []
+    items = split_items(staf)
+    with span('classify', 'parse'):
+        categories = [lookup(login, title) or classifier.classify(title)
+                      for title, _ in items]
+    return [(login, title, amount, category)
+            for (title, amount), category in zip(items, categories)]
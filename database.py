@@ -2,47 +2,75 @@
 import sqlite3 as sq
 import log
 import logging
+from datetime import datetime, timezone
 from typing import Optional
 
 from data_income import data_parse
-from config import DATABASE_NAME, OTHER_CATEGORY_ID
+from config import OTHER_CATEGORY_ID
+from connection import writer
+from cache import login_ids, category_ids, stats_cache
+from metrics import sql_timer
+
+logger = logging.getLogger(__name__)
+
+
+def utc_today() -> str:
+    """Дата новой траты: created_at заполняется CURRENT_TIMESTAMP в UTC."""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
 
 
 def get_category_id(cur: sq.Cursor, category_name: str) -> Optional[int]:
     """Получает ID категории по названию."""
+    category_id = category_ids.get(category_name)
+    if category_id is not None:
+        return category_id
     try:
-        category_execute = cur.execute(
-            'SELECT id FROM categories WHERE name = ?', (category_name,))
-        category_correct = category_execute.fetchone()
+        with sql_timer('select_category_id'):
+            category_execute = cur.execute(
+                'SELECT id FROM categories WHERE name = ?', (category_name,))
+            category_correct = category_execute.fetchone()
         if category_correct:
+            category_ids.put(category_name, category_correct[0])
             return category_correct[0]
-        logging.warning(f'Категория {category_name} не найдена в базе')
+        logger.warning(f'Категория {category_name} не найдена в базе')
         return None
     except sq.Error as error:
-        logging.error(
+        logger.error(
             f'Ошибка получения category_id для {category_name}: {error}')
         return None
 
 
 def get_login_id(cur: sq.Cursor, login: str) -> Optional[int]:
     """Получает ID логина, если существует."""
+    login_id = login_ids.get(login)
+    if login_id is not None:
+        return login_id
     try:
-        login_execute = cur.execute(
-            'SELECT id FROM logins WHERE name = ?', (login,))
-        login_result = login_execute.fetchone()
-        return login_result[0] if login_result else None
+        with sql_timer('select_login_id'):
+            login_execute = cur.execute(
+                'SELECT id FROM logins WHERE name = ?', (login,))
+            login_result = login_execute.fetchone()
+        if login_result:
+            login_ids.put(login, login_result[0])
+            return login_result[0]
+        return None
     except sq.Error as error:
-        logging.error(f'Ошибка проверки логина {login}: {error}')
+        logger.error(f'Ошибка проверки логина {login}: {error}')
         return None
 
 
 def insert_login(cur: sq.Cursor, login: str) -> Optional[int]:
-    """Добавляет новый логин и возвращает его ID."""
+    """Добавляет новый логин и возвращает его ID.
+
+    В кэш ID попадает только после коммита транзакции (см. base_insert).
+    """
+    login_ids.pop(login)
     try:
-        cur.execute('INSERT INTO logins(name) VALUES(?)', (login,))
+        with sql_timer('insert_login'):
+            cur.execute('INSERT INTO logins(name) VALUES(?)', (login,))
         return cur.lastrowid
     except sq.Error as error:
-        logging.error(f'Ошибка добавления логина {login}: {error}')
+        logger.error(f'Ошибка добавления логина {login}: {error}')
         return None
 
 
@@ -51,18 +79,18 @@ def insert_product(
         title: str, price: int, login_id: int, category_id: int) -> bool:
     """Добавляет продукт в базу."""
     try:
-        cur.execute(
-            'INSERT INTO products(title, price, login_id, category_id)'
-            'VALUES(?,?,?,?)',
-            (title, price, login_id, category_id)
-        )
-        logging.debug(
-            f'Добавлен продукт: {title}, цена: {price}, login_id: {login_id},'
-            f' category_id: {category_id}'
-        )
+        with sql_timer('insert_product'):
+            cur.execute(
+                'INSERT INTO products(title, price, login_id, category_id)'
+                'VALUES(?,?,?,?)',
+                (title, price, login_id, category_id)
+            )
+        logger.debug(
+            'Добавлен продукт: %s, цена: %s, login_id: %s, category_id: %s',
+            title, price, login_id, category_id)
         return True
     except sq.Error as error:
-        logging.error(f'Ошибка добавления продукта {title}: {error}')
+        logger.error(f'Ошибка добавления продукта {title}: {error}')
         return False
 
 
@@ -75,43 +103,92 @@ def base_insert(data: dict) -> bool:
         #     logging.warning('Недостаточно данных для сохранения')
         #     return False
 
-        with sq.connect(DATABASE_NAME) as con:
+        with writer() as con:
             cur = con.cursor()
-            logging.debug(f'{login} открыл соединение с базой')
+            logger.debug('%s получил соединение с базой', login)
 
             # Получаем ID категории
             category_id = get_category_id(cur, category_name)
             if category_id is None:
                 category_id = OTHER_CATEGORY_ID  # ID для 'other'
-                logging.info(
-                    f'Используем категорию по умолчанию (ID: {category_id})')
+                logger.info(
+                    'Используем категорию по умолчанию (ID: %s)', category_id)
 
             # Получаем или создаем логин
+            login_created = False
             login_id = get_login_id(cur, login)
             if login_id is None:
+                login_created = True
                 login_id = insert_login(cur, login)
                 if login_id is None:
-                    logging.error(f'Не удалось создать логин {login}')
+                    logger.error(f'Не удалось создать логин {login}')
                     return False
-                logging.debug(f'Создан новый логин {login} (ID: {login_id})')
+                logger.debug('Создан новый логин %s (ID: %s)', login, login_id)
             else:
-                logging.debug(
-                    f'Найден существующий логин {login} (ID: {login_id})')
+                logger.debug(
+                    'Найден существующий логин %s (ID: %s)', login, login_id)
 
             # Добавляем продукт
             if insert_product(
                     cur, str_item, sum_int_item, login_id, category_id):
-                con.commit()
-                logging.debug(f'Данные успешно сохранены для {login}')
+                with sql_timer('commit'):
+                    con.commit()
+                if login_created:
+                    login_ids.put(login, login_id)
+                stats_cache.invalidate(login_id, utc_today())
+                logger.debug('Данные успешно сохранены для %s', login)
                 return True
             else:
                 con.rollback()
-                logging.error(f'Ошибка сохранения данных для {login}')
+                logger.error(f'Ошибка сохранения данных для {login}')
                 return False
 
     except sq.Error as error:
-        logging.error(f'Ошибка базы данных: {error}')
+        logger.error(f'Ошибка базы данных: {error}')
         return False
     except Exception as error:
-        logging.error(f'Неожиданная ошибка в base_insert: {error}')
+        logger.error(f'Неожиданная ошибка в base_insert: {error}')
         return False
+
+
+def insert_parsed_many(records: list[tuple[str, str, int, str]],
+                       product_ids: list = None) -> int:
+    """Записывает пачку уже распарсенных трат одной транзакцией.
+
+    Записи - кортежи (логин, статья трат, цена, категория) как из data_parse.
+    В product_ids, если он передан, дописываются id записанных трат
+    в порядке records. При ошибке транзакция откатывается целиком
+    и исключение пробрасывается.
+    """
+    created = {}
+    with writer() as con:
+        cur = con.cursor()
+        rows = []
+        for login, str_item, sum_int_item, category_name in records:
+            category_id = get_category_id(cur, category_name)
+            if category_id is None:
+                category_id = OTHER_CATEGORY_ID
+            login_id = created.get(login) or get_login_id(cur, login)
+            if login_id is None:
+                login_id = insert_login(cur, login)
+                if login_id is None:
+                    raise sq.DatabaseError(f'Не удалось создать логин {login}')
+                created[login] = login_id
+            rows.append((str_item, sum_int_item, login_id, category_id))
+        with sql_timer('insert_products_batch'):
+            cur.executemany(
+                'INSERT INTO products(title, price, login_id, category_id)'
+                'VALUES(?,?,?,?)',
+                rows
+            )
+        # Транзакция пишет одна, поэтому id пачки идут подряд.
+        last_id = cur.execute('SELECT last_insert_rowid()').fetchone()[0]
+    if product_ids is not None and rows:
+        product_ids.extend(range(last_id - len(rows) + 1, last_id + 1))
+    for login, login_id in created.items():
+        login_ids.put(login, login_id)
+    day = utc_today()
+    for login_id in {row[2] for row in rows}:
+        stats_cache.invalidate(login_id, day)
+    logger.debug('Пачка из %s записей сохранена', len(rows))
+    return len(rows)
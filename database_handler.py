@@ -1,39 +1,153 @@
-import sqlite3
-from datetime import datetime
-from typing import List, Tuple
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+import log
 import logging
 
-from config import DATABASE_NAME
+from config import STATS_DEBUG
+from connection import reader
+from cache import login_ids, stats_cache
+from metrics import sql_timer
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def check_user_exists(username: str) -> bool:
+def period_bounds(period_data: dict) -> Tuple[str, str]:
     """
-    Проверяет, существует ли пользователь в базе.
+    Переводит период в полуоткрытый интервал [начало, конец).
+
+    Границы - даты ГГГГ-ММ-ДД, подходят и для created_at, и для day.
+    Сравнение самого столбца, а не date(created_at), позволяет
+    использовать индекс по (login_id, created_at).
     """
+    start = datetime.strptime(period_data['start_date'], '%d.%m.%Y')
+    end = datetime.strptime(period_data['end_date'], '%d.%m.%Y')
+    return (start.strftime('%Y-%m-%d'),
+            (end + timedelta(days=1)).strftime('%Y-%m-%d'))
+
+
+def get_user_id(username: str) -> Optional[int]:
+    """
+    Возвращает ID пользователя или None, если его нет в базе.
+    """
+    login_id = login_ids.get(username)
+    if login_id is not None:
+        return login_id
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
+        with reader() as conn:
+            cursor = conn.cursor()
 
-        query = "SELECT id, name FROM logins WHERE name = ?"
-        cursor.execute(query, (username,))
-        result = cursor.fetchone()
-        conn.close()
+            query = "SELECT id FROM logins WHERE name = ?"
+            with sql_timer('select_login_id'):
+                cursor.execute(query, (username,))
+                result = cursor.fetchone()
 
         if result:
-            logger.info(
-                f'Пользователь {username} найден в базе (ID: {result[0]})')
-            return True
+            logger.debug(
+                'Пользователь %s найден в базе (ID: %s)', username, result[0])
+            login_ids.put(username, result[0])
+            return result[0]
         else:
             logger.warning(f'❌ Пользователь {username} НЕ найден в базе')
-            return False
+            return None
 
     except Exception as e:
         logger.error(f"Ошибка проверки пользователя {username}: {e}")
-        return False
+        return None
+
+
+def check_user_exists(username: str) -> bool:
+    """
+    Проверяет, существует ли пользователь в базе.
+    """
+    return get_user_id(username) is not None
+
+
+def log_diagnostics(cursor, login_id: int, start_date: str,
+                    end_date: str) -> None:
+    """
+    Диагностические запросы по всей таблице products.
+
+    Выполняются только при включенном STATS_DEBUG.
+    """
+    # ТЕСТ 1: Простой запрос без JOIN
+    test_query1 = "SELECT COUNT(*) FROM products WHERE created_at >= ? AND created_at < ?"
+    cursor.execute(test_query1, (start_date, end_date))
+    logger.info(
+        f'   ТЕСТ 1 - Простой поиск по дате: {cursor.fetchone()[0]} записей')
+
+    # ТЕСТ 2: Поиск по пользователю без даты
+    test_query2 = "SELECT COUNT(*) FROM products WHERE login_id = ?"
+    cursor.execute(test_query2, (login_id,))
+    logger.info(
+        f'   ТЕСТ 2 - Поиск по пользователю: {cursor.fetchone()[0]} записей')
+
+
+def get_statistics(login_id: int, period_data: dict) -> dict:
+    """
+    Собирает всю статистику пользователя за период одним запросом.
+
+    Разбивка по категориям берется из одного GROUP BY по суточным итогам
+    daily_spend, поэтому стоимость зависит от числа дней в периоде,
+    а не от числа трат. Итоги и топ категория считаются по
+    сгруппированным строкам.
+    """
+    start_date, end_date = period_bounds(period_data)
+    key = (login_id, start_date, end_date, 'statistics')
+    cached = stats_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = stats_cache.generation(login_id)
+    query = """
+    SELECT
+        c.name as category,
+        SUM(d.total) as total_amount,
+        SUM(d.count) as transactions_count
+    FROM daily_spend d
+    JOIN categories c ON d.category_id = c.id
+    WHERE d.login_id = ?
+    AND d.day >= ? AND d.day < ?
+    GROUP BY d.category_id
+    ORDER BY total_amount DESC
+    """
+    with reader() as conn:
+        cursor = conn.cursor()
+        if STATS_DEBUG:
+            log_diagnostics(cursor, login_id, start_date, end_date)
+        with sql_timer('select_daily_spend'):
+            cursor.execute(query, (login_id, start_date, end_date))
+            categories = cursor.fetchall()
+
+    total_amount = sum(row[1] for row in categories)
+    transactions_count = sum(row[2] for row in categories)
+    logger.debug(
+        'Статистика login_id=%s за %s - %s: %s категорий',
+        login_id, start_date, end_date, len(categories))
+    statistics = {
+        'categories': categories,
+        'total_amount': total_amount,
+        'transactions_count': transactions_count,
+        'average_transaction': (
+            total_amount / transactions_count if transactions_count else 0),
+        'top_category': categories[0][0] if categories else 'Нет данных',
+    }
+    stats_cache.put(key, statistics, generation)
+    return statistics
+
+
+def get_statistics_message(login_id: int, period_data: dict) -> str:
+    """
+    Возвращает готовое сообщение со статистикой, используя кэш.
+    """
+    start_date, end_date = period_bounds(period_data)
+    key = (login_id, start_date, end_date, 'message')
+    message = stats_cache.get(key)
+    if message is None:
+        generation = stats_cache.generation(login_id)
+        statistics = get_statistics(login_id, period_data)
+        message = format_statistics_message(
+            period_data, statistics['categories'], statistics)
+        stats_cache.put(key, message, generation)
+    return message
 
 
 def get_expenses_statistics(period_data: dict) -> List[Tuple]:
@@ -41,59 +155,10 @@ def get_expenses_statistics(period_data: dict) -> List[Tuple]:
     Получает статистику трат за указанный период.
     """
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-        # даты сначала конвертируем из человекочитаемого формата в формат SQL
-        start_date = (datetime.strptime(period_data['start_date'],
-                                        '%d.%m.%Y').strftime('%Y-%m-%d'))
-        end_date = (datetime.strptime(period_data['end_date'],
-                                      '%d.%m.%Y').strftime('%Y-%m-%d'))
-
-        logger.info(f'  ПОИСК СТАТИСТИКИ:')
-        logger.info(f'   Username: {period_data['username']}')
-        logger.info(f'   Период: {start_date} до {end_date}')
-
-        # ТЕСТ 1: Простой запрос без JOIN
-        test_query1 = "SELECT * FROM products WHERE created_at BETWEEN ? AND ?"
-        cursor.execute(
-            test_query1, (f'{start_date} 00:00:00', f'{end_date} 23:59:59'))
-        test_results1 = cursor.fetchall()
-        logger.info(
-            f'   ТЕСТ 1 - Простой поиск по дате: {len(test_results1)} записей')
-
-        # ТЕСТ 2: Поиск по username без даты
-        test_query2 = """
-        SELECT p.* FROM products p
-        JOIN logins l ON p.login_id = l.id
-        WHERE l.name = ?
-        """
-        cursor.execute(test_query2, (period_data['username'],))
-        test_results2 = cursor.fetchall()
-        logger.info(
-            f'   ТЕСТ 2 - Поиск по пользователю: {len(test_results2)} записей')
-
-        # ТЕСТ 3: Полный запрос
-        query = """
-        SELECT
-            c.name as category,
-            SUM(p.price) as total_amount,
-            COUNT(p.id) as transactions_count
-        FROM products p
-        JOIN logins l ON p.login_id = l.id
-        JOIN categories c ON p.category_id = c.id
-        WHERE l.name = ?
-        AND date(p.created_at) BETWEEN ? AND ?
-        GROUP BY c.name
-        ORDER BY total_amount DESC
-        """
-
-        cursor.execute(query, (period_data['username'], start_date, end_date))
-        results = cursor.fetchall()
-
-        logger.info(f' РЕЗУЛЬТАТЫ ПОИСКА: {len(results)}')
-
-        conn.close()
-        return results
+        login_id = get_user_id(period_data['username'])
+        if login_id is None:
+            return []
+        return get_statistics(login_id, period_data)['categories']
 
     except Exception as e:
         logger.error(f"❌ Ошибка в get_expenses_statistics: {e}")
@@ -107,48 +172,17 @@ def get_total_statistics(period_data: dict) -> dict:
     Получает общую статистику за период.
     """
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-
-        start_date = (datetime.strptime(period_data['start_date'],
-                                        '%d.%m.%Y').strftime('%Y-%m-%d'))
-        end_date = (datetime.strptime(period_data['end_date'],
-                                      '%d.%m.%Y').strftime('%Y-%m-%d'))
-
-        query = """
-        SELECT
-            SUM(p.price) as total_amount,
-            COUNT(p.id) as transactions_count,
-            AVG(p.price) as average_transaction,
-            (SELECT c.name FROM products p2
-             JOIN categories c ON p2.category_id = c.id
-             JOIN logins l ON p2.login_id = l.id
-             WHERE l.name = ? AND date(p2.created_at) BETWEEN ? AND ?
-             GROUP BY c.name ORDER BY SUM(p2.price) DESC LIMIT 1) as top_category
-        FROM products p
-        JOIN logins l ON p.login_id = l.id
-        WHERE l.name = ?
-        AND date(p.created_at) BETWEEN ? AND ?
-        """
-
-        cursor.execute(query, (
-            period_data['username'], start_date, end_date,
-            period_data['username'], start_date, end_date
-        ))
-
-        result = cursor.fetchone()
-        conn.close()
-
-        if result and result[0] is not None:
-            return {
-                'total_amount': result[0] or 0,
-                'top_category': result[3] or 'Нет данных'
-            }
-        else:
+        login_id = get_user_id(period_data['username'])
+        if login_id is None:
             return {
                 'total_amount': 0,
                 'top_category': 'Нет данных'
             }
+        statistics = get_statistics(login_id, period_data)
+        return {
+            'total_amount': statistics['total_amount'],
+            'top_category': statistics['top_category']
+        }
 
     except Exception as e:
         logger.error(f"Ошибка получения общей статистики: {e}")
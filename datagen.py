@@ -0,0 +1,232 @@
+"""
+Генератор синтетической базы со схемой create_base.
+
+Нужен для подбора железа, настройки запросов и замеров bench.py.
+Названия трат берутся из словаря CATEGORY_KEYWORDS, категория
+определяется тем же классификатором, что и в боте. Распределение
+по категориям, число пользователей и трат, длина периода и перекос
+трат к последним дням настраиваются. Траты пишутся в порядке
+created_at, как их записывал бы бот.
+
+Загрузка идет без журнала, индексы и триггеры на products снимаются
+на время вставки и создаются заново после нее, суточные итоги
+daily_spend пересчитываются одним запросом. При одинаковых seed
+и end_date база получается одинаковой.
+
+Запуск:
+    python datagen.py big.sqlite --logins 10000 --products 1000 \\
+        --days 730 --skew 2 --weights food=40,restaurants=15 --seed 1
+"""
+import argparse
+import math
+import os
+import random
+import re
+import sqlite3 as sq
+import time
+from datetime import date, datetime, timedelta, timezone
+from itertools import accumulate
+from typing import Callable, Optional
+
+import log
+import logging
+
+from classifier import classifier
+from config import CATEGORY_KEYWORDS
+from create_base import create_base
+from migrations import DAILY_SPEND_BACKFILL
+
+# Доля трат по категориям, если не задано --weights
+DEFAULT_WEIGHTS = {
+    'food': 35, 'restaurants': 12, 'transport': 10, 'shopping': 8,
+    'utilities': 6, 'entertainment': 5, 'home': 5, 'auto': 4,
+    'pharmacy': 3, 'medicine': 3, 'beauty': 3, 'education': 2,
+    'travels': 2, 'credits': 1, 'other': 1,
+}
+# Медиана суммы траты по категории, суммы распределены логнормально
+PRICE_MEDIANS = {
+    'food': 600, 'restaurants': 900, 'transport': 250, 'shopping': 2500,
+    'utilities': 3000, 'entertainment': 1200, 'home': 1500, 'auto': 2500,
+    'pharmacy': 500, 'medicine': 3000, 'beauty': 1500, 'education': 4000,
+    'travels': 12000, 'credits': 15000, 'other': 500,
+}
+PRICE_SIGMA = 0.8
+# Перекос активности пользователей: чем меньше, тем сильнее
+USER_ACTIVITY_ALPHA = 1.5
+CHUNK_SIZE = 100000
+
+
+def keyword_word(pattern: str) -> str:
+    """Превращает шаблон вида r'мяс[оа]' или r'чеснок[а]?' в слово."""
+    word = re.sub(r'\[[^\]]*\]\?', '', pattern)
+    return re.sub(r'\[([^\]])[^\]]*\]', r'\1', word)
+
+
+def build_vocabulary() -> dict[str, list[tuple[str, str]]]:
+    """Слова по категориям словаря вместе с категорией от классификатора."""
+    vocabulary = {}
+    for name, patterns in CATEGORY_KEYWORDS.items():
+        words = sorted({keyword_word(pattern) for pattern in patterns})
+        vocabulary[name] = [(word, classifier.classify(word)) for word in words]
+    return vocabulary
+
+
+def day_counts(total: int, days: int, skew: float) -> list[int]:
+    """Делит total трат по дням, от самого старого к сегодняшнему.
+
+    Вес дня растет к концу периода как x ** (skew - 1), skew = 1 дает
+    равномерное распределение, больше 1 - перекос к последним дням.
+    """
+    weights = [((day + 0.5) / days) ** (skew - 1) for day in range(days)]
+    scale = total / sum(weights)
+    counts = []
+    carry = 0.0
+    for weight in weights:
+        exact = weight * scale + carry
+        count = int(exact)
+        carry = exact - count
+        counts.append(count)
+    counts[-1] += total - sum(counts)
+    return counts
+
+
+def parse_weights(text: str) -> dict[str, float]:
+    """'food=40,restaurants=15' -> словарь весов."""
+    weights = {}
+    for item in text.split(','):
+        name, _, value = item.partition('=')
+        if name.strip() not in CATEGORY_KEYWORDS:
+            raise ValueError(f'Неизвестная категория {name}')
+        weights[name.strip()] = float(value)
+    return weights
+
+
+def generate(path: str, logins: int = 1000, products: int = 1000,
+             days: int = 365, skew: float = 1.0,
+             weights: Optional[dict[str, float]] = None, seed: int = 42,
+             end_date: Optional[date] = None, chunk_size: int = CHUNK_SIZE,
+             progress: Callable[[int, int], None] = None) -> int:
+    """Создает базу path с logins * products тратами, возвращает их число.
+
+    products - среднее число трат на пользователя, активность
+    пользователей распределена по Парето.
+    """
+    rng = random.Random(seed)
+    end_date = end_date or datetime.now(timezone.utc).date()
+    weights = weights or DEFAULT_WEIGHTS
+    total = logins * products
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    create_base(path)
+    con = sq.connect(path)
+    try:
+        con.execute('PRAGMA journal_mode = OFF')
+        con.execute('PRAGMA synchronous = OFF')
+        con.execute('PRAGMA cache_size = -262144')
+        category_ids = dict(con.execute('SELECT name, id FROM categories'))
+
+        # Индексы и триггеры мешают быстрой вставке, создаем их в конце.
+        deferred = con.execute(
+            "SELECT type, name, sql FROM sqlite_master "
+            "WHERE tbl_name = 'products' AND type IN ('index', 'trigger') "
+            "AND sql IS NOT NULL").fetchall()
+        for kind, name, _ in deferred:
+            con.execute(f'DROP {kind.upper()} {name}')
+
+        con.executemany('INSERT INTO logins(name) VALUES(?)',
+                        [(f'user{number}',) for number in range(logins)])
+        con.commit()
+
+        vocabulary = build_vocabulary()
+        names = [name for name in weights if vocabulary.get(name)]
+        category_cum = list(accumulate(weights[name] for name in names))
+        user_cum = list(accumulate(
+            rng.paretovariate(USER_ACTIVITY_ALPHA) for _ in range(logins)))
+        mu = {name: math.log(PRICE_MEDIANS.get(name, 500)) for name in names}
+
+        start = end_date - timedelta(days=days - 1)
+        written = 0
+        chunk = []
+        started = time.monotonic()
+        for offset, count in enumerate(day_counts(total, days, skew)):
+            if not count:
+                continue
+            day = (start + timedelta(days=offset)).isoformat()
+            users = rng.choices(range(logins), cum_weights=user_cum, k=count)
+            categories = rng.choices(names, cum_weights=category_cum, k=count)
+            seconds = sorted(rng.randrange(86400) for _ in range(count))
+            for user, name, second in zip(users, categories, seconds):
+                word, category = rng.choice(vocabulary[name])
+                price = max(1, round(rng.lognormvariate(mu[name], PRICE_SIGMA)))
+                chunk.append((
+                    word, price, user + 1, category_ids[category],
+                    f'{day} {second // 3600:02d}:{second // 60 % 60:02d}:'
+                    f'{second % 60:02d}'))
+            if len(chunk) >= chunk_size:
+                con.executemany(
+                    'INSERT INTO products'
+                    '(title, price, login_id, category_id, created_at)'
+                    'VALUES(?,?,?,?,?)', chunk)
+                con.commit()
+                written += len(chunk)
+                chunk = []
+                if progress:
+                    progress(written, total)
+        if chunk:
+            con.executemany(
+                'INSERT INTO products'
+                '(title, price, login_id, category_id, created_at)'
+                'VALUES(?,?,?,?,?)', chunk)
+            written += len(chunk)
+        con.commit()
+        loaded = time.monotonic() - started
+
+        for _, _, sql in deferred:
+            con.execute(sql)
+        con.execute('DELETE FROM daily_spend')
+        con.execute(DAILY_SPEND_BACKFILL)
+        con.execute('ANALYZE')
+        con.commit()
+        con.execute('PRAGMA journal_mode = WAL')
+    finally:
+        con.close()
+    logging.info(
+        f'Сгенерировано {written} трат в {path}: вставка {loaded:.1f} с, '
+        f'всего {time.monotonic() - started:.1f} с')
+    return written
+
+
+def print_progress(written: int, total: int) -> None:
+    print(f'\rЗаписано {written} из {total} трат', end='', flush=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Генерация синтетической базы трат.')
+    parser.add_argument('path', help='файл создаваемой базы')
+    parser.add_argument('--logins', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=1000,
+                        help='среднее число трат на пользователя')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help='перекос трат к последним дням, 1 - равномерно')
+    parser.add_argument('--weights', type=parse_weights,
+                        help='доли категорий, например food=40,restaurants=15')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--end-date', type=date.fromisoformat,
+                        help='последний день периода ГГГГ-ММ-ДД, '
+                             'по умолчанию сегодня')
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    written = generate(
+        args.path, logins=args.logins, products=args.products,
+        days=args.days, skew=args.skew, weights=args.weights,
+        seed=args.seed, end_date=args.end_date, progress=print_progress)
+    print(f'\nГотово: {written} трат за {time.monotonic() - started:.1f} с')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Раздача обновлений по рабочим потокам с учетом чата.
+
+Каждый чат всегда попадает в один и тот же поток (шард), поэтому его
+сообщения обрабатываются строго по порядку, а разные чаты - параллельно.
+Медленная статистика или котик в одном чате не задерживают чаты
+из других шардов.
+"""
+import queue
+import threading
+import time
+from typing import Callable
+
+import log
+import logging
+
+from config import DISPATCH_WORKERS, DISPATCH_QUEUE_SIZE
+
+# Маркер остановки потока шарда
+_STOP = object()
+
+
+class _Shard:
+    """Очередь и поток одного шарда со счетчиками."""
+
+    def __init__(self, number: int, maxsize: int):
+        self.number = number
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.processed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.thread = threading.Thread(
+            target=self._run, name=f'chat-shard-{number}', daemon=True)
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            enqueued, func, args = item
+            wait = time.monotonic() - enqueued
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            try:
+                func(*args)
+            except Exception as error:
+                self.failed += 1
+                logging.error(
+                    f'Ошибка обработчика в шарде {self.number}: {error}')
+            self.processed += 1
+
+    def stats(self) -> dict:
+        return {
+            'shard': self.number,
+            'depth': self.queue.qsize(),
+            'processed': self.processed,
+            'failed': self.failed,
+            'avg_wait': self.total_wait / self.processed if self.processed else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+
+class ChatDispatcher:
+    """Фиксированный пул потоков, разделенный по chat_id."""
+
+    def __init__(self, workers: int = DISPATCH_WORKERS,
+                 queue_size: int = DISPATCH_QUEUE_SIZE):
+        self._shards = [_Shard(number, queue_size) for number in range(workers)]
+        self._started = False
+
+    def start(self) -> None:
+        if not self._started:
+            for shard in self._shards:
+                shard.thread.start()
+            self._started = True
+            logging.info(f'Диспетчер запущен, шардов: {len(self._shards)}')
+
+    def submit(self, chat_id: int, func: Callable, *args) -> None:
+        """Ставит вызов func(*args) в очередь шарда этого чата.
+
+        Если очередь шарда заполнена, вызов ждет - это и есть
+        ограничение скорости приема обновлений.
+        """
+        shard = self._shards[chat_id % len(self._shards)]
+        shard.queue.put((time.monotonic(), func, args))
+
+    def stop(self) -> None:
+        """Дожидается обработки очередей и останавливает потоки."""
+        if not self._started:
+            return
+        for shard in self._shards:
+            shard.queue.put(_STOP)
+        for shard in self._shards:
+            shard.thread.join()
+        self._started = False
+        logging.info('Диспетчер остановлен')
+
+    def stats(self) -> list[dict]:
+        """Глубина очереди и время ожидания по каждому шарду."""
+        return [shard.stats() for shard in self._shards]
+
+
+def update_chat_id(update) -> int:
+    """Чат, к которому относится обновление Telegram.
+
+    Для обновлений без чата возвращает update_id, чтобы они
+    просто распределялись по шардам.
+    """
+    for field in ('message', 'edited_message', 'channel_post',
+                  'edited_channel_post'):
+        message = getattr(update, field, None)
+        if message is not None:
+            return message.chat.id
+    callback = getattr(update, 'callback_query', None)
+    if callback is not None and callback.message is not None:
+        return callback.message.chat.id
+    return update.update_id
@@ -0,0 +1,100 @@
+"""
+Выгрузка всей истории трат пользователя в CSV.
+
+Траты читаются курсором порциями в порядке created_at и сразу
+пишутся в файл, поэтому память не зависит от числа записей.
+Колонки совпадают с форматом importer.py, выгрузку можно загрузить
+обратно: дата пишется в ISO 8601 с явным смещением +00:00, и импорт
+не сдвигает ее повторно на системный пояс. Используется командой /export и из консоли:
+    python exporter.py --login username -o expenses.csv.gz --gzip
+"""
+import argparse
+import csv
+import gzip
+import os
+import shutil
+import tempfile
+
+import log
+import logging
+
+from config import EXPORT_FETCH_SIZE
+from connection import reader
+from database_handler import get_user_id
+
+EXPORT_COLUMNS = ('date', 'title', 'amount', 'category')
+
+EXPORT_QUERY = '''
+SELECT strftime('%Y-%m-%dT%H:%M:%S+00:00', p.created_at),
+       p.title, p.price, c.name
+FROM products p
+JOIN categories c ON c.id = p.category_id
+WHERE p.login_id = ?
+ORDER BY p.created_at, p.id
+'''
+
+
+def write_export(login_id: int, path: str, compress: bool = False) -> int:
+    """Пишет траты пользователя в CSV (или .csv.gz), возвращает число строк."""
+    opener = gzip.open if compress else open
+    rows = 0
+    with opener(path, 'wt', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(EXPORT_COLUMNS)
+        with reader() as con:
+            cursor = con.execute(EXPORT_QUERY, (login_id,))
+            cursor.arraysize = EXPORT_FETCH_SIZE
+            while True:
+                chunk = cursor.fetchmany()
+                if not chunk:
+                    break
+                writer.writerows(chunk)
+                rows += len(chunk)
+    logging.info(f'Выгружено {rows} трат пользователя {login_id} в {path}')
+    return rows
+
+
+def make_export(username: str, compress: bool = False):
+    """Выгружает траты во временный файл для отправки в Telegram.
+
+    Возвращает (путь, имя файла для пользователя, число строк)
+    или None, если пользователя нет в базе. Файл удаляется remove_export.
+    """
+    login_id = get_user_id(username)
+    if login_id is None:
+        return None
+    name = f'expenses_{username}.csv' + ('.gz' if compress else '')
+    path = os.path.join(tempfile.mkdtemp(prefix='export_'), name)
+    try:
+        rows = write_export(login_id, path, compress)
+    except Exception:
+        remove_export(path)
+        raise
+    return path, name, rows
+
+
+def remove_export(path: str) -> None:
+    """Удаляет временный файл выгрузки вместе с его каталогом."""
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Выгрузка истории трат пользователя в CSV.')
+    parser.add_argument('--login', required=True, help='логин Telegram')
+    parser.add_argument('-o', '--output',
+                        help='файл выгрузки, по умолчанию expenses_<логин>.csv')
+    parser.add_argument('--gzip', action='store_true', help='сжать gzip')
+    args = parser.parse_args()
+
+    login_id = get_user_id(args.login)
+    if login_id is None:
+        parser.exit(1, f'Пользователь {args.login} не найден\n')
+    output = args.output or (
+        f'expenses_{args.login}.csv' + ('.gz' if args.gzip else ''))
+    rows = write_export(login_id, output, args.gzip)
+    print(f'Выгружено {rows} трат в {output}')
+
+
+if __name__ == '__main__':
+    main()
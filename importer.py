@@ -0,0 +1,310 @@
+"""
+Массовый импорт прошлых трат из CSV или выписки банка.
+
+Файл читается построчно, категории определяются пачками так же, как
+для сообщений бота: сначала выученные категории пользователя
+(category_memo), затем классификатор. Траты записываются executemany
+порциями по IMPORT_CHUNK_SIZE строк в отдельных транзакциях.
+Дата траты из файла переводится из часового пояса выписки (--timezone,
+по умолчанию системный) в UTC и сохраняется в created_at, как
+CURRENT_TIMESTAMP у трат из бота. Явное смещение в дате (выгрузка
+exporter.py) важнее --timezone. Дата без времени не переводится:
+трата остается в своем календарном дне, время ставится полдень.
+После каждой порции в таблицу imports пишется позиция в файле, поэтому
+повторный запуск продолжает импорт с места сбоя. Память не зависит
+от размера файла.
+
+Запуск:
+    python importer.py expenses.csv --login username
+    python importer.py statement.csv --login username --delimiter ';' \\
+        --date-column 'Дата операции' --title-column 'Описание' \\
+        --amount-column 'Сумма' --encoding cp1251 --only-negative \\
+        --timezone Europe/Moscow
+"""
+import argparse
+import csv
+import itertools
+import os
+import sqlite3 as sq
+import time
+from datetime import datetime, timezone, tzinfo
+from typing import Callable, Iterator, Optional
+from zoneinfo import ZoneInfo
+
+import log
+import logging
+
+from classifier import classifier
+from config import OTHER_CATEGORY_ID, IMPORT_CHUNK_SIZE
+from connection import writer
+from cache import login_ids, stats_cache, warm_categories
+from category_memo import lookup
+from data_income import EMPTY_TITLE
+from database import get_category_id, get_login_id, insert_login
+from migrations import migrate
+
+# Форматы дат, которые встречаются в выгрузках банков
+DATE_FORMATS = (
+    '%Y-%m-%dT%H:%M:%S%z',
+    '%Y-%m-%d %H:%M:%S%z',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d',
+    '%d.%m.%Y %H:%M:%S',
+    '%d.%m.%Y %H:%M',
+    '%d.%m.%Y',
+    '%d/%m/%Y',
+)
+# Форматы без времени: у такой даты нет часового пояса
+DATE_ONLY_FORMATS = {'%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y'}
+
+
+def parse_date(value: str, source_tz: tzinfo = None) -> Optional[str]:
+    """Приводит дату к формату CURRENT_TIMESTAMP (UTC) или возвращает None.
+
+    Дата со смещением (выгрузка exporter.py) переводится по нему, дата без
+    смещения считается временем source_tz, None - системного пояса.
+    Дата без времени не сдвигается: иначе полночь в поясе восточнее UTC
+    уходила бы в предыдущий день, а первое число - в прошлый месяц.
+    """
+    value = value.strip()
+    for date_format in DATE_FORMATS:
+        try:
+            moment = datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+        if date_format in DATE_ONLY_FORMATS:
+            return moment.strftime('%Y-%m-%d 12:00:00')
+        if moment.tzinfo is None and source_tz is not None:
+            moment = moment.replace(tzinfo=source_tz)
+        return moment.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    return None
+
+
+def parse_amount(value: str) -> Optional[float]:
+    """Разбирает сумму вида '-1 234,50' или '1234.5'."""
+    value = (value.strip().replace('\xa0', '').replace(' ', '')
+             .replace(',', '.'))
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class ImportStats:
+    """Счетчики одного импорта."""
+
+    def __init__(self, position: int = 0, imported: int = 0,
+                 skipped: int = 0):
+        self.position = position
+        self.imported = imported
+        self.skipped = skipped
+        self.started = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.imported / elapsed if elapsed else 0.0
+
+
+class CsvImporter:
+    """Потоковый импорт трат одного пользователя из CSV-файла."""
+
+    def __init__(self, path: str, login: str,
+                 date_column: str = 'date', title_column: str = 'title',
+                 amount_column: str = 'amount', delimiter: str = None,
+                 encoding: str = 'utf-8-sig', only_negative: bool = False,
+                 source_tz: str = None,
+                 chunk_size: int = IMPORT_CHUNK_SIZE,
+                 progress: Callable[[ImportStats], None] = None):
+        self.path = path
+        self.login = login
+        self.date_column = date_column
+        self.title_column = title_column
+        self.amount_column = amount_column
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.only_negative = only_negative
+        self.source_tz = ZoneInfo(source_tz) if source_tz else None
+        self.chunk_size = chunk_size
+        self.progress = progress
+        # Ключ позиции: один и тот же файл разных пользователей
+        # импортируется независимо.
+        self.source = f'{os.path.abspath(path)}:{login}'
+
+    def _rows(self, file) -> Iterator[dict]:
+        delimiter = self.delimiter
+        if delimiter is None:
+            sample = file.read(64 * 1024)
+            file.seek(0)
+            try:
+                delimiter = csv.Sniffer().sniff(sample, ',;\t|').delimiter
+            except csv.Error:
+                delimiter = ','
+        reader = csv.DictReader(file, delimiter=delimiter)
+        missing = {self.date_column, self.title_column,
+                   self.amount_column} - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(
+                f'В файле нет колонок: {", ".join(sorted(missing))}')
+        return reader
+
+    def _parse(self, row: dict) -> Optional[tuple[str, int, str]]:
+        """Строка файла -> (статья трат, цена, created_at) или None."""
+        created_at = parse_date(row.get(self.date_column) or '',
+                                self.source_tz)
+        amount = parse_amount(row.get(self.amount_column) or '')
+        title = (row.get(self.title_column) or '').strip()
+        if created_at is None or amount is None:
+            return None
+        if self.only_negative and amount >= 0:
+            return None
+        price = round(abs(amount))
+        if not price:
+            return None
+        return title or EMPTY_TITLE, price, created_at
+
+    def _prepare(self) -> tuple[int, ImportStats]:
+        """Находит или создает логин и позицию прошлого импорта."""
+        created = False
+        with writer() as con:
+            warm_categories(con)
+            cur = con.cursor()
+            login_id = get_login_id(cur, self.login)
+            if login_id is None:
+                login_id = insert_login(cur, self.login)
+                if login_id is None:
+                    raise sq.DatabaseError(
+                        f'Не удалось создать логин {self.login}')
+                created = True
+            cur.execute(
+                'INSERT INTO imports(source, login_id) VALUES(?, ?) '
+                'ON CONFLICT(source) DO NOTHING', (self.source, login_id))
+            position, imported, skipped = cur.execute(
+                'SELECT position, imported, skipped FROM imports '
+                'WHERE source = ?', (self.source,)).fetchone()
+        if created:
+            login_ids.put(self.login, login_id)
+        return login_id, ImportStats(position, imported, skipped)
+
+    def _write_chunk(self, login_id: int, chunk: list[tuple[str, int, str]],
+                     consumed: int, stats: ImportStats) -> None:
+        """Пишет порцию и новую позицию в файле одной транзакцией."""
+        # Как в data_parse_many: выученная категория важнее шаблонов.
+        learned = [lookup(self.login, title) for title, _, _ in chunk]
+        guessed = iter(classifier.classify_many(
+            title for (title, _, _), category in zip(chunk, learned)
+            if category is None))
+        categories = [category or next(guessed) for category in learned]
+        with writer() as con:
+            cur = con.cursor()
+            rows = []
+            for (title, price, created_at), category_name in zip(
+                    chunk, categories):
+                category_id = get_category_id(cur, category_name)
+                if category_id is None:
+                    category_id = OTHER_CATEGORY_ID
+                rows.append((title, price, login_id, category_id, created_at))
+            cur.executemany(
+                'INSERT INTO products'
+                '(title, price, login_id, category_id, created_at)'
+                'VALUES(?,?,?,?,?)',
+                rows
+            )
+            skipped = stats.skipped + consumed - len(chunk)
+            cur.execute(
+                'UPDATE imports SET position = ?, imported = ?, skipped = ?, '
+                'updated_at = CURRENT_TIMESTAMP WHERE source = ?',
+                (stats.position + consumed, stats.imported + len(chunk),
+                 skipped, self.source))
+        stats.position += consumed
+        stats.imported += len(chunk)
+        stats.skipped = skipped
+        for day in {created_at[:10] for _, _, created_at in chunk}:
+            stats_cache.invalidate(login_id, day)
+        if self.progress:
+            self.progress(stats)
+
+    def run(self, restart: bool = False) -> ImportStats:
+        """Импортирует файл, продолжая с сохраненной позиции.
+
+        restart=True начинает файл заново, уже загруженные строки
+        при этом будут добавлены повторно.
+        """
+        if restart:
+            with writer() as con:
+                con.execute('DELETE FROM imports WHERE source = ?',
+                            (self.source,))
+        login_id, stats = self._prepare()
+        if stats.position:
+            logging.info(
+                f'Импорт {self.source} продолжается со строки {stats.position}')
+        with open(self.path, newline='', encoding=self.encoding) as file:
+            rows = itertools.islice(self._rows(file), stats.position, None)
+            chunk = []
+            consumed = 0
+            for row in rows:
+                consumed += 1
+                parsed = self._parse(row)
+                if parsed is not None:
+                    chunk.append(parsed)
+                if consumed >= self.chunk_size:
+                    self._write_chunk(login_id, chunk, consumed, stats)
+                    chunk = []
+                    consumed = 0
+            if consumed:
+                self._write_chunk(login_id, chunk, consumed, stats)
+        logging.info(
+            f'Импорт {self.source} завершен: добавлено {stats.imported}, '
+            f'пропущено {stats.skipped}')
+        return stats
+
+
+def print_progress(stats: ImportStats) -> None:
+    print(f'\rСтрок: {stats.position}, добавлено: {stats.imported}, '
+          f'пропущено: {stats.skipped}, {stats.rate:.0f} строк/с',
+          end='', flush=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Импорт прошлых трат из CSV или выписки банка.')
+    parser.add_argument('path', help='CSV-файл с тратами')
+    parser.add_argument('--login', required=True,
+                        help='логин Telegram, которому принадлежат траты')
+    parser.add_argument('--date-column', default='date')
+    parser.add_argument('--title-column', default='title')
+    parser.add_argument('--amount-column', default='amount')
+    parser.add_argument('--delimiter',
+                        help='разделитель, по умолчанию определяется по файлу')
+    parser.add_argument('--encoding', default='utf-8-sig')
+    parser.add_argument('--only-negative', action='store_true',
+                        help='брать только списания (отрицательные суммы)')
+    parser.add_argument('--timezone',
+                        help='часовой пояс дат в файле, например '
+                             'Europe/Moscow; по умолчанию системный')
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument('--restart', action='store_true',
+                        help='начать файл заново вместо продолжения')
+    args = parser.parse_args()
+
+    with writer() as con:
+        migrate(con)
+    importer = CsvImporter(
+        args.path, args.login,
+        date_column=args.date_column,
+        title_column=args.title_column,
+        amount_column=args.amount_column,
+        delimiter=args.delimiter,
+        encoding=args.encoding,
+        only_negative=args.only_negative,
+        source_tz=args.timezone,
+        chunk_size=args.chunk_size,
+        progress=print_progress,
+    )
+    stats = importer.run(restart=args.restart)
+    print(f'\nГотово: добавлено {stats.imported}, пропущено {stats.skipped}')
+
+
+if __name__ == '__main__':
+    main()
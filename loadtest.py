@@ -0,0 +1,483 @@
+"""
+Нагрузочный прогон бота без Telegram.
+
+FakeBotApi - локальная замена Bot API: отдает обновления через
+getUpdates и принимает ответы бота (sendMessage, sendPhoto,
+editMessageText, deleteMessage, setMyCommands и др.). LoadDriver
+проигрывает сценарий от множества чатов: /start, траты, /stats
+с выбором недели и произвольного периода. Каждый чат ждет все ответы
+на свой шаг и только потом отправляет следующий, время от отправки
+обновления до последнего ответа на него - задержка шага.
+
+bot.py запускается отдельным процессом во временном каталоге со своей
+базой, адрес Bot API подменяется через TELEGRAM_API_URL. В режиме
+webhook обновления отправляются на webhook бота, а не через getUpdates.
+Переменные режима передаются явно, чтобы .env бота их не подменил,
+а пауза между getUpdates по умолчанию 0 и не попадает в задержки.
+
+После прогона бот останавливается и считаются строки products в его
+базе. Если записано не столько трат, сколько отправлено, пришли лишние
+ответы или не все чаты дошли до конца, отчет помечается valid: false
+с причинами, а запуск завершается с кодом 1: задержки по такому
+трафику ничего не значат.
+
+Запуск:
+    python loadtest.py --chats 200 --rounds 3 -o loadtest.json
+    python loadtest.py --chats 200 --mode webhook
+"""
+import argparse
+import itertools
+import json
+import os
+import queue
+import re
+import shutil
+import signal
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+from create_base import create_base
+from webhook import post_update
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+TOKEN = '123456:loadtest'
+# Методы, ответ на которые считается ответом чату
+REPLY_METHODS = {'sendMessage', 'sendPhoto', 'sendDocument',
+                 'editMessageText', 'deleteMessage'}
+
+
+class FakeBotApi:
+    """Локальный HTTP сервер, отвечающий как Bot API."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 on_reply: Callable[[int, str, dict], None] = None):
+        self.on_reply = on_reply
+        self.calls = {}
+        self._calls_lock = threading.Lock()
+        self.ready = threading.Event()
+        self._updates = []
+        self._next_update_id = 1
+        self._next_message_id = itertools.count(1)
+        self._condition = threading.Condition()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def api_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/bot{{0}}/{{1}}'
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name='fake-bot-api', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def call_counts(self) -> dict:
+        """Сколько раз вызывался каждый метод Bot API."""
+        with self._calls_lock:
+            return dict(self.calls)
+
+    def push_update(self, update: dict) -> None:
+        """Ставит обновление в очередь getUpdates."""
+        with self._condition:
+            update['update_id'] = self._next_update_id
+            self._next_update_id += 1
+            self._updates.append(update)
+            self._condition.notify_all()
+
+    def _get_updates(self, params: dict) -> list:
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            # Подтвержденные offset обновления больше не отдаются.
+            self._updates = [update for update in self._updates
+                             if update['update_id'] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return self._updates[:limit]
+
+    def _message(self, chat_id: int, params: dict) -> dict:
+        message = {
+            'message_id': int(params.get('message_id')
+                              or next(self._next_message_id)),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'bot'},
+        }
+        if 'text' in params:
+            message['text'] = params['text']
+        return message
+
+    def _call(self, method: str, params: dict):
+        """Результат метода Bot API."""
+        # Запросы обрабатываются в разных потоках сервера.
+        with self._calls_lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'getUpdates':
+            self.ready.set()
+            return self._get_updates(params)
+        if method == 'setWebhook':
+            self.ready.set()
+            return True
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'bot',
+                    'username': 'loadtest_bot'}
+        if method not in REPLY_METHODS:
+            return True
+        chat_id = int(params.get('chat_id') or 0)
+        if self.on_reply:
+            self.on_reply(chat_id, method, params)
+        if method == 'deleteMessage':
+            return True
+        message = self._message(chat_id, params)
+        if method == 'sendPhoto':
+            file_id = f'photo-{message["message_id"]}'
+            message['photo'] = [{'file_id': file_id,
+                                 'file_unique_id': file_id,
+                                 'width': 600, 'height': 400}]
+        elif method == 'sendDocument':
+            message['document'] = {'file_id': f'doc-{message["message_id"]}',
+                                   'file_unique_id': 'doc'}
+        return message
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                parts = urlsplit(self.path)
+                method = parts.path.rsplit('/', 1)[-1]
+                params = dict(parse_qsl(parts.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                params.update(parse_body(
+                    self.headers.get('Content-Type', ''), body))
+                payload = json.dumps(
+                    {'ok': True, 'result': api._call(method, params)}
+                ).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def parse_body(content_type: str, body: bytes) -> dict:
+    """Параметры запроса из тела: форма, JSON или multipart."""
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    if content_type.startswith('application/x-www-form-urlencoded'):
+        return dict(parse_qsl(body.decode('utf-8')))
+    if content_type.startswith('multipart/form-data'):
+        # Файлы не нужны, берем только простые текстовые поля.
+        fields = re.findall(
+            rb'name="([^"]+)"\r\n\r\n(.*?)\r\n--', body, re.DOTALL)
+        return {name.decode(): value.decode('utf-8', 'replace')
+                for name, value in fields}
+    return {}
+
+
+def message_update(chat_id: int, text: str) -> dict:
+    user = {'id': chat_id, 'is_bot': False, 'first_name': f'user{chat_id}',
+            'username': f'user{chat_id}'}
+    message = {
+        'message_id': int(time.time() * 1000) % 2 ** 31,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private',
+                 'username': user['username'], 'first_name': user['first_name']},
+        'from': user,
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [
+            {'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+    return {'message': message}
+
+
+def callback_update(chat_id: int, data: str) -> dict:
+    update = message_update(chat_id, '📊 Выберите период для статистики:')
+    message = update['message']
+    return {'callback_query': {
+        'id': str(message['message_id']),
+        'from': message['from'],
+        'chat_instance': str(chat_id),
+        'message': message,
+        'data': data,
+    }}
+
+
+# Шаг сценария: (название, обновление по chat_id, ожидаемое число ответов)
+SCRIPT = [
+    ('start', lambda chat_id: message_update(chat_id, '/start'), 1),
+    ('expense', lambda chat_id: message_update(chat_id, 'молоко хлеб 230'), 1),
+    ('expense', lambda chat_id: message_update(chat_id, 'такси 640'), 1),
+    ('expense', lambda chat_id: message_update(chat_id, 'кино 700'), 1),
+    ('expense_multi',
+     lambda chat_id: message_update(chat_id, 'мясо 1500 хлеб 80 такси 400'), 1),
+    ('stats', lambda chat_id: message_update(chat_id, '/stats'), 1),
+    ('stats_week', lambda chat_id: callback_update(chat_id, 'stats_week'), 2),
+    ('stats', lambda chat_id: message_update(chat_id, '/stats'), 1),
+    ('stats_custom', lambda chat_id: callback_update(chat_id, 'stats_custom'), 1),
+    ('custom_dates',
+     lambda chat_id: message_update(chat_id, '01.01.2024-31.12.2030'), 2),
+]
+# Сколько строк products добавляет шаг сценария
+SPENDS = {'expense': 1, 'expense_multi': 3}
+
+
+class _Chat:
+    def __init__(self, chat_id: int, steps: int):
+        self.chat_id = chat_id
+        self.steps = steps
+        self.step = 0
+        self.remaining = 0
+        self.sent_at = 0.0
+
+
+class LoadDriver:
+    """Проигрывает SCRIPT от chats чатов rounds раз подряд."""
+
+    def __init__(self, send: Callable[[dict], None], chats: int,
+                 rounds: int = 1, senders: int = 4, first_chat: int = 1000):
+        self.send = send
+        self.chats = {chat_id: _Chat(chat_id, len(SCRIPT) * rounds)
+                      for chat_id in range(first_chat, first_chat + chats)}
+        self.latencies = {}
+        self.unexpected = 0
+        self.spends_sent = 0
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+        self._active = len(self.chats)
+        self._lock = threading.Lock()
+        self._outbox = queue.Queue()
+        self._senders = [threading.Thread(target=self._send_loop, daemon=True)
+                         for _ in range(senders)]
+
+    def _send_loop(self) -> None:
+        while True:
+            update = self._outbox.get()
+            if update is None:
+                break
+            self.send(update)
+
+    def _next(self, chat: _Chat) -> None:
+        name, build, replies = SCRIPT[chat.step % len(SCRIPT)]
+        self.spends_sent += SPENDS.get(name, 0)
+        chat.remaining = replies
+        chat.sent_at = time.perf_counter()
+        self._outbox.put(build(chat.chat_id))
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        for thread in self._senders:
+            thread.start()
+        with self._lock:
+            for chat in self.chats.values():
+                self._next(chat)
+
+    def stop(self) -> None:
+        for _ in self._senders:
+            self._outbox.put(None)
+
+    def on_reply(self, chat_id: int, method: str, params: dict) -> None:
+        with self._lock:
+            chat = self.chats.get(chat_id)
+            if chat is None or chat.remaining <= 0:
+                self.unexpected += 1
+                return
+            chat.remaining -= 1
+            if chat.remaining:
+                return
+            name = SCRIPT[chat.step % len(SCRIPT)][0]
+            self.latencies.setdefault(name, []).append(
+                time.perf_counter() - chat.sent_at)
+            chat.step += 1
+            if chat.step < chat.steps:
+                self._next(chat)
+                return
+            self._active -= 1
+            if not self._active:
+                self.finished = time.perf_counter()
+                self.done.set()
+
+    def report(self) -> dict:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        samples = [value for values in self.latencies.values()
+                   for value in values]
+        return {
+            'chats': len(self.chats),
+            'steps': len(samples),
+            'incomplete_chats': self._active,
+            'unexpected_replies': self.unexpected,
+            'spends_sent': self.spends_sent,
+            'elapsed_s': elapsed,
+            'steps_per_s': len(samples) / elapsed if elapsed else 0.0,
+            'latency': latency_summary(samples),
+            'by_step': {name: latency_summary(values)
+                        for name, values in self.latencies.items()},
+        }
+
+
+def latency_summary(samples: list[float]) -> Optional[dict]:
+    """p50/p95/p99/max в миллисекундах."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def quantile(share: float) -> float:
+        return ordered[min(len(ordered) - 1, int(len(ordered) * share))] * 1000
+
+    return {
+        'count': len(ordered),
+        'p50_ms': statistics.median(ordered) * 1000,
+        'p95_ms': quantile(0.95),
+        'p99_ms': quantile(0.99),
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def run(chats: int, rounds: int, mode: str = 'polling',
+        write_behind: bool = False, webhook_port: int = 18443,
+        timeout: float = 600, poll_interval: float = 0) -> dict:
+    """Запускает bot.py против FakeBotApi и проигрывает сценарий."""
+    api = FakeBotApi()
+    workdir = tempfile.mkdtemp(prefix='loadtest_')
+    database = os.path.join(workdir, 'asla.sqlite')
+    create_base(database)
+    env = dict(os.environ, TOKEN=TOKEN, TELEGRAM_API_URL=api.api_url,
+               WRITE_BEHIND='1' if write_behind else '0',
+               POLL_INTERVAL=str(poll_interval))
+    if mode == 'webhook':
+        secret = 'loadtest'
+        webhook_url = f'http://127.0.0.1:{webhook_port}/'
+        env.update(WEBHOOK_URL=webhook_url, WEBHOOK_SECRET=secret,
+                   WEBHOOK_HOST='127.0.0.1', WEBHOOK_PORT=str(webhook_port))
+        update_ids = itertools.count(1)
+
+        def send(update):
+            update['update_id'] = next(update_ids)
+            post_update(webhook_url, update, secret)
+    else:
+        # Пустое значение, а не отсутствие: иначе bot.py возьмет
+        # WEBHOOK_URL из .env.
+        env['WEBHOOK_URL'] = ''
+        send = api.push_update
+
+    driver = LoadDriver(send, chats, rounds)
+    api.on_reply = driver.on_reply
+    api.start()
+    bot = subprocess.Popen(
+        [sys.executable, BOT_PATH], cwd=workdir, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not api.ready.wait(60):
+            raise RuntimeError('Бот не подключился к FakeBotApi')
+        driver.start()
+        driver.done.wait(timeout)
+        # Остановка дописывает очередь записи, после нее база полная,
+        # а запоздалые повторные ответы уже посчитаны.
+        stop_bot(bot)
+        report = driver.report()
+        report.update(mode=mode, write_behind=write_behind,
+                      rows_stored=count_rows(database),
+                      api_calls=api.call_counts())
+        report['problems'] = problems(report)
+        report['valid'] = not report['problems']
+        return report
+    finally:
+        driver.stop()
+        stop_bot(bot)
+        api.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def stop_bot(bot: subprocess.Popen) -> None:
+    if bot.poll() is not None:
+        return
+    bot.send_signal(signal.SIGINT)
+    try:
+        bot.wait(30)
+    except subprocess.TimeoutExpired:
+        bot.kill()
+        bot.wait()
+
+
+def count_rows(database: str) -> int:
+    con = sqlite3.connect(database)
+    try:
+        return con.execute('SELECT COUNT(*) FROM products').fetchone()[0]
+    finally:
+        con.close()
+
+
+def problems(report: dict) -> list[str]:
+    """Причины, по которым цифры прогона нельзя считать верными."""
+    found = []
+    if report['incomplete_chats']:
+        found.append(f'не завершили сценарий {report["incomplete_chats"]} чатов')
+    if report['unexpected_replies']:
+        found.append(f'лишних ответов {report["unexpected_replies"]}')
+    if report['rows_stored'] != report['spends_sent']:
+        found.append(f'записано трат {report["rows_stored"]}, '
+                     f'отправлено {report["spends_sent"]}')
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Нагрузочный прогон bot.py на локальном Bot API.')
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=1,
+                        help='сколько раз каждый чат проходит сценарий')
+    parser.add_argument('--mode', choices=('polling', 'webhook'),
+                        default='polling')
+    parser.add_argument('--write-behind', action='store_true')
+    parser.add_argument('--webhook-port', type=int, default=18443)
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--poll-interval', type=float, default=0,
+                        help='пауза бота между getUpdates, секунд')
+    parser.add_argument('-o', '--output', help='записать отчет в JSON')
+    args = parser.parse_args()
+
+    report = run(args.chats, args.rounds, args.mode, args.write_behind,
+                 args.webhook_port, args.timeout, args.poll_interval)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text)
+    print(text)
+    if not report['valid']:
+        sys.exit('Прогон недействителен: ' + '; '.join(report['problems']))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,112 @@
-"""Правила логирования."""
+"""Правила логирования.
+
+Записи из рабочих потоков попадают в очередь (QueueHandler), а в файл
+их пишет отдельный поток QueueListener, поэтому обработчики не ждут
+диск. Настройка через переменные окружения:
+- LOG_LEVEL - уровень корневого логгера, по умолчанию DEBUG;
+- LOG_LEVELS - уровни отдельных логгеров: 'database=INFO,telebot=WARNING';
+- LOG_FORMAT=json - писать JSON строки вместо текста;
+- LOG_SAMPLE_PER_SEC - сколько DEBUG записей в секунду пропускать
+  с одного места вызова на горячих путях (0 - без ограничения).
+Записи внутри трассы обновления (tracing.py) получают ее trace_id.
+"""
+import atexit
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from tracing import current_trace_id
+
+# Логгеры горячих путей: запись трат и статистика
+SAMPLED_LOGGERS = ('database', 'database_handler')
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'file': record.filename,
+            'line': record.lineno,
+            'func': record.funcName,
+            'thread': record.threadName,
+        }
+        trace_id = getattr(record, 'trace_id', None)
+        if trace_id:
+            data['trace_id'] = trace_id
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            data['suppressed'] = suppressed
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Ограничивает частоту DEBUG записей с одного места вызова.
+
+    За секунду с одной строки кода проходит не больше per_second записей,
+    число отброшенных добавляется к следующей пропущенной записи.
+    """
+
+    def __init__(self, loggers: tuple, per_second: int):
+        super().__init__()
+        self.loggers = loggers
+        self.per_second = per_second
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if (record.levelno > logging.DEBUG
+                or not record.name.startswith(self.loggers)):
+            return True
+        key = (record.pathname, record.lineno)
+        second = int(time.monotonic())
+        with self._lock:
+            window, passed, dropped = self._windows.get(key, (second, 0, 0))
+            if window != second:
+                window, passed = second, 0
+            if passed >= self.per_second:
+                self._windows[key] = (window, passed, dropped + 1)
+                return False
+            self._windows[key] = (window, passed + 1, 0)
+        if dropped:
+            record.suppressed = dropped
+            record.msg = f'{record.msg} (пропущено похожих: {dropped})'
+        return True
+
+
+class TraceIdFilter(logging.Filter):
+    """Запоминает trace_id в потоке, где запись создана."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = current_trace_id()
+        record.trace = f' - trace {record.trace_id}' if record.trace_id else ''
+        return True
+
+
+def parse_levels(text: str) -> dict:
+    """'database=INFO,telebot=WARNING' -> {'database': 'INFO', ...}."""
+    levels = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        name, _, level = item.partition('=')
+        levels[name.strip()] = level.strip().upper()
+    return levels
 
 
 # Получаем корневой логгер
 root_logger = logging.getLogger()
-root_logger.setLevel(logging.DEBUG)
+root_logger.setLevel(os.getenv('LOG_LEVEL', 'DEBUG').upper())
+for name, level in parse_levels(os.getenv('LOG_LEVELS', '')).items():
+    logging.getLogger(name).setLevel(level)
 
 # Создаем обработчик с ротацией
 handler = RotatingFileHandler(
@@ -16,13 +117,28 @@ handler = RotatingFileHandler(
     mode='a'
 )
 
-# Настраиваем формат как в basicConfig
-formatter = logging.Formatter(
-    '%(asctime)s - %(levelname)s - %(message)s '
-    '- %(filename)s:%(lineno)d - %(funcName)s'
-)
+if os.getenv('LOG_FORMAT') == 'json':
+    formatter = JsonFormatter()
+else:
+    # Настраиваем формат как в basicConfig
+    formatter = logging.Formatter(
+        '%(asctime)s - %(levelname)s - %(message)s '
+        '- %(filename)s:%(lineno)d - %(funcName)s%(trace)s'
+    )
 handler.setFormatter(formatter)
 
+# Файл пишет отдельный поток, обработчики только кладут запись в очередь.
+log_queue = queue.SimpleQueue()
+queue_handler = QueueHandler(log_queue)
+queue_handler.addFilter(TraceIdFilter())
+sample_rate = int(os.getenv('LOG_SAMPLE_PER_SEC', '10'))
+if sample_rate:
+    queue_handler.addFilter(SamplingFilter(SAMPLED_LOGGERS, sample_rate))
+listener = QueueListener(log_queue, handler, respect_handler_level=True)
+
 # Очищаем существующие обработчики и добавляем наш
 root_logger.handlers.clear()
-root_logger.addHandler(handler)
+root_logger.addHandler(queue_handler)
+listener.start()
+# При выходе дописываем оставшиеся в очереди записи.
+atexit.register(listener.stop)
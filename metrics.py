@@ -0,0 +1,448 @@
+"""
+Метрики бота в формате Prometheus.
+
+Счетчики и гистограммы задержек:
+- обработчиков сообщений и callback (декоратор track_handler);
+- SQL запросов database и database_handler (sql_timer);
+- API котиков (upstream_timer);
+- вызовов Bot API из синхронного бота (install_telegram_timing).
+
+Те же замеры добавляются отрезками в трассу текущего обновления
+(tracing.py), если она ведется.
+
+Наблюдение - это поиск корзины bisect и пара сложений под блокировкой,
+поэтому метрики можно не выключать в рабочем режиме. Текст метрик
+отдает MetricsServer по /metrics, MetricsDumper периодически пишет
+его в файл.
+"""
+import abc
+import asyncio
+import bisect
+import functools
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+import requests
+import log
+import logging
+
+import tracing
+from config import METRICS_BUCKETS
+
+_metrics = []
+_collectors = []
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _CounterValue:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        # Последняя ячейка - корзина +Inf.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self, span: str = None, category: str = 'app') -> '_Timer':
+        return _Timer(self, span, category)
+
+
+class _Timer:
+    """Контекстный менеджер: пишет время блока в гистограмму.
+
+    Если задан span, блок записывается и отрезком текущей трассы.
+    """
+    __slots__ = ('histogram', 'span', 'category', 'start')
+
+    def __init__(self, histogram: _HistogramValue, span: str = None,
+                 category: str = 'app'):
+        self.histogram = histogram
+        self.span = span
+        self.category = category
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        end = time.perf_counter()
+        self.histogram.observe(end - self.start)
+        if self.span is not None:
+            if exc_type is None:
+                tracing.record(self.span, self.category, self.start, end)
+            else:
+                tracing.record(self.span, self.category, self.start, end,
+                               error=exc_type.__name__)
+        return False
+
+
+class _Metric(abc.ABC):
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._children = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """Значение метрики для нового набора меток."""
+
+    def labels(self, *values):
+        """Значение метрики для набора меток, создается при первом вызове."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}',
+                 f'# TYPE {self.name} {self.kind}']
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def _render_child(self, values, child) -> list[str]:
+        return [f'{self.name}{_format_labels(self.labelnames, values)} '
+                f'{child.value}']
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (),
+                 buckets: tuple = METRICS_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help_text, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def _render_child(self, values, child) -> list[str]:
+        with child._lock:
+            counts = list(child.counts)
+            total, count = child.sum, child.count
+        lines = []
+        cumulative = 0
+        for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            labels = _format_labels(self.labelnames, values, f'le="{le}"')
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f'{self.name}_sum{labels} {total}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+def register_collector(collect: Callable[[], list[str]]) -> None:
+    """Добавляет функцию, отдающую готовые строки метрик при выгрузке."""
+    _collectors.append(collect)
+
+
+def gauge_lines(name: str, help_text: str,
+                samples: list[tuple[dict, float]]) -> list[str]:
+    """Строки gauge для сборщика: samples - пары (метки, значение)."""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+    for labels, value in samples:
+        names, values = tuple(labels), tuple(labels.values())
+        lines.append(f'{name}{_format_labels(names, values)} {value}')
+    return lines
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        try:
+            lines.extend(collect())
+        except Exception as error:
+            logging.error(f'Ошибка сборщика метрик: {error}')
+    return '\n'.join(lines) + '\n'
+
+
+HANDLER_REQUESTS = Counter(
+    'bot_handler_requests_total', 'Вызовы обработчиков бота',
+    ('handler', 'status'))
+HANDLER_LATENCY = Histogram(
+    'bot_handler_latency_seconds', 'Время обработчиков бота', ('handler',))
+SQL_LATENCY = Histogram(
+    'bot_sql_latency_seconds', 'Время SQL запросов', ('statement',))
+UPSTREAM_LATENCY = Histogram(
+    'bot_upstream_latency_seconds', 'Время запросов к внешним API',
+    ('upstream', 'operation'))
+UPSTREAM_ERRORS = Counter(
+    'bot_upstream_errors_total', 'Ошибки запросов к внешним API',
+    ('upstream', 'operation'))
+TELEGRAM_LATENCY = Histogram(
+    'bot_telegram_api_latency_seconds', 'Время вызовов Bot API', ('method',))
+TELEGRAM_ERRORS = Counter(
+    'bot_telegram_api_errors_total', 'Ошибки вызовов Bot API', ('method',))
+
+
+def track_handler(func):
+    """Считает вызовы, ошибки и время обработчика, обычного или async.
+
+    Ставится под декоратором @bot.message_handler/callback_query_handler.
+    """
+    name = func.__name__
+    latency = HANDLER_LATENCY.labels(name)
+    succeeded = HANDLER_REQUESTS.labels(func.__name__, 'ok')
+    failed = HANDLER_REQUESTS.labels(func.__name__, 'error')
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception:
+                failed.inc()
+                raise
+            finally:
+                end = time.perf_counter()
+                latency.observe(end - start)
+                tracing.record(name, 'handler', start, end)
+            succeeded.inc()
+            return result
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            failed.inc()
+            raise
+        finally:
+            end = time.perf_counter()
+            latency.observe(end - start)
+            tracing.record(name, 'handler', start, end)
+        succeeded.inc()
+        return result
+    return wrapper
+
+
+def sql_timer(statement: str) -> _Timer:
+    """with sql_timer('имя'): ... - время запроса вместе с чтением строк."""
+    return SQL_LATENCY.labels(statement).time(f'sql {statement}', 'sql')
+
+
+class upstream_timer:
+    """Время и ошибки обращения к внешнему API."""
+    __slots__ = ('timer', 'errors')
+
+    def __init__(self, upstream: str, operation: str):
+        self.timer = UPSTREAM_LATENCY.labels(upstream, operation).time(
+            f'{upstream} {operation}', 'upstream')
+        self.errors = UPSTREAM_ERRORS.labels(upstream, operation)
+
+    def __enter__(self):
+        self.timer.__enter__()
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        self.timer.__exit__(exc_type, *exc_info)
+        if exc_type is not None:
+            self.errors.inc()
+        return False
+
+    def error(self) -> None:
+        """Отмечает ошибку, которая не привела к исключению."""
+        self.errors.inc()
+
+
+_telegram_session = requests.Session()
+
+
+def _timed_request(method, url, **kwargs):
+    name = url.rsplit('/', 1)[-1]
+    start = time.perf_counter()
+    try:
+        response = _telegram_session.request(method, url, **kwargs)
+    except Exception:
+        TELEGRAM_ERRORS.labels(name).inc()
+        raise
+    finally:
+        end = time.perf_counter()
+        TELEGRAM_LATENCY.labels(name).observe(end - start)
+        tracing.record(name, 'telegram', start, end)
+    if response.status_code != 200:
+        TELEGRAM_ERRORS.labels(name).inc()
+    return response
+
+
+def install_telegram_timing() -> None:
+    """Отправляет запросы синхронного TeleBot через замеряющую функцию."""
+    from telebot import apihelper
+    apihelper.CUSTOM_REQUEST_SENDER = _timed_request
+
+
+def install_async_telegram_timing() -> None:
+    """То же для AsyncTeleBot: оборачивает asyncio_helper._process_request."""
+    from telebot import asyncio_helper
+    process_request = asyncio_helper._process_request
+    if getattr(process_request, 'timed', False):
+        return
+
+    @functools.wraps(process_request)
+    async def timed(token, url, *args, **kwargs):
+        name = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            return await process_request(token, url, *args, **kwargs)
+        except Exception:
+            # Ответ не 200 asyncio_helper превращает в исключение.
+            TELEGRAM_ERRORS.labels(name).inc()
+            raise
+        finally:
+            end = time.perf_counter()
+            TELEGRAM_LATENCY.labels(name).observe(end - start)
+            tracing.record(name, 'telegram', start, end)
+
+    timed.timed = True
+    asyncio_helper._process_request = timed
+
+
+def start_metrics(host: str, port: int, dump_path: str = None,
+                  dump_interval: float = 60) -> list:
+    """Поднимает сервер /metrics (если port) и выгрузку в файл (если путь).
+
+    Возвращает запущенные объекты, у каждого есть stop().
+    """
+    started = []
+    if port:
+        server = MetricsServer(host, port)
+        server.start()
+        started.append(server)
+    if dump_path:
+        dumper = MetricsDumper(dump_path, dump_interval)
+        dumper.start()
+        started.append(dumper)
+    return started
+
+
+class MetricsServer:
+    """HTTP сервер, отдающий метрики по /metrics."""
+
+    def __init__(self, host: str, port: int):
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self) -> tuple:
+        return self._httpd.server_address
+
+    def _make_handler(self):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                payload = render().encode('utf-8')
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._httpd.serve_forever, name='metrics', daemon=True)
+            self._thread.start()
+            logging.info(f'Метрики доступны на {self.address}/metrics')
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread = None
+
+
+class MetricsDumper:
+    """Периодически записывает метрики в файл (атомарно, через замену)."""
+
+    def __init__(self, path: str, interval: float):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def dump(self) -> None:
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            file.write(render())
+        os.replace(temporary, self.path)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.dump()
+            except OSError as error:
+                logging.error(f'Ошибка записи метрик в {self.path}: {error}')
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='metrics-dump', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.dump()
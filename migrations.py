@@ -0,0 +1,152 @@
+"""
+Версионные миграции схемы базы.
+
+Номер примененной миграции хранится в PRAGMA user_version, поэтому
+повторный запуск ничего не меняет. Новые миграции добавляются
+только в конец списка MIGRATIONS.
+"""
+import sqlite3 as sq
+import log
+import logging
+
+# Пересчет суточных итогов из products, используется миграцией и rollup.py.
+DAILY_SPEND_BACKFILL = '''
+INSERT INTO daily_spend(login_id, category_id, day, total, count)
+SELECT login_id, category_id, date(created_at), SUM(price), COUNT(*)
+FROM products
+GROUP BY login_id, category_id, date(created_at)
+'''
+
+MIGRATIONS = [
+    # 1: индексы для выборок статистики по пользователю и периоду.
+    (
+        'CREATE INDEX IF NOT EXISTS idx_products_login_created '
+        'ON products(login_id, created_at)',
+        # Покрывающий индекс: статистика читается без обращения к таблице.
+        'CREATE INDEX IF NOT EXISTS idx_products_login_created_cover '
+        'ON products(login_id, created_at, category_id, price)',
+    ),
+    # 2: суточные итоги по пользователю и категории для статистики.
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS daily_spend(
+            login_id INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(login_id, day, category_id)
+        ) WITHOUT ROWID
+        ''',
+        # Триггер обновляет итоги в той же транзакции, что и вставка траты.
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_products_daily_spend
+        AFTER INSERT ON products
+        BEGIN
+            INSERT INTO daily_spend(login_id, category_id, day, total, count)
+            VALUES(NEW.login_id, NEW.category_id, date(NEW.created_at),
+                   NEW.price, 1)
+            ON CONFLICT(login_id, day, category_id) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1;
+        END
+        ''',
+        'DELETE FROM daily_spend',
+        DAILY_SPEND_BACKFILL,
+    ),
+    # 3: file_id котиков, уже загруженных в Telegram.
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS cat_files(
+            url TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            last_used DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_cat_files_last_used '
+        'ON cat_files(last_used)',
+    ),
+    # 4: сессии чатов, переживающие перезапуск бота.
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS sessions(
+            store TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY(store, chat_id)
+        )
+        ''',
+    ),
+    # 5: позиция массового импорта, чтобы продолжить его после сбоя.
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS imports(
+            source TEXT PRIMARY KEY,
+            login_id INTEGER NOT NULL,
+            position INTEGER NOT NULL DEFAULT 0,
+            imported INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ),
+    # 6: выученные категории названий трат, login_id = 0 - общий словарь.
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS category_memo(
+            login_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            category_id INTEGER NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY(login_id, title)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_category_memo_title '
+        'ON category_memo(title, category_id)',
+        # Смена категории траты переносит ее сумму в суточных итогах.
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_products_daily_spend_category
+        AFTER UPDATE OF category_id ON products
+        WHEN OLD.category_id != NEW.category_id
+        BEGIN
+            UPDATE daily_spend SET total = total - OLD.price, count = count - 1
+            WHERE login_id = OLD.login_id AND day = date(OLD.created_at)
+                AND category_id = OLD.category_id;
+            DELETE FROM daily_spend
+            WHERE login_id = OLD.login_id AND day = date(OLD.created_at)
+                AND category_id = OLD.category_id AND count <= 0;
+            INSERT INTO daily_spend(login_id, category_id, day, total, count)
+            VALUES(NEW.login_id, NEW.category_id, date(NEW.created_at),
+                   NEW.price, 1)
+            ON CONFLICT(login_id, day, category_id) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1;
+        END
+        ''',
+    ),
+]
+
+
+def get_version(con: sq.Connection) -> int:
+    """Возвращает номер последней примененной миграции."""
+    return con.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(con: sq.Connection) -> int:
+    """Применяет недостающие миграции и возвращает текущую версию схемы."""
+    version = get_version(con)
+    for number, statements in enumerate(MIGRATIONS[version:], version + 1):
+        try:
+            con.execute('BEGIN')
+            for statement in statements:
+                con.execute(statement)
+            con.execute(f'PRAGMA user_version = {number}')
+            con.commit()
+        except sq.Error as error:
+            con.rollback()
+            logging.error(f'Ошибка применения миграции {number}: {error}')
+            raise
+        logging.info(f'Применена миграция {number}')
+        version = number
+    return version
@@ -0,0 +1,258 @@
+"""
+Профилирование бота по команде администратора.
+
+/profile включает cProfile и/или tracemalloc на следующие N обновлений
+или на T секунд, после чего пишет файлы .pstats и снимок памяти
+в PROFILE_DIR и возвращает короткую сводку с top-N строками.
+
+Профилируется обработка обновлений в bot.py целиком, вместе с вызовами
+database, database_handler, data_income и cat_api. cProfile в одном
+процессе может работать только один, поэтому на время сеанса обновления
+обрабатываются по очереди: профиль точный, но шарды диспетчера не
+работают параллельно. Вне сеанса проверка стоит одно чтение атрибута.
+
+Формат команды:
+    /profile [cpu|mem|all] [N | Ts]   - /profile all 30s, /profile cpu 200
+    /profile stop                     - завершить сеанс досрочно
+"""
+import cProfile
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Optional
+
+import log
+import logging
+
+from config import (ADMIN_LOGINS, PROFILE_DIR, PROFILE_TOP,
+                    PROFILE_DEFAULT_UPDATES, PROFILE_MAX_UPDATES,
+                    PROFILE_MAX_SECONDS)
+
+MODES = {'cpu': (True, False), 'mem': (False, True), 'all': (True, True)}
+
+
+def is_admin(username: Optional[str]) -> bool:
+    return bool(username) and username in ADMIN_LOGINS
+
+
+def parse_profile_args(text: str) -> tuple[bool, bool, int, float]:
+    """'/profile all 30s' -> (cpu, memory, updates, seconds).
+
+    Ограничение задается либо числом обновлений, либо секундами,
+    второе тогда равно 0. Ошибки формата - ValueError.
+    """
+    cpu, memory = MODES['cpu']
+    updates, seconds = PROFILE_DEFAULT_UPDATES, 0.0
+    for arg in text.split()[1:]:
+        if arg in MODES:
+            cpu, memory = MODES[arg]
+        elif arg.endswith('s') and arg[:-1].isdigit():
+            updates, seconds = 0, float(arg[:-1])
+        elif arg.isdigit():
+            updates, seconds = int(arg), 0.0
+        else:
+            raise ValueError(f'Непонятный аргумент {arg}')
+    if seconds:
+        seconds = min(seconds, PROFILE_MAX_SECONDS)
+    elif updates:
+        updates = min(updates, PROFILE_MAX_UPDATES)
+    else:
+        raise ValueError('Нужно ненулевое число обновлений или секунд')
+    return cpu, memory, updates, seconds
+
+
+class ProfileSession:
+    """Один сеанс профилирования и его результаты."""
+
+    def __init__(self, chat_id: int, cpu: bool, memory: bool,
+                 updates: int, seconds: float):
+        self.chat_id = chat_id
+        self.profile = cProfile.Profile() if cpu else None
+        self.memory = memory
+        self.updates = updates
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.processed = 0
+        self.started = time.monotonic()
+        # Текст сводки, когда сеанс завершен
+        self.report = None
+        self._baseline = None
+        # Если tracemalloc уже запущен (PYTHONTRACEMALLOC), не останавливаем.
+        self._own_tracemalloc = False
+
+    def begin(self) -> None:
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._own_tracemalloc = True
+            self._baseline = tracemalloc.take_snapshot()
+
+    def expired(self) -> bool:
+        if self.deadline is not None:
+            return time.monotonic() >= self.deadline
+        return self.processed >= self.updates
+
+    def finish(self, directory: str, top: int) -> str:
+        """Пишет файлы результатов и возвращает текст сводки."""
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.join(directory, datetime.now().strftime(
+            f'profile-%Y%m%d-%H%M%S-{self.chat_id}'))
+        lines = [f'Профиль: {self.processed} обновлений за '
+                 f'{time.monotonic() - self.started:.1f} с']
+        # Снимок памяти делается первым, иначе в прирост попадет
+        # сохранение статистики cProfile.
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, cProfile.__file__),
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            if self._own_tracemalloc:
+                tracemalloc.stop()
+            path = f'{prefix}.snapshot'
+            snapshot.dump(path)
+            lines.append(f'\nПамять ({path}), прирост по строкам:')
+            lines.extend(memory_summary(snapshot, self._baseline, top))
+        if self.profile is not None:
+            self.profile.disable()
+            if self.processed:
+                path = f'{prefix}.pstats'
+                self.profile.dump_stats(path)
+                lines.append(f'\nCPU ({path}), по суммарному времени:')
+                lines.extend(cpu_summary(pstats.Stats(path), top))
+        return '\n'.join(lines)
+
+
+def _short_path(filename: str) -> str:
+    return os.path.basename(filename) if filename.startswith('/') else filename
+
+
+def cpu_summary(stats: pstats.Stats, top: int) -> list[str]:
+    stats.sort_stats(pstats.SortKey.CUMULATIVE)
+    lines = []
+    for func in stats.fcn_list[:top]:
+        _, calls, own, cumulative, _ = stats.stats[func]
+        filename, line, name = func
+        lines.append(
+            f'{cumulative * 1000:9.1f} мс {own * 1000:8.1f} мс {calls:7d} '
+            f'{_short_path(filename)}:{line}({name})')
+    return lines
+
+
+def memory_summary(snapshot: tracemalloc.Snapshot,
+                   baseline: tracemalloc.Snapshot, top: int) -> list[str]:
+    lines = []
+    for stat in snapshot.compare_to(baseline, 'lineno')[:top]:
+        frame = stat.traceback[0]
+        lines.append(
+            f'{stat.size_diff / 1024:+9.1f} КиБ {stat.count_diff:+7d} '
+            f'{_short_path(frame.filename)}:{frame.lineno}')
+    return lines
+
+
+class Profiler:
+    """Запускает сеансы и оборачивает обработку обновлений.
+
+    on_report(chat_id, text) вызывается по завершении сеанса, вне
+    блокировки, чтобы отправка сводки не задерживала обновления.
+    Сеанс, остановленный через stop() внутри run (/profile stop),
+    отчитывается, когда run отпустит блокировку.
+    """
+
+    def __init__(self, on_report: Callable[[int, str], None] = None,
+                 directory: str = PROFILE_DIR, top: int = PROFILE_TOP):
+        self.on_report = on_report
+        self.directory = directory
+        self.top = top
+        self._session = None
+        self._lock = threading.RLock()
+
+    @property
+    def active(self) -> bool:
+        return self._session is not None
+
+    def start(self, chat_id: int, cpu: bool, memory: bool, updates: int,
+              seconds: float) -> bool:
+        """Начинает сеанс, False - если другой сеанс еще идет."""
+        with self._lock:
+            if self._session is not None:
+                return False
+            session = ProfileSession(chat_id, cpu, memory, updates, seconds)
+            session.begin()
+            self._session = session
+        if seconds:
+            timer = threading.Timer(seconds, self._expire, (session,))
+            timer.daemon = True
+            timer.start()
+        logging.info(
+            f'Профилирование запущено: cpu={cpu}, memory={memory}, '
+            f'обновлений {updates}, секунд {seconds}')
+        return True
+
+    def stop(self) -> Optional[str]:
+        """Завершает текущий сеанс досрочно и возвращает сводку.
+
+        Сводка не отправляется через on_report: внутри run это сделает
+        run, None - если сеанса нет.
+        """
+        with self._lock:
+            session = self._session
+            if session is None:
+                return None
+            return self._finish(session)
+
+    def run(self, func: Callable, *args):
+        """Вызывает func(*args), под профилировщиком если идет сеанс."""
+        if self._session is None:
+            return func(*args)
+        report = None
+        try:
+            with self._lock:
+                session = self._session
+                if session is None:
+                    return func(*args)
+                if session.profile is not None:
+                    session.profile.enable()
+                try:
+                    return func(*args)
+                finally:
+                    if session.profile is not None:
+                        session.profile.disable()
+                    session.processed += 1
+                    if self._session is session and session.expired():
+                        report = self._finish(session)
+                    elif self._session is not session:
+                        # Сеанс завершил сам обработчик (/profile stop).
+                        report = session.report
+        finally:
+            if report is not None:
+                self._report(session, report)
+
+    def _expire(self, session: ProfileSession) -> None:
+        with self._lock:
+            if self._session is not session:
+                return
+            report = self._finish(session)
+        self._report(session, report)
+
+    def _finish(self, session: ProfileSession) -> str:
+        self._session = None
+        try:
+            report = session.finish(self.directory, self.top)
+        except Exception as error:
+            logging.error(f'Ошибка записи профиля: {error}')
+            report = f'Не удалось записать профиль: {error}'
+        session.report = report
+        logging.info(f'Профилирование завершено, {session.processed} обновлений')
+        return report
+
+    def _report(self, session: ProfileSession, report: str) -> None:
+        if self.on_report is None:
+            return
+        try:
+            self.on_report(session.chat_id, report)
+        except Exception as error:
+            logging.error(f'Ошибка отправки сводки профиля: {error}')
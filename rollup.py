@@ -0,0 +1,26 @@
+"""
+Пересборка суточных итогов daily_spend из таблицы products.
+
+Запуск: python rollup.py
+"""
+import log
+import logging
+
+from connection import writer
+from cache import stats_cache
+from migrations import DAILY_SPEND_BACKFILL
+
+
+def rebuild_daily_spend() -> int:
+    """Пересчитывает daily_spend целиком, возвращает число строк итогов."""
+    with writer() as con:
+        con.execute('DELETE FROM daily_spend')
+        con.execute(DAILY_SPEND_BACKFILL)
+        rows = con.execute('SELECT COUNT(*) FROM daily_spend').fetchone()[0]
+    stats_cache.clear()
+    logging.info(f'Суточные итоги пересобраны: {rows} строк')
+    return rows
+
+
+if __name__ == '__main__':
+    print(f'Суточные итоги пересобраны: {rebuild_daily_spend()} строк')
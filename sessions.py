@@ -0,0 +1,291 @@
+"""
+Хранилище сессий чатов вместо обычных словарей.
+
+Записи компактные (__slots__), каждая живет ограниченное время.
+Устаревшие записи удаляет фоновый поток по куче сроков истечения,
+при превышении max_size вытесняются записи с ближайшим сроком.
+Продление записи не добавляет элемент в кучу: старый элемент при
+разборе переносится на новый срок, так что куча не растет с каждым set.
+Доступ разбит на полосы с отдельными блокировками по chat_id.
+По желанию записи дублируются в таблицу sessions, чтобы пережить
+перезапуск бота.
+"""
+import heapq
+import json
+import sqlite3 as sq
+import threading
+import time
+
+import log
+import logging
+
+from config import (TIME_TO_CLEAR, SESSION_GRACE, SESSION_MAX_SIZE,
+                    SESSION_STRIPES, SESSION_SWEEP_INTERVAL, SESSION_PERSIST)
+from connection import writer, reader
+
+
+class UserSession:
+    """Сессия после /start: траты сохраняются, пока она активна."""
+    __slots__ = ('login', 'active', 'time')
+
+    def __init__(self, login, active=True, time=None):
+        self.login = login
+        self.active = active
+        self.time = time
+
+
+class StatsSession:
+    """Состояние выбора периода статистики."""
+    __slots__ = ('username', 'state')
+
+    def __init__(self, username, state):
+        self.username = username
+        self.state = state
+
+
+def _to_dict(record) -> dict:
+    return {name: getattr(record, name) for name in record.__slots__}
+
+
+class SessionStore:
+    """Ограниченное по размеру и времени хранилище записей по chat_id."""
+
+    def __init__(self, name: str, record_type: type, ttl: float,
+                 max_size: int = SESSION_MAX_SIZE,
+                 stripes: int = SESSION_STRIPES,
+                 persist: bool = SESSION_PERSIST):
+        self.name = name
+        self.record_type = record_type
+        self.ttl = ttl
+        self.max_size = max_size
+        self.persist = persist
+        self._stripes = [({}, threading.Lock()) for _ in range(stripes)]
+        # Куча (срок, chat_id); продленные записи переносятся при разборе,
+        # лишние элементы пропускаются.
+        self._heap = []
+        self._heap_lock = threading.Lock()
+        self._size = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def _stripe(self, chat_id: int):
+        return self._stripes[chat_id % len(self._stripes)]
+
+    def get(self, chat_id: int, default=None):
+        data, lock = self._stripe(chat_id)
+        with lock:
+            item = data.get(chat_id)
+            if item is None:
+                return default
+            if item[0] <= time.time():
+                return default
+            return item[1]
+
+    def __contains__(self, chat_id: int) -> bool:
+        return self.get(chat_id) is not None
+
+    def __getitem__(self, chat_id: int):
+        record = self.get(chat_id)
+        if record is None:
+            raise KeyError(chat_id)
+        return record
+
+    def __setitem__(self, chat_id: int, record) -> None:
+        self.set(chat_id, record)
+
+    def __delitem__(self, chat_id: int) -> None:
+        if self.pop(chat_id) is None:
+            raise KeyError(chat_id)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def set(self, chat_id: int, record, expires: float = None) -> None:
+        """Сохраняет запись со сроком жизни ttl."""
+        expires = expires or time.time() + self.ttl
+        data, lock = self._stripe(chat_id)
+        with lock:
+            item = data.get(chat_id)
+            if item is None:
+                with self._heap_lock:
+                    self._size += 1
+            data[chat_id] = (expires, record)
+        # Для продленной записи в куче уже есть элемент с более ранним
+        # сроком, _remove_if перенесет его.
+        if item is None or expires < item[0]:
+            with self._heap_lock:
+                heapq.heappush(self._heap, (expires, chat_id))
+        if self.persist:
+            self._save(chat_id, record, expires)
+        if self._size > self.max_size:
+            self._evict()
+
+    def update(self, chat_id: int, **fields):
+        """Меняет поля существующей записи, срок жизни не продлевается.
+
+        Возвращает запись или None, если ее нет или она уже истекла,
+        как get.
+        """
+        data, lock = self._stripe(chat_id)
+        with lock:
+            item = data.get(chat_id)
+            if item is None or item[0] <= time.time():
+                return None
+            expires, record = item
+            for name, value in fields.items():
+                setattr(record, name, value)
+        if self.persist:
+            self._save(chat_id, record, expires)
+        return record
+
+    def pop(self, chat_id: int, default=None):
+        data, lock = self._stripe(chat_id)
+        with lock:
+            item = data.pop(chat_id, None)
+            if item is not None:
+                with self._heap_lock:
+                    self._size -= 1
+        if item is None:
+            return default
+        if self.persist:
+            self._delete([chat_id])
+        return item[1]
+
+    def _remove_if(self, chat_id: int, expires: float) -> bool:
+        """Удаляет запись, только если ее срок не продлили после постановки в кучу.
+
+        Элемент продленной записи возвращается в кучу с новым сроком.
+        """
+        data, lock = self._stripe(chat_id)
+        with lock:
+            item = data.get(chat_id)
+            if item is None or item[0] < expires:
+                return False
+            if item[0] > expires:
+                with self._heap_lock:
+                    heapq.heappush(self._heap, (item[0], chat_id))
+                return False
+            del data[chat_id]
+            with self._heap_lock:
+                self._size -= 1
+        return True
+
+    def _evict(self) -> None:
+        """Вытесняет записи с ближайшим сроком, пока размер выше предела."""
+        removed = []
+        while self._size > self.max_size:
+            with self._heap_lock:
+                if not self._heap:
+                    break
+                expires, chat_id = heapq.heappop(self._heap)
+            if self._remove_if(chat_id, expires):
+                removed.append(chat_id)
+        self.evicted += len(removed)
+        if removed and self.persist:
+            self._delete(removed)
+
+    def sweep(self) -> int:
+        """Удаляет все истекшие записи, возвращает их число."""
+        now = time.time()
+        removed = []
+        while True:
+            with self._heap_lock:
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                expires, chat_id = heapq.heappop(self._heap)
+            if self._remove_if(chat_id, expires):
+                removed.append(chat_id)
+        self.expired += len(removed)
+        if removed and self.persist:
+            self._delete(removed)
+        return len(removed)
+
+    def _save(self, chat_id: int, record, expires: float) -> None:
+        try:
+            with writer() as con:
+                con.execute(
+                    'INSERT INTO sessions(store, chat_id, data, expires_at) '
+                    'VALUES(?, ?, ?, ?) ON CONFLICT(store, chat_id) DO UPDATE '
+                    'SET data = excluded.data, expires_at = excluded.expires_at',
+                    (self.name, chat_id,
+                     json.dumps(_to_dict(record), ensure_ascii=False), expires))
+        except sq.Error as error:
+            logging.error(f'Ошибка сохранения сессии {chat_id}: {error}')
+
+    def _delete(self, chat_ids: list) -> None:
+        try:
+            with writer() as con:
+                con.executemany(
+                    'DELETE FROM sessions WHERE store = ? AND chat_id = ?',
+                    [(self.name, chat_id) for chat_id in chat_ids])
+        except sq.Error as error:
+            logging.error(f'Ошибка удаления сессий: {error}')
+
+    def load(self) -> int:
+        """Восстанавливает не истекшие записи из таблицы sessions."""
+        with reader() as con:
+            rows = con.execute(
+                'SELECT chat_id, data, expires_at FROM sessions '
+                'WHERE store = ? AND expires_at > ?',
+                (self.name, time.time())).fetchall()
+        persist, self.persist = self.persist, False
+        try:
+            for chat_id, data, expires in rows:
+                self.set(chat_id, self.record_type(**json.loads(data)), expires)
+        finally:
+            self.persist = persist
+        logging.info(f'Восстановлено сессий {self.name}: {len(rows)}')
+        return len(rows)
+
+    def stats(self) -> dict:
+        return {
+            'size': self._size,
+            'max_size': self.max_size,
+            'expired': self.expired,
+            'evicted': self.evicted,
+        }
+
+
+class Sweeper:
+    """Фоновый поток, периодически вызывающий sweep у хранилищ."""
+
+    def __init__(self, stores: list, interval: float = SESSION_SWEEP_INTERVAL):
+        self.stores = stores
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='session-sweeper', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            for store in self.stores:
+                try:
+                    store.sweep()
+                except Exception as error:
+                    logging.error(f'Ошибка очистки сессий {store.name}: {error}')
+
+
+# Сессия хранится дольше TIME_TO_CLEAR на SESSION_GRACE, чтобы вернувшийся
+# пользователь получил сообщение о закрытии сессии.
+user_status = SessionStore('user_status', UserSession, TIME_TO_CLEAR + SESSION_GRACE)
+for_user_stats = SessionStore('for_user_stats', StatsSession, TIME_TO_CLEAR)
+sweeper = Sweeper([user_status, for_user_stats])
+
+
+def load_sessions() -> None:
+    """Восстанавливает сессии после перезапуска, если включено хранение."""
+    for store in (user_status, for_user_stats):
+        if store.persist:
+            store.load()
@@ -0,0 +1,127 @@
+"""Проверки CatPrefetcher и CircuitBreaker на локальной заглушке API."""
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from cat_api import CatPrefetcher, CircuitBreaker
+
+
+class StubCatApi(ThreadingHTTPServer):
+    """Отдает limit котиков или 500, пока failing=True."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.failing = False
+        self.limits = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address
+        return f'http://{host}:{port}/v1/images/search'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        limit = int(parse_qs(urlparse(self.path).query).get('limit', ['1'])[0])
+        with server.lock:
+            server.limits.append(limit)
+            number = len(server.limits)
+        if server.failing:
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = json.dumps([{'url': f'https://cats.test/{number}-{i}.jpg'}
+                           for i in range(limit)]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+class CatPrefetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = StubCatApi()
+        threading.Thread(target=self.api.serve_forever, daemon=True).start()
+        self.addCleanup(self.api.server_close)
+        self.addCleanup(self.api.shutdown)
+        self.http = requests.Session()
+        self.addCleanup(self.http.close)
+
+    def prefetcher(self, breaker: CircuitBreaker = None) -> CatPrefetcher:
+        return CatPrefetcher(
+            url=self.api.url, buffer_size=4, batch_size=4,
+            refill_interval=0.05, breaker=breaker or CircuitBreaker(2, 60),
+            http=self.http)
+
+    def test_refills_buffer_in_batches(self):
+        prefetcher = self.prefetcher()
+        prefetcher.start()
+        self.addCleanup(prefetcher.stop)
+        self.assertTrue(wait_for(lambda: len(prefetcher) == 4))
+        self.assertEqual(self.api.limits[0], 4)
+        urls = [prefetcher.get(direct=False) for _ in range(3)]
+        self.assertTrue(all(urls))
+        # Буфер ниже половины - фон дозапрашивает пачку.
+        self.assertTrue(wait_for(lambda: len(prefetcher) >= 2
+                                 and len(self.api.limits) >= 2))
+        self.assertEqual(self.api.limits[1], 4)
+
+    def test_breaker_opens_after_failures(self):
+        self.api.failing = True
+        prefetcher = self.prefetcher()
+        self.assertFalse(prefetcher.get())
+        self.assertFalse(prefetcher.get())
+        self.assertTrue(prefetcher.breaker.is_open)
+        # Открытый выключатель не пускает запросы к API.
+        self.assertFalse(prefetcher.get())
+        self.assertEqual(len(self.api.limits), 2)
+
+    def test_half_open_admits_single_probe(self):
+        self.api.failing = True
+        breaker = CircuitBreaker(2, 0.05)
+        prefetcher = self.prefetcher(breaker)
+        prefetcher.get()
+        prefetcher.get()
+        self.assertTrue(breaker.is_open)
+        time.sleep(0.1)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+        # Неудачная проба снова открывает выключатель на reset_timeout.
+        time.sleep(0.1)
+        self.api.failing = False
+        requests_before = len(self.api.limits)
+        self.assertTrue(prefetcher.get())
+        self.assertEqual(len(self.api.limits), requests_before + 1)
+        self.assertFalse(breaker.is_open)
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+
+if __name__ == '__main__':
+    unittest.main()
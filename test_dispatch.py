@@ -0,0 +1,71 @@
+"""Проверка раздачи обновлений polling режима по шардам bot.py."""
+import os
+import threading
+import time
+import unittest
+
+os.environ.setdefault('TOKEN', '123456:test')
+
+from telebot import apihelper
+
+import bot
+from loadtest import FakeBotApi
+
+CHATS = 5
+MESSAGES = 8
+
+
+def make_update(chat_id: int, text: str) -> dict:
+    return {'message': {
+        'message_id': 1, 'date': int(time.time()), 'text': text,
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'user'},
+    }}
+
+
+class PollingDispatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = FakeBotApi()
+        self.api.start()
+        self.addCleanup(self.api.stop)
+        api_url = apihelper.API_URL
+        apihelper.API_URL = self.api.api_url
+        self.addCleanup(setattr, apihelper, 'API_URL', api_url)
+        self.handled = []
+        self.lock = threading.Lock()
+        process = bot._process_new_updates
+        bot._process_new_updates = self.record
+        self.addCleanup(setattr, bot, '_process_new_updates', process)
+        bot.bot.last_update_id = 0
+        bot.dispatcher.start()
+        self.addCleanup(bot.dispatcher.stop)
+
+    def record(self, updates):
+        # Медленная обработка: шарды не успевают до следующего опроса.
+        time.sleep(0.02)
+        with self.lock:
+            self.handled.extend(update.update_id for update in updates)
+
+    def test_each_update_is_handled_once(self):
+        for number in range(MESSAGES):
+            for chat_id in range(1, CHATS + 1):
+                self.api.push_update(make_update(chat_id, f'кофе {number}'))
+        poller = threading.Thread(
+            target=bot.bot.polling,
+            kwargs={'non_stop': True, 'interval': 0, 'timeout': 1},
+            daemon=True)
+        poller.start()
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline and len(self.handled) < CHATS * MESSAGES:
+            time.sleep(0.05)
+        # Еще несколько опросов: повторов быть не должно.
+        time.sleep(0.3)
+        bot.bot.stop_polling()
+        poller.join(5)
+        self.assertEqual(sorted(self.handled),
+                         list(range(1, CHATS * MESSAGES + 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""Проверки WebhookServer через локальный клиент post_update."""
+import http.client
+import json
+import queue
+import unittest
+
+from webhook import SECRET_HEADER, WebhookServer, post_update
+
+SECRET = 'test-secret'
+UPDATE = {'update_id': 1, 'message': {'message_id': 1, 'text': 'мясо 100'}}
+
+
+class WebhookServerTest(unittest.TestCase):
+
+    def start_server(self, process=None) -> WebhookServer:
+        self.received = []
+        server = WebhookServer(
+            process or self.received.append, SECRET, port=0)
+        server.start()
+        self.addCleanup(server.stop)
+        host, port = server.address
+        self.url = f'http://{host}:{port}/'
+        return server
+
+    def raw_post(self, body: bytes, headers: dict) -> int:
+        host, port = self.server.address
+        connection = http.client.HTTPConnection(host, port, timeout=5)
+        self.addCleanup(connection.close)
+        connection.putrequest('POST', '/')
+        for name, value in headers.items():
+            connection.putheader(name, value)
+        connection.endheaders(body)
+        return connection.getresponse().status
+
+    def setUp(self):
+        self.server = self.start_server()
+
+    def test_valid_update_is_processed(self):
+        self.assertEqual(post_update(self.url, UPDATE, SECRET), 200)
+        # Обновление передается в process до ответа.
+        self.assertEqual(self.received, [UPDATE])
+        self.assertEqual(self.server.accepted, 1)
+
+    def test_updates_keep_arrival_order(self):
+        updates = [dict(UPDATE, update_id=number) for number in range(20)]
+        for update in updates:
+            self.assertEqual(post_update(self.url, update, SECRET), 200)
+        self.assertEqual(self.received, updates)
+
+    def test_wrong_or_missing_secret_is_forbidden(self):
+        self.assertEqual(post_update(self.url, UPDATE, 'wrong'), 403)
+        self.assertEqual(post_update(self.url, UPDATE), 403)
+        body = json.dumps(UPDATE).encode()
+        status = self.raw_post(body, {
+            SECRET_HEADER: 'секрет'.encode('utf-8'),
+            'Content-Length': str(len(body)),
+        })
+        self.assertEqual(status, 403)
+        self.assertEqual(self.received, [])
+
+    def test_bad_body_is_rejected(self):
+        body = b'{not json'
+        cases = [
+            (body, {'Content-Length': str(len(body))}),
+            (b'[1, 2]', {'Content-Length': '6'}),
+            (b'{}', {}),
+            (b'{}', {'Content-Length': 'abc'}),
+            (b'{}', {'Content-Length': '-1'}),
+            (b'{}', {'Content-Length': str(self.server.max_body + 1)}),
+        ]
+        for body, headers in cases:
+            with self.subTest(headers=headers, body=body):
+                status = self.raw_post(body, dict(headers, **{
+                    SECRET_HEADER: SECRET}))
+                self.assertEqual(status, 400)
+        self.assertEqual(self.received, [])
+
+    def test_full_queue_returns_503(self):
+        updates = queue.Queue(maxsize=1)
+        server = self.start_server(updates.put_nowait)
+        self.assertEqual(post_update(self.url, UPDATE, SECRET), 200)
+        self.assertEqual(post_update(self.url, UPDATE, SECRET), 503)
+        self.assertEqual(server.rejected, 1)
+
+    def test_process_error_is_acknowledged(self):
+        def process(update):
+            raise RuntimeError('ошибка обработчика')
+
+        server = self.start_server(process)
+        self.assertEqual(post_update(self.url, UPDATE, SECRET), 200)
+        self.assertEqual(server.accepted, 1)
+
+    def test_empty_secret_is_refused(self):
+        with self.assertRaises(ValueError):
+            WebhookServer(lambda update: None, '', port=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
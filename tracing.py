@@ -0,0 +1,257 @@
+"""
+Трассировка обработки обновлений.
+
+Для каждого входящего обновления создается трасса со своим trace_id,
+внутри нее записываются отрезки (span): классификация траты, каждый
+SQL запрос, обращения к API котиков и вызовы Bot API. Отрезки пишутся
+из тех же мест, что и метрики (metrics.py), поэтому отдельной разметки
+кода почти не нужно.
+
+Записываются не все трассы: доля TRACE_SAMPLE_RATE выбирается случайно,
+а обновления медленнее TRACE_SLOW_MS пишутся всегда. Файл в формате
+Chrome trace events (JSON массив) открывается в chrome://tracing или
+https://ui.perfetto.dev. Пока трассировка не включена, trace() и span()
+ничего не записывают.
+"""
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+from typing import Optional
+
+import logging
+
+_current = contextvars.ContextVar('trace', default=None)
+_ids = itertools.count(1)
+# Имена потоков по идентификатору, заполняются при записи отрезков
+_thread_names = {}
+# Отметки perf_counter переводятся в микросекунды от начала эпохи,
+# чтобы трассы разных запусков в одном файле не накладывались.
+_EPOCH_OFFSET = time.time() - time.perf_counter()
+# Маркер остановки потока записи
+_STOP = object()
+
+
+def _micros(moment: float) -> int:
+    return int((moment + _EPOCH_OFFSET) * 1000000)
+
+
+class Trace:
+    """Трасса одного обновления: отрезки копятся до ее завершения."""
+    __slots__ = ('trace_id', 'name', 'args', 'start', 'sampled', 'spans')
+
+    def __init__(self, name: str, args: dict, sampled: bool):
+        self.trace_id = f'{os.getpid():x}-{next(_ids):x}'
+        self.name = name
+        self.args = args
+        self.sampled = sampled
+        self.start = time.perf_counter()
+        # (имя, категория, начало, конец, поток, аргументы)
+        self.spans = []
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'category', 'args', 'start')
+
+    def __init__(self, trace: Trace, name: str, category: str, args: dict):
+        self.trace = trace
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.trace.spans.append((
+            self.name, self.category, self.start, time.perf_counter(),
+            threading.get_ident(), self.args))
+        return False
+
+
+class TraceWriter:
+    """Поток, дописывающий события в файл трассировки."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._threads_named = set()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='trace-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def put(self, events: list) -> None:
+        self._queue.put(events)
+
+    def _run(self) -> None:
+        with open(self.path, 'a', encoding='utf-8') as file:
+            # Закрывающая скобка не нужна: просмотрщики принимают
+            # незавершенный массив, так файл можно дописывать.
+            if file.tell() == 0:
+                file.write('[\n')
+            while True:
+                events = self._queue.get()
+                if events is _STOP:
+                    break
+                try:
+                    for event in self._thread_names(events) + events:
+                        file.write(json.dumps(event, ensure_ascii=False))
+                        file.write(',\n')
+                    file.flush()
+                except (OSError, TypeError, ValueError) as error:
+                    logging.error(f'Ошибка записи трассы в {self.path}: {error}')
+
+    def _thread_names(self, events: list) -> list:
+        """Метаданные с именами потоков, еще не встречавшихся в файле."""
+        names = []
+        for event in events:
+            tid = event['tid']
+            if tid not in self._threads_named:
+                self._threads_named.add(tid)
+                names.append({
+                    'name': 'thread_name', 'ph': 'M', 'pid': event['pid'],
+                    'tid': tid, 'args': {'name': _thread_names.get(tid, str(tid))},
+                })
+        return names
+
+
+class Tracer:
+    """Выборка трасс и передача записанных в TraceWriter."""
+
+    def __init__(self):
+        self.sample_rate = 0.0
+        self.slow_seconds = 0.0
+        self._writer = None
+        self._random = random.Random()
+        self.recorded = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._writer is not None
+
+    def start(self, path: Optional[str], sample_rate: float,
+              slow_ms: float) -> None:
+        """Включает трассировку в файл path (None - оставить выключенной)."""
+        if not path or self.enabled:
+            return
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_ms / 1000
+        self._writer = TraceWriter(path)
+        self._writer.start()
+        logging.info(
+            f'Трассировка в {path}: доля {sample_rate}, '
+            f'медленные от {slow_ms} мс')
+
+    def stop(self) -> None:
+        if self._writer is not None:
+            writer, self._writer = self._writer, None
+            writer.stop()
+
+    @contextlib.contextmanager
+    def trace(self, name: str, **args):
+        """with tracer.trace('update', chat_id=...): - трасса обновления."""
+        if not self.enabled or _current.get() is not None:
+            yield _current.get()
+            return
+        current = Trace(name, args,
+                        self._random.random() < self.sample_rate)
+        token = _current.set(current)
+        try:
+            yield current
+        finally:
+            _current.reset(token)
+            self._finish(current, time.perf_counter())
+
+    def _finish(self, current: Trace, end: float) -> None:
+        slow = end - current.start >= self.slow_seconds
+        writer = self._writer
+        if writer is None or not (current.sampled or slow):
+            self.dropped += 1
+            return
+        self.recorded += 1
+        pid = os.getpid()
+        tid = threading.get_ident()
+        _remember_thread()
+        root_args = dict(current.args, trace_id=current.trace_id,
+                         sampled=current.sampled, slow=slow)
+        events = [{
+            'name': current.name, 'cat': 'update', 'ph': 'X',
+            'ts': _micros(current.start),
+            'dur': int((end - current.start) * 1000000),
+            'pid': pid, 'tid': tid, 'args': root_args,
+        }]
+        for name, category, start, stop, span_tid, args in current.spans:
+            events.append({
+                'name': name, 'cat': category, 'ph': 'X',
+                'ts': _micros(start), 'dur': int((stop - start) * 1000000),
+                'pid': pid, 'tid': span_tid,
+                'args': dict(args, trace_id=current.trace_id),
+            })
+        writer.put(events)
+
+
+tracer = Tracer()
+trace = tracer.trace
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str, category: str = 'app', **args):
+    """with span('classify', 'parse'): - отрезок внутри текущей трассы."""
+    current = _current.get()
+    if current is None:
+        return _NO_SPAN
+    _remember_thread()
+    return _Span(current, name, category, args)
+
+
+def record(name: str, category: str, start: float, end: float,
+           **args) -> None:
+    """Добавляет уже замеренный отрезок (отметки perf_counter)."""
+    current = _current.get()
+    if current is None:
+        return
+    _remember_thread()
+    current.spans.append(
+        (name, category, start, end, threading.get_ident(), args))
+
+
+def current_trace_id() -> Optional[str]:
+    current = _current.get()
+    return current.trace_id if current is not None else None
+
+
+def _remember_thread() -> None:
+    tid = threading.get_ident()
+    if tid not in _thread_names:
+        _thread_names[tid] = threading.current_thread().name
@@ -0,0 +1,149 @@
+"""
+Прием обновлений Telegram через webhook вместо long polling.
+
+Локальный HTTP сервер принимает POST с обновлением, проверяет
+заголовок X-Telegram-Bot-Api-Secret-Token и сразу, до ответа, передает
+обновление в process. process должен только поставить обновление
+в очередь (шард диспетчера, цикл событий): своей очереди и пула потоков
+у сервера нет, поэтому обновления одного чата уходят в обработку
+в порядке прихода и не стоят в двух очередях подряд. Если process
+выбрасывает queue.Full, сервер отвечает 503 и Telegram повторит доставку.
+Без секретного токена сервер не запускается: иначе он принимал бы
+обновления от кого угодно.
+"""
+import hmac
+import json
+import queue
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+import log
+import logging
+
+from config import WEBHOOK_MAX_BODY
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """HTTP сервер webhook.
+
+    process получает обновление в виде словаря из JSON в потоке запроса.
+    """
+
+    def __init__(
+            self,
+            process: Callable[[dict], None],
+            secret: str,
+            host: str = '127.0.0.1',
+            port: int = 8443,
+            path: str = '/',
+            max_body: int = WEBHOOK_MAX_BODY):
+        if not secret:
+            raise ValueError('Для webhook нужен непустой секретный токен')
+        self.process = process
+        self.secret = secret.encode('utf-8')
+        self.max_body = max_body
+        self.path = path
+        self._thread = None
+        self.accepted = 0
+        self.rejected = 0
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+
+    @property
+    def address(self) -> tuple:
+        return self._httpd.server_address
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                # Заголовки разобраны как latin-1, обратное кодирование
+                # дает исходные байты и не падает на не-ASCII токене.
+                token = self.headers.get(SECRET_HEADER, '').encode('latin-1')
+                if not hmac.compare_digest(token, server.secret):
+                    logging.warning('Webhook: неверный секретный токен')
+                    self.send_response(403)
+                    self.end_headers()
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', ''))
+                    if not 0 <= length <= server.max_body:
+                        raise ValueError(f'недопустимая длина {length}')
+                    update = json.loads(self.rfile.read(length))
+                    if not isinstance(update, dict):
+                        raise ValueError('обновление должно быть объектом')
+                except ValueError as error:
+                    logging.warning(f'Webhook: неверный запрос: {error}')
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+                try:
+                    server.process(update)
+                except queue.Full:
+                    server.rejected += 1
+                    logging.warning('Webhook: очередь обновлений заполнена')
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                except Exception as error:
+                    # Повтор доставки не поможет: отвечаем 200, как polling.
+                    logging.error(f'Ошибка обработки обновления: {error}')
+                server.accepted += 1
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logging.debug(f'Webhook: {format % args}')
+
+        return Handler
+
+    def start(self) -> None:
+        """Запускает HTTP сервер в фоне."""
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name='webhook-http', daemon=True)
+        self._thread.start()
+        logging.info(f'Webhook сервер слушает {self.address}')
+
+    def serve_forever(self) -> None:
+        """Запускает сервер и блокируется до остановки."""
+        self.start()
+        try:
+            self._thread.join()
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        """Останавливает прием обновлений."""
+        if self._thread is None:
+            return
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+        self._thread = None
+        logging.info('Webhook сервер остановлен')
+
+
+def post_update(url: str, update: dict, secret: str = '') -> int:
+    """Отправляет обновление на webhook, как это делает Telegram.
+
+    Используется локальными тестовыми клиентами, возвращает HTTP статус.
+    """
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode('utf-8'),
+        headers={'Content-Type': 'application/json', SECRET_HEADER: secret},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
@@ -0,0 +1,150 @@
+"""
+Отложенная запись трат пачками.
+
+Обработчик кладет распарсенную запись в очередь и сразу отвечает
+пользователю, а отдельный поток пишет накопившиеся записи одной
+транзакцией через executemany. Если пачка не записалась, записи
+каждого сообщения повторяются отдельной транзакцией, и об ошибке
+узнают только чаты, чьи записи так и не легли в базу. Id записанных
+трат дописываются в список, переданный с сообщением, - по ним кнопки
+смены категории находят свою трату.
+"""
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+import log
+import logging
+
+from config import (WRITE_BATCH_SIZE, WRITE_MAX_LATENCY,
+                    WRITE_QUEUE_SIZE, WRITE_PUT_TIMEOUT)
+from database import insert_parsed_many
+
+# Маркер остановки потока записи
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """Ограниченная очередь записей с потоком-писателем.
+
+    Пачка сбрасывается при наборе batch_size записей или через
+    max_latency секунд после первой записи пачки. Если очередь
+    заполнена, submit ждет put_timeout секунд и выбрасывает queue.Full.
+    """
+
+    def __init__(
+            self,
+            on_error: Optional[Callable[[int, Exception], None]] = None,
+            batch_size: int = WRITE_BATCH_SIZE,
+            max_latency: float = WRITE_MAX_LATENCY,
+            maxsize: int = WRITE_QUEUE_SIZE,
+            put_timeout: float = WRITE_PUT_TIMEOUT,
+            insert: Callable[[list, list], int] = insert_parsed_many):
+        self.on_error = on_error
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.put_timeout = put_timeout
+        self._insert = insert
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self.written = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        """Запускает поток записи."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+            logging.info('Поток отложенной записи запущен')
+
+    def submit(self, chat_id: int, record: tuple) -> None:
+        """Ставит запись из data_parse в очередь на запись."""
+        self.submit_many(chat_id, [record])
+
+    def submit_many(self, chat_id: int, records: list,
+                    product_ids: list = None) -> None:
+        """Ставит записи одного сообщения, они попадут в одну пачку.
+
+        После записи в product_ids дописываются id трат. Запись без
+        логина не ставится: она уронила бы всю пачку.
+        """
+        if any(not record[0] for record in records):
+            raise ValueError('Запись без логина')
+        self._queue.put((chat_id, records, product_ids),
+                        timeout=self.put_timeout)
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def stop(self) -> None:
+        """Дописывает все, что осталось в очереди, и останавливает поток."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        logging.info(
+            f'Поток отложенной записи остановлен, записано: {self.written}')
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = (self._queue.get(timeout=timeout) if timeout > 0
+                            else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+    def _flush(self, batch: list) -> None:
+        try:
+            product_ids = []
+            self.written += self._insert(
+                [record for _, records, _ in batch for record in records],
+                product_ids)
+            start = 0
+            for _, records, ids in batch:
+                if ids is not None:
+                    ids.extend(product_ids[start:start + len(records)])
+                start += len(records)
+            return
+        except Exception as error:
+            if len(batch) == 1:
+                self._failed(batch[0], error)
+                return
+            logging.error(
+                f'Ошибка записи пачки из {len(batch)} сообщений, '
+                f'записываем по одному: {error}')
+        # Одна плохая запись не должна откатывать чужие траты.
+        for item in batch:
+            try:
+                self.written += self._insert(item[1], item[2])
+            except Exception as error:
+                self._failed(item, error)
+
+    def _failed(self, item: tuple, error: Exception) -> None:
+        chat_id, records, _ = item
+        self.failed += len(records)
+        logging.error(
+            f'Ошибка записи {len(records)} записей чата {chat_id}: {error}')
+        if self.on_error is None:
+            return
+        try:
+            self.on_error(chat_id, error)
+        except Exception as notify_error:
+            logging.error(
+                f'Не удалось сообщить об ошибке в чат {chat_id}: '
+                f'{notify_error}')